@@ -0,0 +1,95 @@
+# ==================================================================================
+#  Copyright (c) 2020 HCL Technologies Limited.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+# ==================================================================================
+
+
+"""
+Detector comparison on the same generated data.
+
+The isolation forest picked by ModelTraining.isoforest and the built-in
+detectors (detectors.DETECTORS) are fitted on one preprocessed dataset and
+scored on the same test split. For each detector the fit time, the batch and
+single sample scoring latency, the online update cost and the macro F1 score
+are reported and written to detectors.csv.
+
+    python benchmarks/bench_detectors.py
+    python benchmarks/bench_detectors.py --rows 32000 --width 20
+"""
+
+import argparse
+import csv
+import sys
+import time
+import numpy as np
+from bench_training import generate
+
+
+def timed(run, repeat):
+    """ Best wall time of repeat runs in seconds """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the AD detectors on the same data")
+    parser.add_argument('--rows', type=int, default=8000)
+    parser.add_argument('--width', type=int, default=5)
+    parser.add_argument('--iterations', type=int, default=3, help="hyper parameter settings sampled by isoforest")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', default='detectors.csv')
+    args = parser.parse_args()
+
+    import detectors
+    from ad_train import ModelTraining
+    from processing import PREPROCESS
+    from tests.conftest import FrameDB
+    mt = ModelTraining(FrameDB(generate(args.rows, args.width), label='Viavi.UE.anomalies'))
+    ps = PREPROCESS(mt.train_data)
+    ps.process()
+    mt.train_data = ps.data
+    mt.actual = (mt.test_data['Viavi.UE.anomalies'] > 0).astype(int)
+    ps = PREPROCESS(mt.test_data[list(mt.train_data.columns)])
+    ps.transform()
+    mt.test_data = ps.data
+    X = mt.test_data.values.astype(np.float32)
+
+    fits = {'isoforest': lambda: mt.isoforest(n_iter=args.iterations)[1]}
+    fits.update((name, lambda name=name: detectors.create(name).fit(mt.train_data.values)) for name in detectors.DETECTORS)
+    results = []
+    for name, fit in fits.items():
+        start = time.perf_counter()
+        model = fit()
+        fitted = time.perf_counter() - start
+        batch = timed(lambda: model.predict(X), args.repeat)
+        single = timed(lambda: [model.predict(X[i:i + 1]) for i in range(min(200, len(X)))], args.repeat) / min(200, len(X))
+        update = timed(lambda: model.update(X), args.repeat) / len(X) if getattr(model, 'online', False) else float('nan')
+        results.append({'detector': name, 'fit_s': fitted, 'batch_us': batch / len(X) * 1e6, 'single_us': single * 1e6,
+                        'update_us': update * 1e6, 'f1': mt.validate(model, mt.test_data)})
+        print('{detector:>10}  fit {fit_s:8.3f}s  batch {batch_us:8.2f}us/sample  single {single_us:9.1f}us  '
+              'update {update_us:6.2f}us/sample  F1 {f1:.3f}'.format(**results[-1]))
+
+    with open(args.output, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(results[0]))
+        writer.writeheader()
+        writer.writerows(results)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
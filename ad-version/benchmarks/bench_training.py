@@ -0,0 +1,189 @@
+# ==================================================================================
+#  Copyright (c) 2020 HCL Technologies Limited.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+# ==================================================================================
+
+"""
+Scaling benchmarks of the training stages.
+
+PREPROCESS.process, ModelTraining.isoforest and ModelTraining.validate are run
+on generated datasets of increasing size (rows) and width (feature columns).
+Every measurement runs in a fresh subprocess in a temporary working directory
+and records wall time, peak RSS growth and the peak of traced allocations
+(tracemalloc, measured in a second run so it does not distort the timing).
+
+Results are written to scaling.csv with the fitted time exponent per stage and
+compared with baseline.json; the run fails when a stage is slower or allocates
+more than the tolerance allows.
+
+    python benchmarks/bench_training.py                     # compare with the baseline
+    python benchmarks/bench_training.py --update-baseline   # store the current results
+"""
+
+import argparse
+import csv
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+STAGES = ('process', 'isoforest', 'validate')
+FEATURES = ['DRB.UEThpDl', 'RF.serving.RSRP', 'RF.serving.RSRQ', 'RF.serving.RSSINR', 'RRU.PrbUsedDl']
+
+
+def generate(rows, width, seed=4):
+    """ UE samples with width feature columns, 5% labelled anomalous """
+    rng = np.random.default_rng(seed)
+    cols = FEATURES + ['f{}'.format(i) for i in range(max(0, width - len(FEATURES)))]
+    df = pd.DataFrame(rng.normal(50, 10, size=(rows, len(cols))), columns=cols[:max(width, len(FEATURES))])
+    anomalous = rng.random(rows) < 0.05
+    df.loc[anomalous, 'DRB.UEThpDl'] *= 0.1
+    df['ue-id'] = ['Car-{}'.format(i % 100) for i in range(rows)]
+    df['Viavi.UE.anomalies'] = anomalous.astype(int)
+    return df
+
+
+def prepare(stage, rows, width, n_iter):
+    """ Set up everything the stage needs and return it as a callable """
+    from ad_train import ModelTraining
+    from processing import PREPROCESS
+    from tests.conftest import FrameDB
+    df = generate(rows, width)
+    if stage == 'process':
+        return PREPROCESS(df.drop(columns=['Viavi.UE.anomalies']).copy()).process
+    mt = ModelTraining(FrameDB(df, label='Viavi.UE.anomalies'))
+    ps = PREPROCESS(mt.train_data)
+    ps.process()
+    mt.train_data = ps.data
+    mt.actual = (mt.test_data['Viavi.UE.anomalies'] > 0).astype(int)
+    ps = PREPROCESS(mt.test_data[list(mt.train_data.columns)])
+    ps.transform()
+    mt.test_data = ps.data
+    if stage == 'isoforest':
+        return lambda: mt.isoforest(n_iter=n_iter)
+    _, model = mt.isoforest(n_iter=1)
+    return lambda: mt.validate(model, mt.test_data)
+
+
+def measure(stage, rows, width, n_iter):
+    """ Run one stage in this process and return its measurements """
+    run = prepare(stage, rows, width, n_iter)
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    run()
+    wall = time.perf_counter() - start
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss
+    run = prepare(stage, rows, width, n_iter)
+    tracemalloc.start()
+    run()
+    _, peak_alloc = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'stage': stage, 'rows': rows, 'width': width, 'wall_s': wall, 'peak_rss_kb': peak_rss, 'peak_alloc_kb': peak_alloc // 1024}
+
+
+def child(stage, rows, width, n_iter):
+    """ Measure in a fresh interpreter inside an empty working directory """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([os.path.join(ROOT, 'src'), ROOT, os.environ.get('PYTHONPATH', '')]))
+    with tempfile.TemporaryDirectory() as cwd:
+        os.mkdir(os.path.join(cwd, 'src'))
+        out = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', stage, str(rows), str(width), '--iterations', str(n_iter)],
+                             cwd=cwd, env=env, check=True, capture_output=True, text=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def exponent(results, stage, width):
+    """ Slope of log(wall time) over log(rows), 1 means linear scaling """
+    points = [(r['rows'], r['wall_s']) for r in results if r['stage'] == stage and r['width'] == width and r['wall_s'] > 0]
+    if len(points) < 2:
+        return float('nan')
+    x, y = np.log([p[0] for p in points]), np.log([p[1] for p in points])
+    return float(np.polyfit(x, y, 1)[0])
+
+
+def compare(results, baseline, tolerance, floor):
+    """ Regressions of wall time and allocations beyond tolerance (relative), ignoring times below floor seconds """
+    stored = {(b['stage'], b['rows'], b['width']): b for b in baseline}
+    failures = []
+    for r in results:
+        b = stored.get((r['stage'], r['rows'], r['width']))
+        if b is None:
+            continue
+        if r['wall_s'] > floor and r['wall_s'] > b['wall_s'] * (1 + tolerance):
+            failures.append('{stage} rows={rows} width={width}: {wall_s:.3f}s'.format(**r) + ' vs {:.3f}s'.format(b['wall_s']))
+        if r['peak_alloc_kb'] > b['peak_alloc_kb'] * (1 + tolerance) + 1024:
+            failures.append('{stage} rows={rows} width={width}: {peak_alloc_kb} KiB'.format(**r) + ' vs {} KiB allocated'.format(b['peak_alloc_kb']))
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scaling benchmarks of the AD training stages")
+    parser.add_argument('--sizes', default='2000,8000,32000', help="comma separated row counts")
+    parser.add_argument('--widths', default='5,20', help="comma separated feature column counts")
+    parser.add_argument('--stages', default=','.join(STAGES))
+    parser.add_argument('--iterations', type=int, default=3, help="hyper parameter settings sampled by isoforest")
+    parser.add_argument('--baseline', default=os.path.join(HERE, 'baseline.json'))
+    parser.add_argument('--output', default='scaling.csv')
+    parser.add_argument('--tolerance', type=float, default=0.5, help="allowed relative regression (default 0.5)")
+    parser.add_argument('--floor', type=float, default=0.05, help="wall times below this many seconds are not compared")
+    parser.add_argument('--update-baseline', action='store_true')
+    parser.add_argument('--child', nargs=3, metavar=('STAGE', 'ROWS', 'WIDTH'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        stage, rows, width = args.child
+        print(json.dumps(measure(stage, int(rows), int(width), args.iterations)))
+        return 0
+
+    sizes = [int(s) for s in args.sizes.split(',')]
+    widths = [int(w) for w in args.widths.split(',')]
+    stages = args.stages.split(',')
+    results = []
+    for stage in stages:
+        for width in widths:
+            for rows in sizes:
+                r = child(stage, rows, width, args.iterations)
+                results.append(r)
+                print('{stage:>10} rows={rows:>7} width={width:>3}  {wall_s:8.3f}s  rss +{peak_rss_kb:>8} KiB  alloc {peak_alloc_kb:>8} KiB'.format(**r))
+            print('{:>10} width={:>3}  time ~ rows^{:.2f}'.format(stage, width, exponent(results, stage, width)))
+
+    with open(args.output, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(results[0]))
+        writer.writeheader()
+        writer.writerows(results)
+
+    if args.update_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=1)
+        print('Baseline written to {}'.format(args.baseline))
+        return 0
+    if not os.path.isfile(args.baseline):
+        print('No baseline in {}, run with --update-baseline'.format(args.baseline))
+        return 0
+    with open(args.baseline) as f:
+        failures = compare(results, json.load(f), args.tolerance, args.floor)
+    for failure in failures:
+        print('REGRESSION ' + failure)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
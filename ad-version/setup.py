@@ -22,8 +22,8 @@ setup(
     packages=find_packages(exclude=["tests.*", "tests"]),
     description="Anomaly Detection xApp that integrates with Traffic Steering",
     url="https://gerrit.o-ran-sc.org/r/admin/repos/ric-app/ad",
-    install_requires=["ricxappframe==3.2.2", "pandas>=1.1.3", "joblib>=0.3.2", "Scikit-learn>=0.18", "mdclogpy<=1.1.1", "schedule>=0.0.0", "influxdb-client"],
-    entry_points={"console_scripts": ["run-src.py=src.main:start"]},  # adds a magical entrypoint for Docker
+    install_requires=["ricxappframe==3.2.2", "pandas>=1.1.3", "joblib>=0.3.2", "scikit-learn>=1.3,<1.10", "mdclogpy<=1.1.1", "schedule>=0.0.0", "influxdb-client"],
+    entry_points={"console_scripts": ["run-src.py=src.main:start", "backfill-src.py=src.backfill:start"]},  # adds a magical entrypoint for Docker
     license="Apache 2.0",
     data_files=[("", ["LICENSE.txt"])],
 )
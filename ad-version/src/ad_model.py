@@ -14,179 +14,478 @@
 #  limitations under the License.
 # ==================================================================================
 
+import copy
+import os
+import time
+from collections import OrderedDict
 import joblib
 from mdclogpy import Logger
-from influxdb_client.client.query_api import QueryApi
-import pandas as pd 
+import pandas as pd
 import numpy as np
+from sklearn.preprocessing import Normalizer
 
 
 logger = Logger(name=__name__)
 
+# degradation labels indexed by bit mask: 1 Throughput, 2 RSRP, 4 RSRQ
+DEGRADATIONS = ['', 'Throughput', 'RSRP', 'Throughput RSRP', 'RSRQ', 'Throughput RSRQ', 'RSRP RSRQ', 'Throughput RSRP RSRQ']
+DEGRADATION = pd.CategoricalDtype(DEGRADATIONS)
+
+
+class FeatureBatch(object):
+    r""" Array backed batch of model features that is reused across ticks.
+
+    The buffers are preallocated as float32 (the dtype the forest evaluates in)
+    and only grow when a tick carries more rows than seen before, so steady
+    state inference does not allocate per tick.
+
+    Parameters
+    ----------
+    columns: list
+        feature names in the order the model was trained on
+    capacity: int (default=1024)
+        number of rows to preallocate
+
+    Attributes
+    ----------
+    values: array
+        (capacity, n_features) float32 feature buffer
+    labels: array
+        (capacity,) int8 label buffer (1: anomalous, 0: normal)
+    size: int
+        number of valid rows of the current tick
+    """
+
+    def __init__(self, columns, capacity=1024):
+        self.columns = list(columns)
+        self.size = 0
+        self.allocate(capacity)
+
+    def allocate(self, capacity):
+        self.capacity = capacity
+        self.values = np.empty((capacity, len(self.columns)), dtype=np.float32)
+        self.labels = np.empty(capacity, dtype=np.int8)
+        self.norms = np.empty(capacity, dtype=np.float32)
+
+    def load(self, df):
+        """ Copy the feature columns of df into the buffer and return the filled view """
+        n = len(df)
+        if n > self.capacity:
+            self.allocate(1 << (n - 1).bit_length())
+        self.size = n
+        view = self.values[:n]
+        for j, col in enumerate(self.columns):
+            np.copyto(view[:, j], df[col].to_numpy(), casting='unsafe')
+        return view
+
+    @property
+    def view(self):
+        return self.values[:self.size]
+
+    def scale(self, scaler):
+        """ Apply the fitted transformer in place, l2 Normalizer is computed without temporaries """
+        view = self.view
+        if isinstance(scaler, Normalizer) and scaler.norm == 'l2':
+            norms = self.norms[:self.size]
+            np.einsum('ij,ij->i', view, view, out=norms)
+            np.sqrt(norms, out=norms)
+            norms[norms == 0] = 1
+            np.divide(view, norms[:, None], out=view)
+        else:
+            view[:] = scaler.transform(view)
+        return view
+
+    def predict(self, model):
+        """ Predict on the current view and return labels (1: anomalous, 0: normal) """
+        labels = self.labels[:self.size]
+        np.equal(model.predict(self.view), -1, out=labels, casting='unsafe')
+        return labels
+
+
+class ScoreCache(object):
+    r""" Bounded LRU of predicted labels keyed by the quantized scaled feature vector.
+
+    Rows whose scaled features round to the same grid point of size quantum
+    reuse the stored label, only the misses go through the forest. The cache is
+    bound to the signature of the model bundle it was filled with and is
+    cleared when a different bundle is bound.
+
+    Parameters
+    ----------
+    size: int
+        maximum number of cached feature vectors
+    quantum: float (default=1e-4)
+        grid size used to quantize the scaled features
+    """
+
+    def __init__(self, size, quantum=1e-4):
+        self.size = size
+        self.quantum = quantum
+        self.entries = OrderedDict()
+        self.signature = None
+        self.hits = 0
+        self.misses = 0
+        self.report = 10000
+
+    def bind(self, signature):
+        if signature != self.signature:
+            self.entries.clear()
+            self.signature = signature
+
+    def keys(self, view):
+        quantized = np.rint(view / self.quantum).astype(np.int32)
+        return [row.tobytes() for row in quantized]
+
+    def predict(self, batch, evaluate, cells=None):
+        """ Fill batch.labels from the cache and evaluate(rows, cells), return the labels of the current view """
+        view = batch.view
+        labels = batch.labels[:batch.size]
+        keys = self.keys(view)
+        if cells is not None:
+            keys = list(zip(cells, keys))
+        miss = []
+        for i, key in enumerate(keys):
+            label = self.entries.get(key)
+            if label is None:
+                miss.append(i)
+            else:
+                labels[i] = label
+                self.entries.move_to_end(key)
+        reported = (self.hits + self.misses) // self.report
+        self.hits += len(keys) - len(miss)
+        self.misses += len(miss)
+        if (self.hits + self.misses) // self.report > reported:
+            logger.debug("Score cache: {}".format(self.stats()))
+        if miss:
+            labels[miss] = evaluate(view[miss], None if cells is None else cells[miss])
+            for i in miss:
+                self.entries[keys[i]] = labels[i]
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+        return labels
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.entries),
+                'hit_ratio': self.hits / total if total else 0.0}
+
 
 class modelling(object):
     r""" Filter dataframe based on paramters that were used to train model
     use transormer to transform the data
     load model and predict the label(normal/anomalous)
 
+    The model is any detector following the scikit-learn outlier convention
+    (IsolationForest or one of detectors.DETECTORS), online detectors are
+    updated with every scored batch.
+
     Parameters:
     data:DataFrame
     """
 
-    def __init__(self, data=None):
+    def __init__(self, data=None, cache=None, path='src', drift=None, shared=None):
         self.data = data
-        self.load_model()
-        self.load_param()
-        self.load_scale()
-
+        self.batch = None
+        self.cache = cache
+        self.path = path
+        self.drift = drift
+        self.shared = shared
+        if shared is not None:
+            self.load_shared()
+        else:
+            self.load_model()
+            self.load_param()
+            self.load_scale()
+            self.load_cells()
+        if self.cache is not None:
+            self.cache.bind(self.signature())
+
+    def signature(self):
+        """ Identify the model bundle on disk by modification time and size of its files """
+        if self.shared is not None:
+            return ('shared', self.shared.name, self.shared.generation)
+        files = (os.path.join(self.path, f) for f in ('model', 'num_params', 'scale', 'cell_models'))
+        return tuple((os.stat(f).st_mtime_ns, os.stat(f).st_size) if os.path.isfile(f) else None for f in files)
+
+    def load_shared(self):
+        """ Serve the generation attached by a model_server.SharedModel instead of the files in path """
+        self.model = self.shared.model
+        self.scale = self.shared.scale
+        self.num = self.shared.num
+        self.batch = FeatureBatch(self.num)
+        self.partition = None
+        self.cell_models = {}
 
     def load_model(self):
         try:
-            with open('src/model', 'rb') as f:
+            with open(os.path.join(self.path, 'model'), 'rb') as f:
                 self.model = joblib.load(f)
         except FileNotFoundError:
             logger.error("Model Does not exsist")
 
     def load_param(self):
         try:
-            with open('src/num_params', 'rb') as f:
+            with open(os.path.join(self.path, 'num_params'), 'rb') as f:
                 self.num = joblib.load(f)
-
+            self.batch = FeatureBatch(self.num)
         except FileNotFoundError:
             logger.error("Parameter file does not exsist")
 
     def load_scale(self):
         try:
-            with open('src/scale', 'rb') as f:
+            with open(os.path.join(self.path, 'scale'), 'rb') as f:
                 self.scale = joblib.load(f)
         except FileNotFoundError:
             logger.error("Scale file does not exsist")
 
+    def load_cells(self):
+        """ Load the per partition models if the model was trained with [model] partition """
+        self.partition = None
+        self.cell_models = {}
+        path = os.path.join(self.path, 'cell_models')
+        if os.path.isfile(path):
+            with open(path, 'rb') as f:
+                bundle = joblib.load(f)
+            self.partition = bundle['partition']
+            self.cell_models = bundle['models']
+
+    def fork(self, cache=None, drift=None):
+        """ modelling serving the same loaded bundle with its own feature buffers, cache and
+        drift monitor, so pipeline contexts can score concurrently without loading the bundle
+        again. Online detectors are copied since they are updated by every prediction.
+        """
+        md = copy.copy(self)
+        md.batch = FeatureBatch(self.num) if self.ready() else None
+        md.cache = cache
+        md.drift = drift
+        if getattr(self.model, 'online', False):
+            md.model = copy.deepcopy(self.model)
+        if cache is not None:
+            cache.bind(self.signature())
+        return md
+
+    def ready(self):
+        return all(hasattr(self, attr) for attr in ('model', 'num', 'scale'))
+
+    def warmup(self, rows=256):
+        """ Run a synthetic batch through scaling and every forest so that the first real
+        tick does not pay one time costs (buffer allocation, lazy imports, thread pools).
+        """
+        frame = pd.DataFrame(np.ones((rows, len(self.num)), dtype=np.float32), columns=self.num)
+        self.batch.load(frame)
+        self.transformation()
+        self.evaluate(self.batch.view)
+        for model in self.cell_models.values():
+            model.predict(self.batch.view[:1])
+        self.batch.size = 0
+
     def transformation(self):
-        self.data = self.scale.transform(self.data)
+        self.data = self.batch.scale(self.scale)
+
+    def cells(self, df):
+        if not self.cell_models or self.partition not in df.columns:
+            return None
+        return df[self.partition].to_numpy()
+
+    def evaluate(self, view, cells=None):
+        """ Label the rows of view, each partition is evaluated by its own model in one call
+        and the rows of partitions without a model by the global model in one call.
+        """
+        if cells is None:
+            return self.model.predict(view) == -1
+        labels = np.empty(len(view), dtype=bool)
+        codes, uniques = pd.factorize(cells)
+        fallback = np.zeros(len(view), dtype=bool)
+        for code, cell in enumerate(uniques):
+            rows = codes == code
+            model = self.cell_models.get(cell)
+            if model is None:
+                fallback |= rows
+            else:
+                labels[rows] = model.predict(view[rows]) == -1
+        if fallback.any():
+            labels[fallback] = self.model.predict(view[fallback]) == -1
+        return labels
 
     def predict(self, df):
         """ Load the saved model and return predicted result.
         Parameters
         .........
-        name:str
-            name of model
+        df: DataFrame
+            samples that contain the trained parameters
 
         Return
         ......
-        pred:int
-            predict label on a given sample
+        pred: array
+            predicted label (1: anomalous, 0: normal) of each sample, the array
+            is a view on a reused buffer and is only valid until the next call
 
         """
-        self.data = df.loc[:, self.num]
+        self.data = self.batch.load(df)
         self.transformation()
-        pred = self.model.predict(self.data)
-        pred = [1 if p == -1 else 0 for p in pred]
-        return pred
+        if self.drift is not None:
+            self.drift.update(self.data)
+        cells = self.cells(df)
+        online = getattr(self.model, 'online', False)
+        if self.cache is not None and not online:
+            return self.cache.predict(self.batch, self.evaluate, cells)
+        if cells is None:
+            labels = self.batch.predict(self.model)
+        else:
+            labels = self.batch.labels[:self.batch.size]
+            labels[:] = self.evaluate(self.data, cells)
+        if online:
+            self.model.update(self.data)
+        return labels
 
 
 class CAUSE(object):
     r""""Rule basd method to find degradation type of anomalous sample
 
+    The anomalous rows are compared with the per UE baseline (maximum of the
+    stored samples of that UE) in one vectorized pass, the degradation type is
+    a bit mask (1: Throughput, 2: RSRP, 4: RSRQ) indexing DEGRADATIONS.
+
+    The baselines of all UEs that are not cached are aggregated by the server
+    in one query (DATABASE.baselines) over the last window, one row per UE.
+    Baselines are cached per UE for ttl seconds, UEs that degrade again within
+    that time are classified without querying them again. With a
+    rolling.RollingStore the baseline is the maximum of the UE's rolling
+    window instead and no query is made.
+
+    Parameters:
+    ttl: float (default=300)
+        seconds a UE baseline is reused, 0 disables the cache
+    rolling: RollingStore (default=None)
+        per UE windows of throughput, RSRP and RSRQ
+    window: str (default='20s')
+        look-back window of the baseline as a Flux duration
+    agg: str or float (default='max')
+        aggregate of the baseline, max, min, mean or a quantile between 0 and 1
+
     Attributes:
     normal:DataFrame
-        Dataframe that contains only normal sample
+        per UE baseline of the last call
+    baselines_cache: dict
+        UE -> (time fetched, [throughput, RSRP, RSRQ] or None if the UE has no history)
     """
 
-    def __init__(self):
-        self.normal = None
+    THROUGHPUT = 1
+    RSRP = 2
+    RSRQ = 4
 
-    def cause(self, df, db, threshold):
-        """ Filter normal data for a particular ue-id to compare with a given sample
-            Compare with normal data to find and return degradaton type
+    def __init__(self, ttl=300.0, rolling=None, window='20s', agg='max'):
+        self.normal = None
+        self.ttl = ttl
+        self.rolling = rolling
+        self.window = window
+        self.agg = agg
+        self.baselines_cache = {}
+        self.pruned_at = time.time()
+
+    def cause(self, df, db, threshold, base=None):
+        """ Find the degradation type of the anomalous samples of df
+
+        base (a DataFrame of throughput, RSRP and RSRQ with the index of df, e.g. from
+        windowed() for a backfilled time range) gives the baseline of every sample,
+        the recent baselines of the UEs are not used then.
+
+        Returns
+        -------
+        anomaly: array
+            int8 label per row, 2 if throughput degraded together with RSRP or RSRQ,
+            1 if one of them degraded, 0 if the sample is normal or no rule matched
+        degradation: array
+            int8 degradation bit mask per row
         """
-        sample = df.copy()
-        sample.index = range(len(sample))
-        for i in range(min(len(sample), 10)):
-            if sample.iloc[i]['Anomaly'] == 1:
-                db_ue = 'tag_key'  # Set this to the correct column name if needed
-                print("meas", db.meas)
-                print("db_ue", db_ue)
-                print("sample", sample)
-                print("sample.iloc[i]", sample.iloc[i])
-                print("sample.iloc[i][db_ue]", sample.iloc[i][db_ue])
-                print("db", db)
-
-                #default 20s
-                query = f"""
-                from(bucket: "{db.bucket}")
-                |> range(start: -240h)
-                |> filter(fn: (r) => r["_measurement"] == "{db.meas}" and r["{db_ue}"] == "{sample.iloc[i][db_ue]}")
-                |> pivot(rowKey:["_time"], columnKey: ["_field"], valueColumn: "_value")
-                """ 
-
-                print(query)  # Print the query to verify its correctness
-
-                normal = db.query(query)
-
-                print("print normal", normal)
-                print(normal.columns)
-
-                if normal is not None and not normal.empty:
-                    # Extract relevant columns from the 'normal' DataFrame
-                    print("db.meas", db.meas)
-                    normal = normal[[db.thpt, db.rsrp, db.rsrq]]
-                    normal = normal.dropna()
-
-                    print("normal 2", normal)
-                    # Find the degradation using the 'find' method
-                    print("threshold", threshold) 
-
-                    deg = self.find(sample.loc[i, :], normal.max(), db, threshold)
-
-                    if deg:
-                        # Set 'Degradation' value in the sample DataFrame
-                        sample.loc[i, 'Degradation'] = deg
-
-                        # Determine the 'Anomaly' type based on the degradation information
-                        if 'Throughput' in deg and ('RSRP' in deg or 'RSRQ' in deg):
-                            sample.loc[i, 'Anomaly'] = 2  # Both types of anomalies detected
-                        else:
-                            sample.loc[i, 'Anomaly'] = 1  # Only one type of anomaly detected
-                    else:
-                        # No degradation found
-                        sample.loc[i, 'Anomaly'] = 0
-
-                else:
-                    # Handle cases where 'normal' is None or empty
-                    sample.loc[i, 'Anomaly'] = 0
-
-        print("SAMPLE: ", sample)
-        return sample[['Anomaly', 'Degradation']].values.tolist()
-
-    def find(self, row, l, db, threshold):
-        """ Store if a particular parameter is below threshold and return """
-        deg = []
-        print("row", row)
-        print("thtpt", db.thpt)
-        print("rsrp", db.rsrp)
-        print("threshold", threshold)
-        
-        # Ensure row and l are Series and we are comparing individual elements
-        thpt_val = row[db.thpt].iloc[0] if isinstance(row[db.thpt], pd.Series) else row[db.thpt]
-        l_thpt_val = l[db.thpt].iloc[0] if isinstance(l[db.thpt], pd.Series) else l[db.thpt]
-        if thpt_val < l_thpt_val * (100 - threshold) * 0.01:
-            deg.append('Throughput')
-
-        rsrp_val = row[db.rsrp].iloc[0] if isinstance(row[db.rsrp], pd.Series) else row[db.rsrp]
-        l_rsrp_val = l[db.rsrp].iloc[0] if isinstance(l[db.rsrp], pd.Series) else l[db.rsrp]
-        if rsrp_val < l_rsrp_val - 15:
-            deg.append('RSRP')
-
-        rsrq_val = row[db.rsrq].iloc[0] if isinstance(row[db.rsrq], pd.Series) else row[db.rsrq]
-        l_rsrq_val = l[db.rsrq].iloc[0] if isinstance(l[db.rsrq], pd.Series) else l[db.rsrq]
-        if rsrq_val < l_rsrq_val - 10:
-            deg.append('RSRQ')
-        
-        if len(deg) == 0:
-            deg = False
+        anomaly = np.asarray(df['Anomaly'], dtype=np.int8).copy()
+        codes = np.zeros(len(df), dtype=np.int8)
+        rows = np.flatnonzero(anomaly == 1)
+        if len(rows) == 0:
+            return anomaly, codes
+        cols = [db.thpt, db.rsrp, db.rsrq]
+        ues = df[db.ue].to_numpy()[rows]
+        if base is not None:
+            base = base[cols].to_numpy(dtype=np.float64)[rows]
         else:
-            deg = ' '.join(deg)
-        return deg
-
-
+            if self.rolling is not None:
+                self.normal = self.recent(pd.unique(ues), cols)
+            else:
+                self.normal = self.baselines(pd.unique(ues), db)
+            base = self.normal.reindex(ues).to_numpy(dtype=np.float64)
+        values = df[cols].to_numpy(dtype=np.float64)[rows]
+        codes[rows] = self.find(values, base, threshold)
+        anomaly[rows] = np.where(codes[rows] == 0, 0, 1)
+        anomaly[rows[((codes[rows] & self.THROUGHPUT) > 0) & ((codes[rows] & (self.RSRP | self.RSRQ)) > 0)]] = 2
+        return anomaly, codes
+
+    def recent(self, ues, cols):
+        """ Maximum throughput, RSRP and RSRQ of the rolling window of each UE """
+        normal = self.rolling.get(ues)
+        return normal[['{}_max'.format(col) for col in cols]].set_axis(cols, axis=1)
+
+    def baselines(self, ues, db):
+        """ Throughput, RSRP and RSRQ baseline of each UE, the UEs that are not cached are aggregated
+        in one query. UEs without recent samples are left out (their rows are classified as normal).
+        """
+        cols = [db.thpt, db.rsrp, db.rsrq]
+        now = time.time()
+        if now - self.pruned_at > self.ttl:
+            self.baselines_cache = {ue: entry for ue, entry in self.baselines_cache.items() if now - entry[0] <= self.ttl}
+            self.pruned_at = now
+        missing = [ue for ue in ues if ue not in self.baselines_cache or now - self.baselines_cache[ue][0] > self.ttl]
+        fetched = self.history(missing, db, cols) if missing else None
+        if fetched is not None:
+            self.baselines_cache.update((ue, (now, fetched.get(str(ue)))) for ue in missing)
+        found = [ue for ue in ues if self.baselines_cache.get(ue, (0, None))[1] is not None]
+        values = [self.baselines_cache[ue][1] for ue in found]
+        return pd.DataFrame(values, index=found, columns=cols, dtype=np.float64)
+
+    def windowed(self, samples, times, db):
+        """ Baseline of every sample over the window that ends at its own time (Series times
+        with the index of samples), aggregated per UE over samples. samples must also hold
+        the samples of the window before the first one scored, e.g. of a backfilled range.
+
+        Returns
+        -------
+        DataFrame of throughput, RSRP and RSRQ with the index of samples
+        """
+        cols = [db.thpt, db.rsrp, db.rsrq]
+        frame = samples[cols].astype(np.float64).assign(_ue=samples[db.ue].astype(str), _time=pd.to_datetime(times, utc=True))
+        rolling = frame.sort_values('_time', kind='stable').groupby('_ue', sort=False).rolling(pd.Timedelta(self.window), on='_time')[cols]
+        normal = getattr(rolling, self.agg)() if self.agg in ('max', 'min', 'mean') else rolling.quantile(float(self.agg))
+        # indexed by (UE, time), the last of samples of a UE at the same time has seen all of them
+        normal = normal[~normal.index.duplicated(keep='last')]
+        keys = pd.MultiIndex.from_arrays([frame['_ue'], frame['_time']])
+        return pd.DataFrame(normal.reindex(keys).to_numpy(), index=samples.index, columns=cols)
+
+    def history(self, ues, db, cols):
+        """ Server side aggregate of the recent samples of ues, UE -> [throughput, RSRP, RSRQ],
+        None if the query failed (nothing is cached then).
+        """
+        try:
+            normal = db.baselines(ues, self.window, self.agg, cols)
+        except Exception as e:
+            logger.warning("Baselines unavailable: {}".format(e))
+            return None
+        normal = normal.dropna()
+        return {str(ue): row for ue, row in zip(normal.index, normal[cols].to_numpy().tolist())}
+
+    def export(self):
+        """ Cached baselines as a JSON serializable dict for checkpoints """
+        return {str(ue): [fetched, values] for ue, (fetched, values) in self.baselines_cache.items()}
+
+    def restore(self, cache):
+        """ Reuse the baselines of a checkpoint that have not expired yet """
+        now = time.time()
+        self.baselines_cache.update((ue, (fetched, values)) for ue, (fetched, values) in cache.items() if now - fetched <= self.ttl)
+
+    def find(self, values, base, threshold):
+        """ Degradation bit mask of each row of values (throughput, RSRP, RSRQ) against the
+        aligned baseline rows, NaN baselines never match.
+        """
+        codes = np.zeros(len(values), dtype=np.int8)
+        codes[values[:, 0] < base[:, 0] * (100 - threshold) * 0.01] |= self.THROUGHPUT
+        codes[values[:, 1] < base[:, 1] - 15] |= self.RSRP
+        codes[values[:, 2] < base[:, 2] - 10] |= self.RSRQ
+        return codes
@@ -14,17 +14,32 @@
 #  limitations under the License.
 # ==================================================================================
 
+import copy
+import os
+import shutil
+import tempfile
 import joblib
 import time
 import numpy as np
+import sklearn
+from configparser import ConfigParser
+from joblib import Parallel, delayed
 from processing import PREPROCESS
+from drift import save_stats
+import detectors
+from rolling import RollingStore
+from exceptions import DatabaseUnavailableError
 from sklearn.metrics import classification_report, f1_score
+from sklearn.base import clone
 from sklearn.ensemble import IsolationForest
 from sklearn.model_selection import RandomizedSearchCV
 from mdclogpy import Logger
 
 logger = Logger(name=__name__)
 
+# per tree state of a fitted IsolationForest that tree_depths and prune read and rewrite
+PRIVATE_FOREST_STATE = ('_decision_path_lengths', '_average_path_length_per_tree', '_seeds')
+
 
 class ModelTraining(object):
     r""" The modelling class takes input as dataframe or array and train Isolation Forest model
@@ -42,42 +57,81 @@ class ModelTraining(object):
         actual label for test data
     X: DataFrame or array
         transformed values of input data
+    path: str (default='src')
+        directory the trained model bundle is installed in
     """
-    def __init__(self, db):
+    def __init__(self, db, path='src'):
         self.db = db
+        self.path = path
+        self.out = path
         self.train_data = None
         self.test_data = None
         self.read_train()
         self.read_test()
 
+    def fetch(self, **kwargs):
+        """ Read data from the database, leaves db.data empty while InfluxDB is unavailable """
+        try:
+            self.db.read_data(**kwargs)
+        except DatabaseUnavailableError as e:
+            logger.warning("InfluxDB unavailable: {}".format(e))
+            self.db.data = None
+
+    def wait_for(self, rows, delay, **kwargs):
+        """ Poll the server side count of complete rows until at least rows are available.
+        The latest point of the measurement is checked first, the count is only queried again
+        once new points have arrived since the last one.
+        """
+        seen = None
+        count = 0
+        while True:
+            try:
+                latest = self.db.last_timestamps().get(self.db.meas)
+                if latest is None:
+                    count = 0
+                elif latest != seen:
+                    count = self.db.count_complete(**kwargs)
+                    seen = latest
+            except DatabaseUnavailableError as e:
+                logger.warning("InfluxDB unavailable: {}".format(e))
+                latest = None
+            if count >= rows:
+                return
+            if latest is None:
+                logger.warning("Waiting for data: no points in {}".format(self.db.meas))
+            else:
+                logger.warning("Waiting for data: {} of {} complete samples available".format(count, rows))
+            time.sleep(delay)
+
+    def complete(self, df):
+        """ Rows with every UE feature, as counted by count_complete """
+        return df.dropna(subset=self.db.features())
+
     def read_train(self):
-        self.db.read_data(train=True)
-        # self.db.read_data(train=False)
-        while self.db.data is None or len(self.db.data.dropna()) < 1000:
-            print("check data is none : ", self.db.data is None)
-            print("count data : ", len(self.db.data.dropna()))
-            
+        self.wait_for(1000, 120, train=True)
+        self.fetch(train=True)
+        while self.db.data is None or len(self.complete(self.db.data)) < 1000:
             logger.warning("Check if InfluxDB instance is up / Not sufficient data for Training")
             time.sleep(120)
-            self.db.read_data(train=True)
-            # self.db.read_data(train=False)
+            self.wait_for(1000, 120, train=True)
+            self.fetch(train=True)
 
         self.train_data = self.db.data
         logger.debug("Training on {} Samples".format(self.train_data.shape[0]))
 
     def read_test(self):
         """ Read test dataset for model validation"""
-        self.db.read_data(valid=True)
-        # self.db.read_data(valid=False)
-        while self.db.data is None or len(self.db.data.dropna()) < 300:
+        self.wait_for(300, 60, valid=True)
+        self.fetch(valid=True)
+        while self.db.data is None or len(self.complete(self.db.data)) < 300:
             logger.warning("Check if InfluxDB instance is up? or Not sufficient data for Validation in last 10 minutes")
             time.sleep(60)
-            self.db.read_data(valid=True)
-            # self.db.read_data(valid=False)
-        self.test_data = self.db.data.dropna()
+            self.wait_for(300, 60, valid=True)
+            self.fetch(valid=True)
+        self.test_data = self.complete(self.db.data)
         logger.debug("Validation on {} Samples".format(self.test_data.shape[0]))
 
-    def isoforest(self, outliers_fraction=0.05, random_state=4):
+    def isoforest(self, outliers_fraction=0.05, random_state=4, n_iter=50):
         """ Train isolation forest
 
         Parameters
@@ -87,16 +141,110 @@ class ModelTraining(object):
         push_model: boolean (default=False)
             return f_1 score if True else push model into repo
         random_state: int (default=42)
+        n_iter: int (default=50)
+            number of sampled hyper parameter settings
         """
         parameter = {'contamination': [of for of in np.arange(0.01, 0.5, 0.02)],
                      'n_estimators': [100*(i+1) for i in range(1, 10)],
                      'max_samples': [0.005, 0.01, 0.1, 0.15, 0.2, 0.3, 0.4]}
-        cv = [(slice(None), slice(None))]
+        self.config()
+        rows = np.arange(len(self.train_data))
+        cv = [(rows, rows)]
         iso = IsolationForest(random_state=random_state, bootstrap=True, warm_start=False)
-        model = RandomizedSearchCV(iso, parameter, scoring=self.validate, cv=cv, n_iter=50)
+        model = RandomizedSearchCV(iso, parameter, scoring=self.validate, cv=cv, n_iter=n_iter, random_state=random_state)
         md = model.fit(self.train_data.values)
-        f1 = self.validate(md.best_estimator_, self.test_data, True)
-        return f1, md.best_estimator_
+        best = self.select(md)
+        if self.prune:
+            best = self.prune_trees(best)
+        f1 = self.validate(best, self.test_data, True)
+        return f1, best
+
+    def select(self, search):
+        """ Pick the forest to serve among the candidates of the hyper parameter search.
+
+        Candidates are refitted in order of F1 and timed on a reference batch of
+        the test data. The cheapest candidate whose F1 is within f1_tolerance of
+        the best one is selected. With a latency budget, candidates over budget
+        are skipped, and if none within tolerance fits, the best F1 that fits is
+        taken instead.
+        """
+        results = search.cv_results_
+        scores = np.nan_to_num(np.asarray(results['mean_test_score'], dtype=np.float64), nan=-1.0)
+        order = np.argsort(-scores, kind='stable')
+        reference = np.asarray(self.test_data.values[:self.latency_rows], dtype=np.float32)
+        budget = self.latency_budget_ms / 1000.0
+        fits = lambda c: budget <= 0 or c['latency'] <= budget
+        candidates = []
+        seen = set()
+        for i in order:
+            params = results['params'][i]
+            key = tuple(sorted(params.items()))
+            if key in seen:
+                continue
+            seen.add(key)
+            within = scores[i] >= scores[order[0]] - self.f1_tolerance
+            if not within and any(fits(c) for c in candidates):
+                break
+            if i == search.best_index_:
+                model = search.best_estimator_
+            else:
+                model = clone(search.estimator).set_params(**params).fit(self.train_data.values)
+            candidates.append({'f1': scores[i], 'params': params, 'model': model, 'within': within,
+                               'latency': latency(model, reference)})
+            logger.info("Candidate {}: F1 {:.4f}, {:.2f} ms per {} samples".format(
+                params, scores[i], candidates[-1]['latency'] * 1000, len(reference)))
+        eligible = [c for c in candidates if c['within'] and fits(c)]
+        if eligible:
+            pick = min(eligible, key=lambda c: c['latency'])
+        elif any(fits(c) for c in candidates):
+            pick = [c for c in candidates if fits(c)][0]
+        else:
+            pick = min(candidates, key=lambda c: c['latency'])
+            logger.warning("No candidate within the latency budget of {} ms, serving the fastest".format(self.latency_budget_ms))
+        logger.info("Selected {}: F1 {:.4f} (best {:.4f}), {:.2f} ms per {} samples (best F1 candidate {:.2f} ms)".format(
+            pick['params'], pick['f1'], candidates[0]['f1'], pick['latency'] * 1000, len(reference), candidates[0]['latency'] * 1000))
+        return pick['model']
+
+    def prune_trees(self, model):
+        """ Drop the trees that follow the forest least (lowest correlation of their path lengths
+        with the forest's on the reference batch), halving the forest while its F1 stays within
+        prune_tolerance of the unpruned one and at least min_trees remain.
+
+        The path lengths cached per tree are private IsolationForest state of the scikit-learn
+        versions allowed by setup.py, the forest is kept as is if they are missing.
+        """
+        if not all(hasattr(model, attr) for attr in PRIVATE_FOREST_STATE):
+            logger.warning("Tree pruning is not supported with scikit-learn {}, forest kept as is".format(sklearn.__version__))
+            return model
+        reference = np.asarray(self.test_data.values[:self.latency_rows], dtype=np.float32)
+        depths = tree_depths(model, reference)
+        ensemble = depths.mean(axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            corr = np.array([np.corrcoef(d, ensemble)[0, 1] for d in depths])
+        ranked = np.argsort(-np.nan_to_num(corr, nan=-1.0), kind='stable')
+        f1 = self.validate(model, self.test_data)
+        best, best_f1 = model, f1
+        keep = len(ranked) // 2
+        while keep >= self.min_trees:
+            pruned = prune(copy.copy(model), np.sort(ranked[:keep]), self.train_data.values)
+            score = self.validate(pruned, self.test_data)
+            if score < f1 - self.prune_tolerance:
+                break
+            best, best_f1 = pruned, score
+            keep //= 2
+        logger.info("Pruned forest from {} to {} trees: F1 {:.4f} -> {:.4f}, {:.2f} -> {:.2f} ms per {} samples".format(
+            len(model.estimators_), len(best.estimators_), f1, best_f1, latency(model, reference) * 1000,
+            latency(best, reference) * 1000, len(reference)))
+        return best
+
+    def streaming(self, name):
+        """ Fit a built-in detector (see detectors.DETECTORS) on the training data """
+        params = {}
+        if name == 'zscore':
+            params = {'threshold': self.zscore_threshold, 'alpha': self.zscore_alpha}
+        model = detectors.create(name, **params).fit(self.train_data.values)
+        f1 = self.validate(model, self.test_data, True)
+        return f1, model
 
     def validate(self, model, test_data, report=False):
         pred = model.predict(self.test_data.values)
@@ -110,12 +258,31 @@ class ModelTraining(object):
 
     def train(self):
         """
-        Main function to perform training on input data
+        Main function to perform training on input data. The bundle is written to a
+        staging directory and installed in path once it is complete (see install).
         """
         logger.debug("Training Starts")
-        ps = PREPROCESS(self.train_data)
+        self.config()
+        staging = tempfile.mkdtemp(prefix='.bundle-', dir=self.path)
+        self.out = staging
+        try:
+            self.fit_bundle()
+            install(staging, self.path)
+        finally:
+            self.out = self.path
+            shutil.rmtree(staging, ignore_errors=True)
+        logger.info("Training Ends : ")
+
+    def fit_bundle(self):
+        """ Preprocess, fit and validate the model and write the bundle to out """
+        if self.rolling:
+            self.train_data = self.rolling_features(self.train_data)
+            self.test_data = self.rolling_features(self.test_data)
+        raw = self.train_data
+        ps = PREPROCESS(self.train_data, path=self.out)
         ps.process()
         self.train_data = ps.data
+        save_stats(self.train_data.values, os.path.join(self.out, 'feature_stats'))
         # Print column names from the DataFrame in your object
         print("Column names in self.test_data:")
         print(self.test_data.columns)
@@ -124,20 +291,150 @@ class ModelTraining(object):
         # Update column name to 'Viavi.UE.anomalies'
         self.actual = (self.test_data['Viavi.UE.anomalies'] > 0).astype(int)
 
-        num = joblib.load('src/num_params')
-        ps = PREPROCESS(self.test_data[num])
+        num = joblib.load(os.path.join(self.out, 'num_params'))
+        ps = PREPROCESS(self.test_data[num], path=self.out)
         ps.transform()
         self.test_data = ps.data
 
         scores = []
         models = []
 
-        logger.info("Training Isolation Forest")
-        f1, model = self.isoforest()
+        if self.detector == 'isoforest':
+            logger.info("Training Isolation Forest")
+            f1, model = self.isoforest()
+        else:
+            logger.info("Training {} detector".format(self.detector))
+            f1, model = self.streaming(self.detector)
         scores.append(f1)
         models.append(model)
 
         opt = scores.index(max(scores))
-        joblib.dump(models[opt], 'src/model')
+        joblib.dump(models[opt], os.path.join(self.out, 'model'))
         logger.info("Optimum f-score : {}".format(scores[opt]))
-        logger.info("Training Ends : ")
+        self.train_cells(models[opt], raw)
+
+    def rolling_features(self, data):
+        """ Add the per UE rolling statistics the served model sees with [rolling] model_features,
+        computed over the samples in time order.
+        """
+        db = self.db
+        store = RollingStore([db.thpt, db.rsrp, db.rsrq, db.rssinr, db.prb], window=self.window, max_ues=self.max_ues)
+        return store.augment(data.dropna(subset=store.features), db.ue)
+
+    def train_cells(self, model, raw, cells=None):
+        """ Train a smaller isolation forest per partition (e.g. ServingCellId) in parallel.
+
+        Partitions with fewer than min_cell_samples rows are served by the global model.
+        Passing cells retrains only those partitions and keeps the other saved models,
+        so a busy cell can be refreshed without a full retrain.
+
+        Parameters
+        ----------
+        model: IsolationForest
+            global model whose hyper parameters are reused
+        raw: DataFrame
+            training data before preprocessing, holds the partition column
+        cells: list (default=None)
+            partitions to retrain, all partitions if None
+        """
+        self.config()
+        target = os.path.join(self.out, 'cell_models')
+        if not self.partition or self.partition not in raw.columns or not isinstance(model, IsolationForest):
+            if os.path.isfile(target) and cells is None:
+                os.remove(target)
+            return
+        if len(self.train_data) != len(raw) or not self.train_data.index.equals(raw.index):
+            raw = raw.loc[self.train_data.index]
+        keys = raw[self.partition].to_numpy()
+        counts = raw[self.partition].value_counts()
+        eligible = [c for c in counts.index[counts >= self.min_cell_samples] if cells is None or c in cells]
+        params = model.get_params()
+        params['n_estimators'] = min(params['n_estimators'], self.cell_estimators)
+        X = self.train_data.values
+        fitted = Parallel(n_jobs=self.n_jobs)(delayed(fit_forest)(params, X[keys == c]) for c in eligible)
+        bundle = {'partition': self.partition, 'models': {}}
+        if cells is not None and os.path.isfile(target):
+            bundle = joblib.load(target)
+        bundle['models'].update(zip(eligible, fitted))
+        joblib.dump(bundle, target)
+        logger.info("Trained {} per {} models, {} partitions use the global model".format(
+            len(eligible), self.partition, len(counts) - len(bundle['models'])))
+
+    def config(self):
+        cfg = ConfigParser()
+        cfg.read('src/ad_config.ini')
+        self.detector = cfg.get('model', 'detector', fallback='isoforest')
+        self.zscore_threshold = cfg.getfloat('model', 'zscore_threshold', fallback=3.5)
+        self.zscore_alpha = cfg.getfloat('model', 'zscore_alpha', fallback=0.001)
+        self.partition = cfg.get('model', 'partition', fallback='')
+        self.f1_tolerance = cfg.getfloat('model', 'f1_tolerance', fallback=0.01)
+        self.latency_budget_ms = cfg.getfloat('model', 'latency_budget_ms', fallback=0)
+        self.latency_rows = cfg.getint('model', 'latency_rows', fallback=1000)
+        self.prune = cfg.getboolean('model', 'prune', fallback=False)
+        self.prune_tolerance = cfg.getfloat('model', 'prune_tolerance', fallback=0.005)
+        self.min_trees = cfg.getint('model', 'min_trees', fallback=25)
+        self.rolling = cfg.getboolean('rolling', 'enabled', fallback=False) and cfg.getboolean('rolling', 'model_features', fallback=False)
+        self.window = cfg.getint('rolling', 'window', fallback=20)
+        self.max_ues = cfg.getint('rolling', 'max_ues', fallback=10000)
+        self.min_cell_samples = cfg.getint('model', 'min_cell_samples', fallback=1000)
+        self.cell_estimators = cfg.getint('model', 'cell_estimators', fallback=100)
+        self.n_jobs = cfg.getint('model', 'n_jobs', fallback=-1)
+
+
+def install(staging, path):
+    """ Move the model bundle written to staging into path.
+
+    The model file marks a complete bundle: the old model is moved out first
+    and the new one is moved in last, so a process starting in between finds
+    no model (and serves the fallback and trains) instead of loading the
+    scaler of one training with the model of another. Files the new bundle
+    does not have (e.g. cell_models) are removed.
+    """
+    model = os.path.join(path, 'model')
+    if os.path.isfile(model):
+        os.replace(model, os.path.join(staging, 'model.old'))
+    for name in ('scale', 'num_params', 'feature_stats', 'cell_models'):
+        new, old = os.path.join(staging, name), os.path.join(path, name)
+        if os.path.isfile(new):
+            os.replace(new, old)
+        elif os.path.isfile(old):
+            os.remove(old)
+    os.replace(os.path.join(staging, 'model'), model)
+
+
+def fit_forest(params, X):
+    return IsolationForest(**params).fit(X)
+
+
+def latency(model, X, repeat=3):
+    """ Best wall time of repeat predictions on X in seconds """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        model.predict(X)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def tree_depths(model, X):
+    """ (n_trees, n_samples) path length of every sample in every tree of a fitted IsolationForest """
+    depths = np.empty((len(model.estimators_), len(X)))
+    for i, (tree, features) in enumerate(zip(model.estimators_, model.estimators_features_)):
+        leaves = tree.apply(X[:, features])
+        depths[i] = model._decision_path_lengths[i][leaves] + model._average_path_length_per_tree[i][leaves] - 1.0
+    return depths
+
+
+def prune(model, keep, X):
+    """ Keep the trees of a fitted IsolationForest at the positions keep, with their cached path
+    lengths, and recompute offset_ on the training data X.
+    """
+    model.estimators_ = [model.estimators_[i] for i in keep]
+    model.estimators_features_ = [model.estimators_features_[i] for i in keep]
+    model._seeds = model._seeds[keep]
+    model._decision_path_lengths = tuple(model._decision_path_lengths[i] for i in keep)
+    model._average_path_length_per_tree = tuple(model._average_path_length_per_tree[i] for i in keep)
+    model.n_estimators = len(keep)
+    if model.contamination != 'auto':
+        model.offset_ = np.percentile(model.score_samples(X), 100.0 * model.contamination)
+    return model
@@ -0,0 +1,221 @@
+# ==================================================================================
+#  Copyright (c) 2020 HCL Technologies Limited.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+# ==================================================================================
+
+"""
+Offline scoring of a historical time range with the saved model bundle.
+
+The range is split into time chunks that are read, scored, classified by
+CAUSE and written in bulk by a pool of worker processes. Completed chunks are
+recorded in a checkpoint file, an interrupted run started again with the same
+range and checkpoint only scores the remaining chunks.
+
+    backfill-src.py --start 2024-05-01 --stop 2024-05-15 --chunk 1h --workers 4
+"""
+
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+from mdclogpy import Logger
+
+logger = Logger(name=__name__)
+
+# per worker process state, created by init_worker
+worker = {}
+
+
+def timestamp(value):
+    ts = pd.Timestamp(value)
+    return ts.tz_localize('UTC') if ts.tzinfo is None else ts.tz_convert('UTC')
+
+
+def sample_times(df):
+    """ Time of every sample: the point time (_time) read from InfluxDB, or the recorded
+    measTimeStampRf of the replay dataset (numbers are milliseconds)
+    """
+    ts = df['_time'] if '_time' in df.columns else df['measTimeStampRf']
+    if pd.api.types.is_numeric_dtype(ts.dtype):
+        return pd.to_datetime(ts, unit='ms', utc=True)
+    return pd.to_datetime(ts, utc=True)
+
+
+def chunks(start, stop, chunk):
+    """ Consecutive [start, stop) ranges of length chunk covering [start, stop) """
+    bounds = list(pd.date_range(start, stop, freq=chunk))
+    if bounds[-1] < stop:
+        bounds.append(stop)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def init_worker(path, threshold, meas, dummy, shared=None):
+    from ad_model import modelling, CAUSE
+    from database import DATABASE, DUMMY
+    db = DUMMY() if dummy else DATABASE()
+    if shared is not None:
+        from model_server import SharedModel
+        shared = SharedModel(shared)
+        shared.refresh()
+        md = modelling(shared=shared)
+    else:
+        md = modelling(path=path)
+    if not md.ready():
+        raise RuntimeError("No model bundle in {}".format(path))
+    db.set_schema(md.num)
+    worker.update(db=db, md=md, cp=CAUSE(), threshold=threshold, meas=meas, shared=shared)
+
+
+def score_chunk(start, stop):
+    """ Read, score, classify and write one chunk in the worker process
+
+    Returns
+    -------
+    (start, rows, anomalies)
+    """
+    from ad_model import DEGRADATION, modelling
+    if worker['shared'] is not None and worker['shared'].refresh():
+        worker['md'] = modelling(shared=worker['shared'])
+    db, md, cp = worker['db'], worker['md'], worker['cp']
+    # one read for the chunk and the baseline window before it, every sample is classified
+    # against the window that ends at its own time
+    frame = db.read_range(start - pd.Timedelta(cp.window), stop)
+    if frame.empty or not set(md.num).issubset(frame.columns):
+        return start, 0, 0
+    times = sample_times(frame)
+    df = frame[(times >= start).to_numpy()].dropna(subset=md.num)
+    if len(df) == 0:
+        return start, 0, 0
+    df = df.copy()
+    df['Anomaly'] = md.predict(df)
+    df['Degradation'] = pd.Categorical.from_codes(np.zeros(len(df), dtype=np.int8), dtype=DEGRADATION)
+    if (df['Anomaly'] == 1).any():
+        anomaly, codes = cp.cause(df, db, worker['threshold'], base=cp.windowed(frame, times, db).loc[df.index])
+        df['Anomaly'] = anomaly
+        df['Degradation'] = pd.Categorical.from_codes(codes, dtype=DEGRADATION)
+    db.write_bulk(df, worker['meas'])
+    return start, len(df), int((df['Anomaly'] > 0).sum())
+
+
+class Checkpoint(object):
+    r""" Completed chunks of a backfill run, saved as JSON after every chunk.
+
+    A checkpoint of a different range or chunk size is ignored.
+    """
+
+    def __init__(self, path, start, stop, chunk):
+        self.path = path
+        self.key = {'start': start.isoformat(), 'stop': stop.isoformat(), 'chunk': str(pd.Timedelta(chunk))}
+        self.done = set()
+        self.rows = 0
+        self.anomalies = 0
+        if path and os.path.isfile(path):
+            with open(path) as f:
+                state = json.load(f)
+            if all(state.get(k) == v for k, v in self.key.items()):
+                self.done = set(state['done'])
+                self.rows = state['rows']
+                self.anomalies = state['anomalies']
+            else:
+                logger.warning("Checkpoint {} belongs to another range, starting over".format(path))
+
+    def complete(self, start, rows, anomalies):
+        self.done.add(start.isoformat())
+        self.rows += rows
+        self.anomalies += anomalies
+        self.save()
+
+    def save(self):
+        if not self.path:
+            return
+        state = dict(self.key, done=sorted(self.done), rows=self.rows, anomalies=self.anomalies)
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp, self.path)
+
+
+def publish(path, name):
+    """ Publish the model bundle in path to shared memory for the workers, None if the model is not a forest """
+    import joblib
+    from model_server import ModelServer
+    model = joblib.load(os.path.join(path, 'model'))
+    if not hasattr(model, 'estimators_'):
+        logger.warning("Only isolation forests are served from shared memory, workers load {}".format(type(model).__name__))
+        return None
+    server = ModelServer(name)
+    server.publish(model, joblib.load(os.path.join(path, 'scale')), joblib.load(os.path.join(path, 'num_params')))
+    return server
+
+
+def backfill(start, stop, chunk='1h', workers=None, path='src', threshold=70, meas='AD', checkpoint='backfill.json', dummy=False, shared=False):
+    """ Score [start, stop) chunk by chunk in a process pool
+
+    With shared, the global model is published once to shared memory and the
+    workers evaluate it there instead of loading their own copy (per cell
+    models are not used).
+
+    Returns
+    -------
+    Checkpoint with the totals of the run
+    """
+    start, stop = timestamp(start), timestamp(stop)
+    state = Checkpoint(checkpoint, start, stop, chunk)
+    todo = [c for c in chunks(start, stop, chunk) if c[0].isoformat() not in state.done]
+    total = len(todo) + len(state.done)
+    logger.info("Backfill {} - {}: {} chunks, {} already done".format(start, stop, total, len(state.done)))
+    began = time.monotonic()
+    rows = 0
+    server = publish(path, 'ad-backfill-{}'.format(os.getpid())) if shared else None
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                 initargs=(path, threshold, meas, dummy, server and server.name)) as pool:
+            futures = [pool.submit(score_chunk, s, e) for s, e in todo]
+            for future in as_completed(futures):
+                chunk_start, count, anomalies = future.result()
+                state.complete(chunk_start, count, anomalies)
+                rows += count
+                elapsed = time.monotonic() - began
+                logger.info("Backfill {}/{} chunks, {} samples, {} anomalous, {:.0f} samples/s".format(
+                    len(state.done), total, state.rows, state.anomalies, rows / elapsed if elapsed > 0 else 0))
+    finally:
+        if server is not None:
+            server.close()
+    return state
+
+
+def start():
+    parser = argparse.ArgumentParser(description="Score a historical time range with the saved model bundle")
+    parser.add_argument('--start', required=True, help="start of the range (RFC3339 or date, UTC if no offset)")
+    parser.add_argument('--stop', default=None, help="end of the range, now if omitted")
+    parser.add_argument('--chunk', default='1h', help="time span scored by one task (default 1h)")
+    parser.add_argument('--workers', type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument('--model', default='src', help="directory of the model bundle (default src)")
+    parser.add_argument('--threshold', type=float, default=70, help="throughput degradation threshold in percent")
+    parser.add_argument('--meas', default='AD', help="measurement the results are written to")
+    parser.add_argument('--checkpoint', default='backfill.json', help="checkpoint file used to resume the run")
+    parser.add_argument('--dummy', action='store_true', help="score the replay dataset instead of InfluxDB")
+    parser.add_argument('--shared', action='store_true', help="serve the model to the workers from shared memory")
+    args = parser.parse_args()
+    stop = args.stop or pd.Timestamp.now(tz='UTC')
+    state = backfill(args.start, stop, args.chunk, args.workers, args.model, args.threshold, args.meas, args.checkpoint,
+                     args.dummy, args.shared)
+    logger.info("Backfill complete: {} samples scored, {} anomalous".format(state.rows, state.anomalies))
+
+
+if __name__ == "__main__":
+    start()
@@ -0,0 +1,103 @@
+# ==================================================================================
+#  Copyright (c) 2020 HCL Technologies Limited.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+# ==================================================================================
+
+import json
+import os
+import threading
+import time
+from mdclogpy import Logger
+
+logger = Logger(name=__name__)
+
+
+class FileStore(object):
+    """ Checkpoint kept in a local JSON file, replaced atomically on every save """
+
+    def __init__(self, path='checkpoint.json'):
+        self.path = path
+
+    def load(self):
+        if not os.path.isfile(self.path):
+            return None
+        with open(self.path) as f:
+            return json.load(f)
+
+    def save(self, state):
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp, self.path)
+
+
+class SDLStore(object):
+    """ Checkpoint kept in SDL under namespace/key, shared by the replicas of the xApp """
+
+    def __init__(self, sdl, namespace='ad', key='checkpoint'):
+        self.sdl = sdl
+        self.namespace = namespace
+        self.key = key
+
+    def load(self):
+        value = self.sdl.get(self.namespace, self.key, usemsgpack=False)
+        return json.loads(value) if value else None
+
+    def save(self, state):
+        self.sdl.set(self.namespace, self.key, json.dumps(state).encode(), usemsgpack=False)
+
+
+class Checkpointer(object):
+    r""" Periodic checkpoint of the predictor's runtime state.
+
+    state() is serialized at most every interval seconds, so the cost on the
+    tick is a clock read in between. Failed saves are logged and retried at
+    the next interval, they never interrupt prediction. Saves from concurrent
+    pipeline contexts are serialized.
+
+    Parameters
+    ----------
+    store: FileStore or SDLStore
+    state: callable
+        returns the state to save as a JSON serializable dict
+    interval: float (default=10)
+        seconds between two checkpoints
+    """
+
+    def __init__(self, store, state, interval=10.0):
+        self.store = store
+        self.state = state
+        self.interval = interval
+        self.saved_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def maybe_save(self):
+        if time.monotonic() - self.saved_at >= self.interval:
+            self.save()
+
+    def save(self):
+        with self.lock:
+            self.saved_at = time.monotonic()
+            try:
+                self.store.save(self.state())
+            except Exception as e:
+                logger.error("Checkpoint failed: {}".format(e))
+
+    def load(self):
+        """ Saved state, None if there is none or it cannot be read """
+        try:
+            return self.store.load()
+        except Exception as e:
+            logger.error("Cannot restore checkpoint: {}".format(e))
+            return None
@@ -0,0 +1,296 @@
+# ==================================================================================
+#  Copyright (c) 2020 HCL Technologies Limited.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+# ==================================================================================
+
+
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import numpy as np
+import pandas as pd
+from mdclogpy import Logger
+from ad_model import CAUSE, DEGRADATION
+from exceptions import DatabaseUnavailableError
+
+logger = Logger(name=__name__)
+
+# name of the context configured by the [influxdb] section alone
+DEFAULT = 'ad'
+
+
+class PipelineContext(object):
+    r""" Runtime of one monitored measurement.
+
+    A context holds its own database handle, served model, degradation analysis
+    and throughput threshold policy, together with the last alert per UE and
+    the unsent TS messages, so several contexts (e.g. one per bucket,
+    measurement or slice) run concurrently in one process. A context is ticked
+    by one thread at a time; the threshold is replaced from the RMR thread and
+    read once per tick. Contexts serving the same bundle share its loaded model
+    (see modelling.fork), each one scores into its own FeatureBatch.
+
+    Parameters
+    ----------
+    name: str
+    db: DATABASE
+        handle reading the bucket and measurement of the context
+    output: str (default='AD')
+        measurement the scored samples are written to
+    model_path: str (default='src')
+        directory of the served model bundle
+    threshold: float (default=70)
+        throughput degradation threshold in percent, updated by A1 policies
+    interval: float (default=0.5)
+        seconds between two ticks when ticker is None
+    ticker: TickController (default=None)
+        adapts the interval to the data arrival rate and the processing time
+    baseline_ttl: float (default=300)
+        seconds a UE baseline is reused by the degradation analysis
+    baseline_window: str (default='20s')
+        look-back window of the UE baselines
+    baseline_agg: str (default='max')
+        aggregate of the UE baselines, max, min, mean or a quantile between 0 and 1
+    pending_max: int (default=1000)
+        number of unsent TS messages kept
+    rolling: RollingStore (default=None)
+        per UE rolling window statistics, updated with every tick and used as the
+        degradation baseline
+    rolling_features: bool (default=False)
+        add the rolling statistics to the samples as model features
+    """
+
+    def __init__(self, name, db, output='AD', model_path='src', threshold=70, interval=0.5, ticker=None,
+                 baseline_ttl=300.0, baseline_window='20s', baseline_agg='max', pending_max=1000, rolling=None,
+                 rolling_features=False):
+        self.name = name
+        self.db = db
+        self.output = output
+        self.model_path = model_path
+        self.threshold = threshold
+        self.interval = interval
+        self.ticker = ticker
+        self.md = None
+        self.rolling = rolling
+        self.rolling_features = rolling_features
+        self.cp = CAUSE(baseline_ttl, rolling, baseline_window, baseline_agg)
+        self.alerts = {}
+        self.pending = deque(maxlen=pending_max)
+        self.checkpointer = None
+        self.on_drift = None
+
+    @classmethod
+    def from_config(cls, name, cfg, dummy=False):
+        """ Context configured by the [context.<name>] section on top of the shared sections:
+        bucket, measurement, output, model and threshold.
+        """
+        from database import DATABASE, DUMMY
+        section = 'context.' + name
+        db = DUMMY() if dummy else DATABASE()
+        db.bucket = cfg.get(section, 'bucket', fallback=db.bucket)
+        db.meas = cfg.get(section, 'measurement', fallback=db.meas)
+        if name != DEFAULT:
+            db.spool.path = os.path.join(db.spool.path, name)
+        rolling = None
+        if cfg.getboolean('rolling', 'enabled', fallback=False):
+            from rolling import RollingStore
+            rolling = RollingStore([db.thpt, db.rsrp, db.rsrq, db.rssinr, db.prb], window=cfg.getint('rolling', 'window', fallback=20),
+                                   max_ues=cfg.getint('rolling', 'max_ues', fallback=10000))
+        if not db.connect():
+            logger.warning("InfluxDB is not reachable, starting {} in degraded mode".format(name))
+        ctx = cls(name, db, output=cfg.get(section, 'output', fallback='AD' if name == DEFAULT else 'AD-' + name),
+                  model_path=cfg.get(section, 'model', fallback='src'),
+                  threshold=cfg.getfloat(section, 'threshold', fallback=70),
+                  interval=cfg.getfloat('pipeline', 'interval', fallback=0.5),
+                  ticker=tick_controller(cfg, 'tick' if name == DEFAULT else 'tick.' + name),
+                  baseline_ttl=cfg.getfloat('model', 'baseline_ttl', fallback=300),
+                  baseline_window=cfg.get('model', 'baseline_window', fallback='20s'),
+                  baseline_agg=cfg.get('model', 'baseline_agg', fallback='max'),
+                  pending_max=cfg.getint('checkpoint', 'pending_max', fallback=1000), rolling=rolling,
+                  rolling_features=cfg.getboolean('rolling', 'model_features', fallback=False))
+        logger.info("Context {}: {}/{} -> {}, throughput threshold {}%".format(name, db.bucket, db.meas, ctx.output, ctx.threshold))
+        return ctx
+
+    def fetch(self):
+        """ Read the latest UE samples from InfluxDB.
+
+        Returns
+        -------
+        df: DataFrame of complete samples to score, or None if there is nothing to score
+        """
+        if self.md is None:
+            logger.debug("Model not ready, skipping prediction")
+            return None
+        try:
+            self.db.read_data()
+        except DatabaseUnavailableError as e:
+            logger.warning("Skipping prediction, running in degraded mode: {}".format(e))
+            return None
+        if self.db.data is None:
+            logger.debug("No new samples")
+            return None
+        df = self.db.data.dropna(axis=0)
+        if len(df) == 0:
+            return None
+        added = set(self.rolling.columns) if self.rolling is not None and self.rolling_features else set()
+        if not set(self.md.num).issubset(added.union(df.columns)):
+            logger.warning("Parameters do not match with training data")
+            return None
+        return df
+
+    def score(self, df):
+        """ Label the samples and find the degradation type of the anomalous ones.
+
+        Returns
+        -------
+        df: DataFrame with Anomaly and Degradation columns, ready to be written
+        val: JSON string of anomalous sample info, or None
+        """
+        md = self.md
+        db = self.db
+        if self.rolling is not None:
+            # updated here and not in fetch: the scorer is the only thread using the store, so
+            # the cause analysis of tick N sees the windows as of tick N
+            df = self.rolling.augment(df, db.ue, assign=self.rolling_features)
+        df['Anomaly'] = md.predict(df)
+        df['Degradation'] = pd.Categorical.from_codes(np.zeros(len(df), dtype=np.int8), dtype=DEGRADATION)
+        if md.drift is not None and md.drift.due() and self.on_drift is not None:
+            self.on_drift(self)
+        val = None
+        if 1 in df.Anomaly.unique():
+            anomaly, codes = self.cp.cause(df, db, self.threshold)
+            df['Anomaly'] = anomaly
+            df['Degradation'] = pd.Categorical.from_codes(codes, dtype=DEGRADATION)
+            df_a = self.unsent(df.loc[df['Anomaly'] == 1].copy())
+            if len(df_a) > 0:
+                df_a['time'] = df_a.index
+                cols = [db.ue, 'time', 'Degradation']
+                result = json.loads(df_a.loc[:, cols].to_json(orient='records'))
+                val = json.dumps(result).encode()
+        df[db.prb] = df[db.prb].astype(np.float32)
+        return df, val
+
+    def unsent(self, df_a):
+        """ Drop the anomalous samples of a UE that are not newer than the last one alerted
+        (e.g. samples scored again after a restart) and remember the newest alerted sample per UE.
+        Only the InfluxDB point time (_time) is compared: the recorded measTimeStampRf starts
+        over when a dataset is replayed in a loop, so samples without _time are always sent.
+        """
+        col = '_time'
+        if col not in df_a.columns or len(df_a) == 0:
+            return df_a
+        ues = df_a[self.db.ue].astype(object).to_numpy()
+        stamps = pd.to_datetime(df_a[col], utc=True)
+        last = pd.to_datetime(pd.Series(ues, index=df_a.index).map(self.alerts), utc=True)
+        fresh = (last.isna() | (stamps > last)).to_numpy()
+        self.alerts.update(stamps[fresh].groupby(ues[fresh]).max().items())
+        return df_a[fresh]
+
+    def write(self, df):
+        """ Store the scored samples in the output measurement """
+        self.db.write_anomaly(df, self.output)
+        if self.checkpointer is not None:
+            self.checkpointer.maybe_save()
+
+    def tick(self, run):
+        """ Run one tick with run(context), which returns the number of samples scored,
+        and return the seconds until the next tick is due.
+        """
+        start = time.monotonic()
+        try:
+            rows = run(self)
+        except Exception as e:
+            logger.error("Tick of {} failed: {}".format(self.name, e))
+            rows = 0
+        elapsed = time.monotonic() - start
+        if self.ticker is None:
+            return max(0.0, self.interval - elapsed)
+        self.ticker.arrived(rows)
+        self.ticker.processed(elapsed)
+        return max(0.0, self.ticker.next_interval() - elapsed)
+
+    def state(self):
+        """ Read watermark, cached UE baselines, last alert per UE and unsent TS messages """
+        watermark = getattr(self.db, 'watermark', None)
+        return {'watermark': watermark.isoformat() if watermark is not None else None,
+                'baselines': self.cp.export(),
+                'alerts': {str(ue): ts.isoformat() for ue, ts in list(self.alerts.items())},
+                'pending': [val.decode() for val in list(self.pending)]}
+
+    def restore(self, state):
+        """ Resume from a checkpoint: continue reading after the watermark, reuse the baselines and
+        do not alert again for samples that were already sent to TS.
+        """
+        if state.get('watermark'):
+            self.db.watermark = pd.Timestamp(state['watermark'])
+        self.cp.restore(state.get('baselines', {}))
+        self.alerts.update((ue, pd.Timestamp(ts)) for ue, ts in state.get('alerts', {}).items())
+        self.pending.extend(val.encode() for val in state.get('pending', []))
+        logger.info("Restored {}: watermark {}, {} baselines, {} UEs alerted, {} pending messages".format(
+            self.name, state.get('watermark'), len(state.get('baselines', {})), len(self.alerts), len(self.pending)))
+
+
+def tick_controller(cfg, prefix='tick'):
+    """ Adaptive poll interval from the [pipeline] section, None for a fixed interval """
+    if not cfg.getboolean('pipeline', 'adaptive', fallback=False):
+        return None
+    from tick import TickController
+    return TickController(interval=cfg.getfloat('pipeline', 'interval', fallback=0.5),
+                          min_interval=cfg.getfloat('pipeline', 'min_interval', fallback=0.1),
+                          max_interval=cfg.getfloat('pipeline', 'max_interval', fallback=5.0),
+                          batch_rows=cfg.getint('pipeline', 'batch_rows', fallback=200),
+                          headroom=cfg.getfloat('pipeline', 'headroom', fallback=1.5),
+                          backoff=cfg.getfloat('pipeline', 'backoff', fallback=2.0), prefix=prefix)
+
+
+def run(contexts, tick, workers=None, ticks=None):
+    """ Tick the contexts on a shared pool of worker threads.
+
+    Every context is ticked again once its interval has passed and its previous
+    tick finished, so a slow context never delays the others as long as a worker
+    is free.
+
+    Parameters
+    ----------
+    contexts: list of PipelineContext
+    tick: callable
+        runs one tick of the given context and returns the number of samples scored
+    workers: int (default=None)
+        size of the thread pool, one per context if None
+    ticks: int (default=None)
+        stop after this many ticks in total, run forever if None
+    """
+    pool = ThreadPoolExecutor(max_workers=workers or len(contexts), thread_name_prefix='ad-tick')
+    due = {ctx: time.monotonic() for ctx in contexts}
+    running = {}
+    count = 0
+    try:
+        while ticks is None or count < ticks or running:
+            now = time.monotonic()
+            for ctx in contexts:
+                if (ticks is None or count < ticks) and ctx not in running.values() and now >= due[ctx]:
+                    running[pool.submit(ctx.tick, tick)] = ctx
+                    count += 1
+            idle = [due[ctx] for ctx in contexts if ctx not in running.values()]
+            timeout = max(0.0, min(idle) - time.monotonic()) if idle else None
+            if not running:
+                time.sleep(timeout)
+                continue
+            done, _ = wait(list(running), timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                due[running.pop(future)] = time.monotonic() + future.result()
+    finally:
+        pool.shutdown(wait=True)
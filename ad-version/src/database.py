@@ -14,17 +14,105 @@
 #  limitations under the License.
 # ==================================================================================
 
+import asyncio
+import json
+import os
+import random
+import threading
 import time
+import numpy as np
 import pandas as pd
-from influxdb_client import InfluxDBClient, Point, WriteOptions
-from influxdb_client.client.query_api import QueryApi
-from influxdb_client.client.write_api import WriteApi
+from influxdb_client import InfluxDBClient, WriteOptions
+from influxdb_client.rest import ApiException
+from influxdb_client.client.write_api import SYNCHRONOUS
 from configparser import ConfigParser
 from mdclogpy import Logger
+import fluxcsv
+from exceptions import DatabaseUnavailableError
+from spool import CircuitBreaker, Spool
 from requests.exceptions import RequestException, ConnectionError
+from urllib3.exceptions import HTTPError
+try:
+    from aiohttp import ClientError
+except ImportError:
+    ClientError = OSError
 
 logger = Logger(name=__name__)
 
+# errors of a request that put the client in degraded mode: unreachable server, failed
+# connection, or an error status (e.g. 401, 5xx) returned by the server
+UNAVAILABLE = (ApiException, HTTPError, OSError)
+
+MEASUREMENT_ESCAPE = str.maketrans({',': r'\,', ' ': r'\ ', '\n': r'\n'})
+KEY_ESCAPE = str.maketrans({',': r'\,', '=': r'\=', ' ': r'\ ', '\n': r'\n'})
+STRING_ESCAPE = str.maketrans({'"': r'\"', '\\': r'\\'})
+
+
+def field_values(col, values):
+    """Line protocol key=value strings of one column, None where the value is missing"""
+    key = col.translate(KEY_ESCAPE) + '='
+    if pd.api.types.is_bool_dtype(values.dtype):
+        missing = values.isna().to_numpy()
+        text = np.where(values.fillna(False).to_numpy(dtype=bool), key + 'true', key + 'false').astype(object)
+    elif pd.api.types.is_integer_dtype(values.dtype):
+        missing = values.isna().to_numpy()
+        text = (key + values.astype(str) + 'i').to_numpy(dtype=object)
+    elif pd.api.types.is_float_dtype(values.dtype):
+        array = values.to_numpy()
+        missing = ~np.isfinite(array)
+        text = (key + values.astype(str).str.replace(r'\.0$', '', regex=True)).to_numpy(dtype=object)
+    else:
+        array = values.astype(object).to_numpy()
+        missing = pd.isna(array)
+        text = np.array([key + '"' + str(v).translate(STRING_ESCAPE) + '"' for v in array], dtype=object)
+    text[missing] = None
+    return text
+
+
+def sample_times(df):
+    """Time of each row in ns since the epoch as strings, from measTimeStampRf (numbers are
+    milliseconds) or _time, None where a row has no time (the server time is used)
+    """
+    col = 'measTimeStampRf' if 'measTimeStampRf' in df.columns else '_time'
+    if col not in df.columns:
+        return [None] * len(df)
+    ts = df[col]
+    ts = pd.to_datetime(ts, unit='ms', utc=True) if pd.api.types.is_numeric_dtype(ts.dtype) else pd.to_datetime(ts, utc=True)
+    ts = ts.dt.tz_convert(None).dt.as_unit('ns')
+    return [None if missing else str(ns) for ns, missing in zip(ts.to_numpy().view('int64').tolist(), ts.isna().tolist())]
+
+
+class Backoff(object):
+    """Exponential backoff with full jitter for reconnect attempts
+
+    Parameters
+    ----------
+    base: float
+        delay in seconds after the first failure
+    cap: float
+        upper bound of the delay in seconds
+    """
+
+    def __init__(self, base=1.0, cap=120.0):
+        self.base = base
+        self.cap = cap
+        self.reset()
+
+    def reset(self):
+        self.attempts = 0
+        self.next_attempt = 0.0
+
+    def ready(self):
+        return time.monotonic() >= self.next_attempt
+
+    def failure(self):
+        """Record a failed attempt and return the delay until the next one"""
+        delay = random.uniform(0, min(self.cap, self.base * 2 ** self.attempts))
+        self.attempts += 1
+        self.next_attempt = time.monotonic() + delay
+        return delay
+
+
 class DATABASE(object):
     """DATABASE class to handle InfluxDB v2.x connections and operations.
 
@@ -57,26 +145,60 @@ class DATABASE(object):
         self.org = org
         self.bucket = bucket
         self.data = None
-        self.client = InfluxDBClient(url=self.url, token=self.token, org=self.org)
-        self.query_api = self.client.query_api()
-        self.write_api = self.client.write_api(write_options=WriteOptions(batch_size=5000))
+        self.schema = None
+        self.timeout = 10000
+        self.pool_size = 4
+        self.connected = False
+        self.aclient = None
+        self.watermark = None
+        self.live_window = '1600ms'
         self.config()
+        self.backoff = Backoff(self.backoff_base, self.backoff_cap)
+        self.client = InfluxDBClient(url=self.url, token=self.token, org=self.org, timeout=self.timeout,
+                                     connection_pool_maxsize=self.pool_size)
+        self.query_api = self.client.query_api()
+        self.breaker = CircuitBreaker(self.breaker_failures, self.breaker_reset)
+        self.spool = Spool(self.spool_path, self.spool_max_bytes, self.spool_max_age)
+        self.replaying = False
+        self.replay_lock = threading.Lock()
+        self.write_api = self.client.write_api(write_options=WriteOptions(batch_size=5000, max_retries=self.write_retries),
+                                               success_callback=self.write_success, error_callback=self.write_error)
+        self.sync_write_api = self.client.write_api(write_options=SYNCHRONOUS)
         self.connect()
 
     def connect(self):
-        if self.client:
-            self.client.close()
-        
-        try:
-            self.client = InfluxDBClient(url=self.url, token=self.token, org=self.org)
-            self.query_api = self.client.query_api()
-            self.write_api = self.client.write_api(write_options=WriteOptions(batch_size=5000))
-            logger.info(f"Connected to InfluxDB at {self.url}")
+        """Check that InfluxDB is reachable. The client and its connection pool are created once
+        in the constructor, this only pings the server and never blocks: while a retry is backing
+        off it returns False immediately.
+        """
+        if self.connected:
             return True
-        except (RequestException, ConnectionError) as e:
-            logger.error(f"Failed to connect to InfluxDB: {e}")
-            time.sleep(120)
+        if not self.backoff.ready():
             return False
+        self.connected = self.client.ping()
+        if self.connected:
+            self.backoff.reset()
+            logger.info(f"Connected to InfluxDB at {self.url}")
+        else:
+            delay = self.backoff.failure()
+            logger.error(f"Failed to connect to InfluxDB at {self.url}, next attempt in {delay:.1f}s")
+        return self.connected
+
+    def disconnected(self, error):
+        """Mark the connection as lost after a failed request and schedule the next attempt"""
+        self.connected = False
+        delay = self.backoff.failure()
+        logger.error(f"Lost connection to InfluxDB: {error}, next attempt in {delay:.1f}s")
+
+    def close(self):
+        """Flush the batched writes, stop the batching thread of the write API and release the
+        connection pool. The instance must not be used afterwards.
+        """
+        try:
+            self.write_api.close()
+            self.sync_write_api.close()
+        finally:
+            self.client.close()
 
     def read_data(self, train=False, valid=False, limit=False):
         """Read data method for a given measurement and limit using Flux query language.
@@ -98,15 +220,19 @@ class DATABASE(object):
             logger.error("Measurement name must be provided")
             return
 
-        # Construct the Flux query
+        live = not (train or valid or limit)
+        start = '-240h'
+        if live:
+            # live reads only fetch the samples written after the newest one already read
+            start = f'time(v: {self.watermark.value + 1})' if self.watermark is not None else f'-{self.live_window}'
+
         # Construct the Flux query
         query = (
             f'from(bucket: "{self.bucket}") '
-            f'|> range(start: -240h) '
+            f'|> range(start: {start}) '
             f'|> filter(fn: (r) => r._measurement == "{self.meas}") '
         )
 
-
         # Apply filters based on parameters
         if train:
             query += '|> range(start: -240h, stop: -5m) '
@@ -116,16 +242,90 @@ class DATABASE(object):
             query += f'|> limit(n: {limit}) '
 
         query += '|> pivot(rowKey:["_time"], columnKey: ["_field"], valueColumn: "_value")'
-        
-        result = self.query_api.query_data_frame(query)
-        print("self meas is : ", self.meas)
-        print("value of result is database.py : ", result)
 
-        self.data = result  # Use double brackets to select the column as DataFrame
+        result = self.query_frame(query)
+        if not result.empty:
+            self.data = result
+            if live and '_time' in result.columns:
+                self.watermark = result['_time'].max()
 
+    def read_range(self, start, stop):
+        """Read the samples with start <= _time < stop (Timestamps) in one query, pivoted like read_data
+
+        Returns
+        -------
+        DataFrame, empty if the range holds no samples
+        """
+        query = (
+            f'from(bucket: "{self.bucket}") '
+            f'|> range(start: time(v: {pd.Timestamp(start).value}), stop: time(v: {pd.Timestamp(stop).value})) '
+            f'|> filter(fn: (r) => r._measurement == "{self.meas}") '
+            '|> pivot(rowKey:["_time"], columnKey: ["_field"], valueColumn: "_value")'
+        )
+        return self.query_frame(query)
+
+    def baselines(self, ues, window='20s', agg='max', fields=None):
+        """Aggregate the recent samples of the given UEs per UE on the server.
+
+        Each field is reduced per UE by max, min or mean, or by the quantile agg
+        when it is a number between 0 and 1, and the results are pivoted into
+        one row per UE, so the response size does not depend on the retention
+        or on how often the UEs report.
+
+        Parameters
+        ----------
+        ues: list
+            UEs to aggregate
+        window: str (default='20s')
+            look-back window as a Flux duration
+        agg: str or float (default='max')
+            max, min, mean or a quantile between 0 and 1
+        fields: list (default=None)
+            fields to aggregate, throughput, RSRP and RSRQ if None
+
+        Returns
+        -------
+        DataFrame indexed by UE with one float64 column per field, UEs without samples in the window are left out
+        """
+        fields = list(fields or [self.thpt, self.rsrp, self.rsrq])
+        ues = [str(ue) for ue in ues]
+        if not ues:
+            return pd.DataFrame(columns=fields, dtype='float64')
+        if agg in ('max', 'min', 'mean'):
+            reduce = agg + '(column: "{}")'
+        else:
+            reduce = 'quantile(column: "{}", q: ' + str(float(agg)) + ', method: "estimate_tdigest")'
+        selected = ', '.join(json.dumps(f) for f in [self.ue] + fields)
+        query = (
+            f'data = from(bucket: "{self.bucket}") '
+            f'|> range(start: -{window}) '
+            f'|> filter(fn: (r) => r._measurement == "{self.meas}" and contains(value: r._field, set: [{selected}])) '
+            '|> pivot(rowKey:["_time"], columnKey: ["_field"], valueColumn: "_value") '
+            f'|> filter(fn: (r) => contains(value: r["{self.ue}"], set: [{", ".join(json.dumps(ue) for ue in ues)}])) '
+            f'|> group(columns: ["{self.ue}"])\n'
+        )
+        for i, field in enumerate(fields):
+            query += (
+                f'f{i} = data |> filter(fn: (r) => exists r["{field}"]) |> {reduce.format(field)} '
+                f'|> map(fn: (r) => ({{"{self.ue}": r["{self.ue}"], _field: "{field}", _value: float(v: r["{field}"])}}))\n'
+            )
+        query += (
+            f'union(tables: [{", ".join("f{}".format(i) for i in range(len(fields)))}]) '
+            '|> group() '
+            f'|> pivot(rowKey:["{self.ue}"], columnKey: ["_field"], valueColumn: "_value")'
+        )
+        result = self.query_frame(query)
+        if result.empty or self.ue not in result.columns:
+            return pd.DataFrame(columns=fields, dtype='float64')
+        result.index = result[self.ue].astype(str).to_numpy()
+        return result.reindex(columns=fields).astype('float64')
 
     def write_anomaly(self, df, meas='AD'):
-        """Write anomaly data to InfluxDB
+        """Write anomaly data to InfluxDB without blocking the caller.
+
+        Records go through the batching write API while the circuit is closed.
+        Failed batches and records written while the circuit is open are kept
+        in the local spool and replayed in large batches once writes succeed again.
 
         Parameters
         ----------
@@ -135,36 +335,94 @@ class DATABASE(object):
             Measurement name
         """
         try:
-            points = []
-            for _, row in df.iterrows():
-                # Convert the timestamp to a string format
-                timestamp = row["measTimeStampRf"].strftime('%Y-%m-%dT%H:%M:%SZ') if isinstance(row["measTimeStampRf"], pd.Timestamp) else row["measTimeStampRf"]
-                
-                # Create a Point for each row, adding tags and fields
-                point = Point(meas).tag("tag_key", "tag_value").time(timestamp)
-                for col in df.columns:
-                    if col != "measTimeStampRf":  # Skip the timestamp column
-                        point.field(col, row[col])
-                
-                points.append(point)
-
-            # Write points to InfluxDB
-            # Error Write Anomaly Data to InfluxDB
-            # self.write_api.write(bucket=self.bucket, org=self.org , record=points)
-        except (RequestException, ConnectionError) as e:
-            logger.error(f"Failed to write data to InfluxDB: {e}")
+            records = self.to_records(df, meas)
+        except (ValueError, TypeError) as e:
+            logger.error(f"Failed to serialize anomaly data: {e}")
+            return
+        if self.breaker.allow():
+            self.write_api.write(bucket=self.bucket, org=self.org, record=records)
+            if self.spool.pending():
+                self.replay()
+        else:
+            self.spool.append(records)
+
+    def to_records(self, df, meas='AD'):
+        """Convert a DataFrame to line protocol records, one point per row.
+
+        Each point is tagged with its UE id and stamped with the sample time in
+        nanoseconds, so samples of different UEs never share a series key and
+        time. The records are built column by column, missing values are left out.
+        """
+        if len(df) == 0:
+            return []
+        head = meas.translate(MEASUREMENT_ESCAPE)
+        if self.ue in df.columns:
+            ues = df[self.ue].astype(object).to_numpy()
+            tag = ',' + self.ue.translate(KEY_ESCAPE) + '='
+            heads = [head if pd.isna(ue) or ue == '' else head + tag + str(ue).translate(KEY_ESCAPE) for ue in ues]
+        else:
+            heads = [head] * len(df)
+        fields = [field_values(col, df[col]) for col in df.columns
+                  if col not in (self.ue, 'measTimeStampRf') and not col.startswith('_')]
+        times = sample_times(df)
+        records = []
+        for head, ts, *values in zip(heads, times, *fields):
+            line = ','.join(v for v in values if v is not None)
+            if line:
+                records.append(head + ' ' + line if ts is None else head + ' ' + line + ' ' + ts)
+        return records
+
+    def write_bulk(self, df, meas='AD', batch_size=5000):
+        """Write df synchronously in large batches, errors are raised to the caller"""
+        records = self.to_records(df, meas)
+        for i in range(0, len(records), batch_size):
+            self.sync_write_api.write(bucket=self.bucket, org=self.org, record=records[i:i + batch_size])
+
+    def write_success(self, conf, data):
+        self.breaker.success()
+        if self.spool.pending():
+            self.replay()
+
+    def write_error(self, conf, data, exception):
+        logger.error(f"Failed to write data to InfluxDB, spooling batch: {exception}")
+        self.breaker.failure()
+        self.spool.append(data)
+
+    def replay(self):
+        """Replay the spool from a background thread, at most one replay runs at a time"""
+        with self.replay_lock:
+            if self.replaying:
+                return
+            self.replaying = True
+        threading.Thread(target=self.replay_spool, name='ad-spool-replay', daemon=True).start()
+
+    def replay_spool(self):
+        try:
+            count = self.spool.replay(lambda records: self.sync_write_api.write(bucket=self.bucket, org=self.org, record=records),
+                                      self.replay_batch)
+            self.breaker.success()
+            logger.info(f"Replayed {count} spooled records to InfluxDB")
+        except Exception as e:
+            self.breaker.failure()
+            logger.error(f"Spool replay interrupted: {e}")
+        finally:
+            with self.replay_lock:
+                self.replaying = False
 
     def query(self, query):
         try:
             # Execute the query
-            result = self.query_api.query_data_frame(query)
-            
+            result = self.query_frame(query)
+
             # Ensure the result is not empty or malformed
             if result is not None and not result.empty:
                 return result
             else:
                 logger.warning("Query returned no results or empty data.")
                 return pd.DataFrame()
+        except DatabaseUnavailableError as e:
+            logger.warning(f"Query skipped, InfluxDB unavailable: {e}")
+            return pd.DataFrame()
         except (RequestException, ConnectionError) as e:
             logger.error(f"Failed to execute query due to a request error: {e}")
             return pd.DataFrame()  # Return an empty DataFrame for consistency
@@ -172,6 +430,151 @@ class DATABASE(object):
             logger.error(f"An unexpected error occurred: {e}")
             return pd.DataFrame()  # Return an empty DataFrame for consistency
 
+    def count_complete(self, train=False, valid=False, fields=None):
+        """Count the rows of the read_data range that have every field present.
+
+        The pivot, the completeness filter and the count run on the server,
+        the response is a single number however large the range is.
+
+        Parameters
+        ----------
+        train: bool (default=False)
+            count the training range (stops 5 minutes ago)
+        valid: bool (default=False)
+            count the validation range
+        fields: list (default=None)
+            fields that must be present, the configured UE features if None
+        """
+        fields = fields or self.features()
+        stop = ', stop: -5m' if train else ''
+        complete = ' and '.join(f'exists r["{f}"]' for f in fields)
+        selected = ', '.join(f'"{f}"' for f in fields)
+        query = (
+            f'from(bucket: "{self.bucket}") '
+            f'|> range(start: -240h{stop}) '
+            f'|> filter(fn: (r) => r._measurement == "{self.meas}" and contains(value: r._field, set: [{selected}])) '
+            '|> pivot(rowKey:["_time"], columnKey: ["_field"], valueColumn: "_value") '
+            f'|> filter(fn: (r) => {complete}) '
+            '|> group() '
+            '|> count(column: "_time")'
+        )
+        result = self.query_frame(query)
+        return 0 if result.empty else int(result['_time'].iloc[0])
+
+    def last_timestamps(self, measurements=None):
+        """Time of the latest point of each measurement in the last 240h, computed by the server
+
+        Returns
+        -------
+        dict: measurement name -> Timestamp, measurements without points are left out
+        """
+        measurements = measurements or [self.meas]
+        selected = ', '.join(f'"{m}"' for m in measurements)
+        query = (
+            f'from(bucket: "{self.bucket}") '
+            '|> range(start: -240h) '
+            f'|> filter(fn: (r) => contains(value: r._measurement, set: [{selected}])) '
+            '|> keep(columns: ["_time", "_measurement"]) '
+            '|> group(columns: ["_measurement"]) '
+            '|> max(column: "_time")'
+        )
+        result = self.query_frame(query)
+        if result.empty:
+            return {}
+        return dict(zip(result['_measurement'], pd.to_datetime(result['_time'], utc=True)))
+
+    def oldest(self, meas, before):
+        """Time of the oldest point of measurement meas before the Timestamp before, None if there is none"""
+        query = (
+            f'from(bucket: "{self.bucket}") '
+            f'|> range(start: time(v: 0), stop: time(v: {pd.Timestamp(before).value})) '
+            f'|> filter(fn: (r) => r._measurement == "{meas}") '
+            '|> first() '
+            '|> keep(columns: ["_time"]) '
+            '|> group() '
+            '|> min(column: "_time")'
+        )
+        result = self.query_frame(query)
+        return None if result.empty else pd.Timestamp(result['_time'].iloc[0])
+
+    def count_range(self, meas, start, stop):
+        """Number of field values of measurement meas with start <= _time < stop, counted by the server"""
+        query = (
+            f'from(bucket: "{self.bucket}") '
+            f'|> range(start: time(v: {pd.Timestamp(start).value}), stop: time(v: {pd.Timestamp(stop).value})) '
+            f'|> filter(fn: (r) => r._measurement == "{meas}") '
+            '|> group() '
+            '|> count()'
+        )
+        result = self.query_frame(query)
+        return 0 if result.empty else int(result['_value'].iloc[0])
+
+    def delete_range(self, meas, start, stop):
+        """Delete the points of measurement meas with start <= _time < stop through the delete API"""
+        if not self.connect():
+            raise DatabaseUnavailableError(f"InfluxDB at {self.url} is unavailable")
+        try:
+            self.client.delete_api().delete(pd.Timestamp(start).to_pydatetime(),
+                                            (pd.Timestamp(stop) - pd.Timedelta(1, 'ns')).to_pydatetime(),
+                                            f'_measurement="{meas}"', bucket=self.bucket, org=self.org)
+        except UNAVAILABLE as e:
+            self.disconnected(e)
+            raise DatabaseUnavailableError(str(e)) from e
+
+    def features(self):
+        return [self.thpt, self.rsrp, self.rsrq, self.rssinr, self.prb]
+
+    def query_frame(self, query):
+        """Run a Flux query and decode the annotated CSV response into a single DataFrame.
+
+        Raises DatabaseUnavailableError straight away when InfluxDB is not reachable.
+        """
+        if not self.connect():
+            raise DatabaseUnavailableError(f"InfluxDB at {self.url} is unavailable")
+        try:
+            response = self.query_api.query_raw(query)
+        except UNAVAILABLE as e:
+            self.disconnected(e)
+            raise DatabaseUnavailableError(str(e)) from e
+        return fluxcsv.decode(response, self.schema)
+
+    async def aquery_frame(self, query):
+        """Asyncio variant of query_frame. The reachability check goes through connect() and
+        its backoff like the synchronous path, the async client is created on first use inside
+        the running event loop (requires the influxdb-client[async] extra).
+        """
+        if not await asyncio.get_running_loop().run_in_executor(None, self.connect):
+            raise DatabaseUnavailableError(f"InfluxDB at {self.url} is unavailable")
+        if self.aclient is None:
+            from influxdb_client.client.influxdb_client_async import InfluxDBClientAsync
+            self.aclient = InfluxDBClientAsync(url=self.url, token=self.token, org=self.org, timeout=self.timeout,
+                                               connection_pool_maxsize=self.pool_size)
+        try:
+            response = await self.aclient.query_api().query_raw(query)
+        except UNAVAILABLE + (ClientError, asyncio.TimeoutError) as e:
+            self.disconnected(e)
+            raise DatabaseUnavailableError(str(e)) from e
+        return fluxcsv.decode(response, self.schema)
+
+    def ingest_schema(self, features=None):
+        """Compact dtypes applied once when a frame is read: float32 features (the dtype the
+        forest evaluates in) and categorical UE and cell ids, about half the memory of the
+        float64 and object columns the frames held before.
+        """
+        schema = {col: 'float32' for col in (features if features is not None else self.features())}
+        schema.update({col: 'category' for col in (self.ue, self.cell)})
+        return schema
+
+    def set_schema(self, features):
+        """Decode the model features as float32 columns regardless of how they were written"""
+        self.schema = self.ingest_schema(features)
+
+    def compact(self, df):
+        """Cast the columns of df that differ from the ingest schema"""
+        if df is None or not self.schema:
+            return df
+        dtypes = {col: dtype for col, dtype in self.schema.items() if col in df.columns and df[col].dtype != dtype}
+        return df.astype(dtypes) if dtypes else df
 
     def config(self):
         cfg = ConfigParser()
@@ -182,6 +585,18 @@ class DATABASE(object):
             self.org = cfg.get('influxdb', 'org')
             self.bucket = cfg.get('influxdb', 'bucket')
             self.meas = cfg.get('influxdb', "measurement")
+            self.timeout = cfg.getint('influxdb', 'timeout', fallback=self.timeout)
+            self.pool_size = cfg.getint('influxdb', 'pool_size', fallback=self.pool_size)
+        self.backoff_base = cfg.getfloat('influxdb', 'backoff_base', fallback=1.0)
+        self.backoff_cap = cfg.getfloat('influxdb', 'backoff_cap', fallback=120.0)
+        self.write_retries = cfg.getint('influxdb', 'write_retries', fallback=2)
+
+        self.spool_path = cfg.get('spool', 'path', fallback='spool')
+        self.spool_max_bytes = int(cfg.getfloat('spool', 'max_mb', fallback=64) * (1 << 20))
+        self.spool_max_age = cfg.getfloat('spool', 'max_age_h', fallback=24) * 3600
+        self.replay_batch = cfg.getint('spool', 'replay_batch', fallback=5000)
+        self.breaker_failures = cfg.getint('spool', 'breaker_failures', fallback=3)
+        self.breaker_reset = cfg.getfloat('spool', 'breaker_reset', fallback=30)
 
         if cfg.has_section('features'):
             self.thpt = cfg.get('features', "thpt")
@@ -192,27 +607,170 @@ class DATABASE(object):
             self.ue = cfg.get('features', "ue")
             self.anomaly = cfg.get('features', "anomaly")
             self.a1_param = cfg.get('features', "a1_param")
+            self.cell = cfg.get('features', "cell", fallback='ServingCellId')
+            self.schema = self.ingest_schema()
+
 
 class DUMMY(DATABASE):
+    """Replays the UE dataset (src/ue.csv) instead of querying InfluxDB.
+
+    The CSV is read in chunks and is expected in measTimeStampRf order. Every
+    read_data call advances a time cursor by interval * speed of recorded time
+    and returns the rows in between, so each tick sees the workload recorded in
+    that time step and memory stays bounded by the chunk size. At the end of the
+    file the replay starts over if loop is enabled.
+
+    The rows replayed in the last baseline window are kept for baselines(), the
+    training and validation sample (the first limit rows) is read once.
+    """
+
     def __init__(self):
         super().__init__()
-        self.ue_data = pd.read_csv('src/ue.csv')
+        cfg = ConfigParser()
+        cfg.read('src/ad_config.ini')
+        self.path = cfg.get('replay', 'path', fallback='src/ue.csv')
+        self.chunksize = cfg.getint('replay', 'chunksize', fallback=10000)
+        self.step = pd.Timedelta(seconds=cfg.getfloat('pipeline', 'interval', fallback=0.5) * cfg.getfloat('replay', 'speed', fallback=1.0))
+        self.loop = cfg.getboolean('replay', 'loop', fallback=True)
+        self.history = pd.Timedelta('20s')
+        self.sample = None
+        self.rewind()
+
+    def rewind(self):
+        self.chunks = None
+        self.buffer = None
+        self.times = None
+        self.cursor = None
+        self.recent = None
+        self.recent_times = None
 
     def connect(self):
         return True
 
+    def head(self, limit):
+        """The first limit rows of the dataset, read from disk once"""
+        if self.sample is None or self.sample[0] != limit:
+            self.sample = (limit, pd.read_csv(self.path, nrows=limit, dtype=self.schema))
+        return self.sample[1]
+
     def read_data(self, train=False, valid=False, limit=100000):
-        if not train:
-            self.data = self.ue_data.head(limit)
+        if train:
+            self.data = self.head(limit).drop(columns=['anomaly'], errors='ignore')
+        elif valid:
+            self.data = self.head(limit).copy()
         else:
-            self.data = self.ue_data.head(limit).drop(columns=['anomaly'], errors='ignore')
+            self.data = self.advance()
+
+    def timestamps(self, chunk):
+        ts = chunk['measTimeStampRf']
+        if pd.api.types.is_numeric_dtype(ts):
+            return pd.to_datetime(ts, unit='ms')
+        return pd.to_datetime(ts)
+
+    def fill(self, end):
+        """Read chunks until the buffer holds a row at or after end, returns False at end of file"""
+        if self.chunks is None:
+            # categories differ between chunks, ids are made categorical per tick in advance()
+            numeric = {col: dtype for col, dtype in (self.schema or {}).items() if dtype != 'category'}
+            self.chunks = pd.read_csv(self.path, chunksize=self.chunksize, dtype=numeric)
+        while self.times is None or len(self.times) == 0 or (end is not None and self.times.iloc[-1] < end):
+            try:
+                chunk = next(self.chunks)
+            except StopIteration:
+                return False
+            times = self.timestamps(chunk)
+            if self.buffer is None:
+                self.buffer, self.times = chunk, times
+            else:
+                self.buffer = pd.concat([self.buffer, chunk], ignore_index=True)
+                self.times = pd.concat([self.times, times], ignore_index=True)
+            if end is None:
+                break
+        return True
+
+    def advance(self):
+        """Return the rows of the next time step, None if the step is empty"""
+        if self.cursor is None:
+            more = self.fill(None)
+            if not more and (self.times is None or len(self.times) == 0):
+                return None
+            self.cursor = self.times.iloc[0]
+        end = self.cursor + self.step
+        more = self.fill(end)
+        n = int((self.times < end).sum())
+        rows = self.buffer.iloc[:n]
+        self.remember(rows, self.times.iloc[:n], end)
+        self.buffer = self.buffer.iloc[n:].reset_index(drop=True)
+        self.times = self.times.iloc[n:].reset_index(drop=True)
+        self.cursor = end
+        if not more and len(self.times) == 0 and self.loop:
+            self.rewind()
+        return self.compact(rows) if len(rows) > 0 else None
+
+    def remember(self, rows, times, end):
+        """Keep the replayed rows of the last history of recorded time for baselines()"""
+        if self.recent is None:
+            self.recent, self.recent_times = rows, times
+        elif len(rows) > 0:
+            self.recent = pd.concat([self.recent, rows], ignore_index=True)
+            self.recent_times = pd.concat([self.recent_times, times], ignore_index=True)
+        keep = (self.recent_times >= end - self.history).to_numpy()
+        if not keep.all():
+            self.recent = self.recent[keep].reset_index(drop=True)
+            self.recent_times = self.recent_times[keep].reset_index(drop=True)
+
+    def count_complete(self, train=False, valid=False, fields=None):
+        return len(self.head(100000).dropna())
+
+    def baselines(self, ues, window='20s', agg='max', fields=None):
+        """Per UE aggregate over the rows replayed in the last window of recorded time"""
+        fields = list(fields or [self.thpt, self.rsrp, self.rsrq])
+        window = pd.Timedelta(window)
+        self.history = max(self.history, window)
+        if self.recent is None or len(self.recent) == 0:
+            return pd.DataFrame(columns=fields, dtype='float64')
+        rows = self.recent[(self.recent_times >= self.cursor - window).to_numpy()]
+        keys = rows[self.ue].astype(str)
+        rows = rows[keys.isin([str(ue) for ue in ues])]
+        grouped = rows.groupby(keys[rows.index])[fields]
+        result = getattr(grouped, agg)() if agg in ('max', 'min', 'mean') else grouped.quantile(float(agg))
+        return result.astype('float64')
+
+    def last_timestamps(self, measurements=None):
+        """The replayed file stands for every measurement, its modification time is the latest point"""
+        stamp = pd.Timestamp(os.path.getmtime(self.path), unit='s', tz='UTC')
+        return {m: stamp for m in measurements or [self.meas]}
+
+    def oldest(self, meas, before):
+        return None
+
+    def count_range(self, meas, start, stop):
+        return 0
+
+    def delete_range(self, meas, start, stop):
+        pass
+
+    def read_range(self, start, stop):
+        """Rows of the whole dataset with start <= measTimeStampRf < stop, read chunk by chunk"""
+        start, stop = pd.Timestamp(start).tz_localize(None), pd.Timestamp(stop).tz_localize(None)
+        numeric = {col: dtype for col, dtype in (self.schema or {}).items() if dtype != 'category'}
+        parts = []
+        for chunk in pd.read_csv(self.path, chunksize=self.chunksize, dtype=numeric):
+            times = self.timestamps(chunk)
+            parts.append(chunk[((times >= start) & (times < stop)).to_numpy()])
+            if len(times) > 0 and times.iloc[-1] >= stop:
+                break
+        df = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame()
+        return self.compact(df) if len(df) > 0 else df
 
     def write_anomaly(self, df, meas_name='AD'):
         pass
 
-    def query(self, query=None):
-        return {'UEReports': self.ue_data.head(1)}
+    def write_bulk(self, df, meas='AD', batch_size=5000):
+        pass
 
+    def query(self, query=None):
+        return self.data if self.data is not None else pd.DataFrame()
 
 
 # import time
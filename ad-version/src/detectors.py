@@ -0,0 +1,117 @@
+# ==================================================================================
+#  Copyright (c) 2020 HCL Technologies Limited.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+# ==================================================================================
+
+"""
+Anomaly detectors served by modelling.
+
+Detectors follow the scikit-learn outlier detector convention, so a fitted
+IsolationForest and the built-in detectors are interchangeable wherever the
+model is used (scaling batch, per cell models, score cache): fit(X),
+score_samples(X) (the lower, the more abnormal) and predict(X) (-1: anomalous,
+1: normal). Online detectors set online and implement update(X), which
+modelling calls with every scored batch.
+"""
+
+from abc import ABC, abstractmethod
+import numpy as np
+
+# consistency constant of the median absolute deviation for normal data
+MAD_SCALE = 1.4826
+# ratio of the median to the mean absolute deviation for normal data
+MEAN_TO_MAD = 0.8453
+
+
+class Detector(ABC):
+    """ Interface of the anomaly detection backends, a backend missing one of the
+    abstract methods fails when it is constructed
+    """
+    online = False
+
+    @abstractmethod
+    def fit(self, X):
+        """ Fit on X and return self """
+
+    @abstractmethod
+    def score_samples(self, X):
+        """ Score of each sample, the lower, the more abnormal """
+
+    @abstractmethod
+    def predict(self, X):
+        """ -1 for anomalous, 1 for normal samples """
+
+    def update(self, X):
+        """ Follow the stream with a scored batch, online detectors only """
+
+
+class RobustZScore(Detector):
+    r""" Streaming robust z-score detector.
+
+    Keeps a running median and median absolute deviation per feature, both
+    updated in O(1) per sample by stochastic approximation, and scores a sample
+    by its largest absolute robust z-score over the features. A sample is
+    anomalous when that score exceeds threshold.
+
+    Parameters
+    ----------
+    threshold: float (default=3.5)
+        robust z-score above which a sample is anomalous
+    alpha: float (default=0.001)
+        weight of a single sample in the running median and deviation
+    """
+    online = True
+
+    def __init__(self, threshold=3.5, alpha=0.001):
+        self.threshold = threshold
+        self.alpha = alpha
+        self.median = None
+        self.mad = None
+
+    def fit(self, X):
+        X = np.asarray(X, dtype=np.float64)
+        self.median = np.median(X, axis=0)
+        self.mad = np.maximum(np.median(np.abs(X - self.median), axis=0), 1e-9)
+        return self
+
+    def score_samples(self, X):
+        z = np.abs(np.asarray(X, dtype=np.float64) - self.median) / (MAD_SCALE * self.mad)
+        return -z.max(axis=1)
+
+    def predict(self, X):
+        return np.where(self.score_samples(X) < -self.threshold, -1, 1)
+
+    def update(self, X):
+        """ Move the median by a step of the current deviation in the direction of the batch
+        and the deviation towards the batch mean absolute deviation, weighted by batch size.
+        """
+        n = len(X)
+        if n == 0:
+            return
+        X = np.asarray(X, dtype=np.float64)
+        weight = 1.0 - (1.0 - self.alpha) ** n
+        deviation = X - self.median
+        self.median += weight * self.mad * np.sign(deviation).mean(axis=0)
+        self.mad += weight * (MEAN_TO_MAD * np.abs(deviation).mean(axis=0) - self.mad)
+        np.maximum(self.mad, 1e-9, out=self.mad)
+
+
+DETECTORS = {'zscore': RobustZScore}
+
+
+def create(name, **params):
+    """ Built-in detector by config name """
+    if name not in DETECTORS:
+        raise ValueError("Unknown detector {}, expected one of {}".format(name, sorted(DETECTORS)))
+    return DETECTORS[name](**params)
@@ -0,0 +1,96 @@
+# ==================================================================================
+#  Copyright (c) 2020 HCL Technologies Limited.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+# ==================================================================================
+
+import os
+import joblib
+import numpy as np
+from mdclogpy import Logger
+
+logger = Logger(name=__name__)
+
+
+def save_stats(data, path='src/feature_stats'):
+    """ Save per feature mean and variance of the scaled training data next to the model """
+    values = np.asarray(data, dtype=np.float64)
+    joblib.dump({'mean': values.mean(axis=0), 'var': values.var(axis=0), 'count': len(values)}, path)
+
+
+class DriftMonitor(object):
+    r""" Online drift monitor over the scaled model features.
+
+    Keeps an exponentially weighted mean and variance per feature, updated in
+    O(1) per sample, and scores drift as the largest shift of the running mean
+    from the training mean in training standard deviations. Retraining is due
+    once the score stayed above threshold for patience consecutive updates.
+
+    Parameters
+    ----------
+    mean: array
+        per feature mean of the training data
+    var: array
+        per feature variance of the training data
+    alpha: float (default=0.01)
+        weight of a single sample in the running statistics
+    threshold: float (default=3.0)
+        drift score that counts as drifted
+    patience: int (default=20)
+        consecutive drifted updates before retraining is due
+    """
+
+    def __init__(self, mean, var, alpha=0.01, threshold=3.0, patience=20):
+        self.ref_mean = np.asarray(mean, dtype=np.float64)
+        self.ref_std = np.sqrt(np.asarray(var, dtype=np.float64)) + 1e-9
+        self.alpha = alpha
+        self.threshold = threshold
+        self.patience = patience
+        self.reset()
+
+    @classmethod
+    def load(cls, path='src/feature_stats', **kwargs):
+        """ Monitor for the statistics saved with the model, None if the model has none """
+        if not os.path.isfile(path):
+            logger.warning("No feature statistics in {}, drift monitoring disabled".format(path))
+            return None
+        stats = joblib.load(path)
+        return cls(stats['mean'], stats['var'], **kwargs)
+
+    def reset(self):
+        self.mean = self.ref_mean.copy()
+        self.var = (self.ref_std - 1e-9) ** 2
+        self.score = 0.0
+        self.exceeded = 0
+
+    def update(self, values):
+        """ Fold a batch of scaled samples into the running statistics.
+
+        Returns
+        -------
+        due: bool
+            True when retraining is due
+        """
+        n = len(values)
+        if n == 0:
+            return False
+        weight = 1.0 - (1.0 - self.alpha) ** n
+        delta = values.mean(axis=0) - self.mean
+        self.mean += weight * delta
+        self.var = (1.0 - weight) * (self.var + weight * delta ** 2) + weight * values.var(axis=0)
+        self.score = float(np.max(np.abs(self.mean - self.ref_mean) / self.ref_std))
+        self.exceeded = self.exceeded + 1 if self.score > self.threshold else 0
+        return self.due()
+
+    def due(self):
+        return self.exceeded >= self.patience
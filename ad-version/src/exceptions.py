@@ -23,3 +23,8 @@ class Error(Exception):
 class NoDataError(BaseException):
     """Raised when there is no data available in database for a given measurment"""
     pass
+
+
+class DatabaseUnavailableError(Error):
+    """Raised when InfluxDB can not be reached, instead of blocking until it is back"""
+    pass
@@ -0,0 +1,118 @@
+# ==================================================================================
+#  Copyright (c) 2020 HCL Technologies Limited.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+# ==================================================================================
+
+"""
+Fast decoder for the annotated CSV returned by the InfluxDB v2 query endpoint.
+
+Each table block of the response is handed to the pandas C parser in one call,
+with column types taken from the caller's schema first and the ``#datatype``
+annotation second, so no per-record objects are created. Blocks are
+concatenated, the result is always a single DataFrame.
+"""
+
+import csv
+import io
+import re
+import pandas as pd
+
+# Flux bookkeeping columns that are not used by the xApp
+DROP = {'', 'result', 'table', '_start', '_stop'}
+
+# annotation datatype -> pandas dtype, None lets the parser infer (longs with gaps become float)
+DATATYPES = {
+    'string': str,
+    'double': 'float64',
+    'boolean': None,
+    'long': None,
+    'unsignedLong': None,
+    'duration': None,
+}
+
+BLOCK = re.compile(rb'\r?\n\r?\n')
+
+
+class FluxQueryError(Exception):
+    """Raised when the query response carries an error table"""
+    pass
+
+
+def decode(response, schema=None):
+    """ Decode an annotated CSV query response into one DataFrame
+
+    Parameters
+    ----------
+    response: HTTPResponse, bytes or str
+        raw response of QueryApi.query_raw
+    schema: dict (default=None)
+        column name -> dtype, takes precedence over the annotations
+
+    Returns
+    -------
+    DataFrame with the Flux bookkeeping columns removed, empty if no rows
+    """
+    if hasattr(response, 'read'):
+        data = response.read()
+    elif isinstance(response, str):
+        data = response.encode()
+    else:
+        data = response
+    schema = schema or {}
+    frames = [frame for frame in (decode_block(block, schema) for block in BLOCK.split(data)) if frame is not None]
+    if not frames:
+        return pd.DataFrame()
+    if len(frames) == 1:
+        return frames[0]
+    frame = pd.concat(frames, ignore_index=True)
+    # blocks carry their own categories, concat falls back to object columns
+    categorical = {name: 'category' for name, dtype in schema.items() if dtype == 'category' and name in frame.columns}
+    return frame.astype(categorical) if categorical else frame
+
+
+def decode_block(block, schema):
+    """ Decode one table block: annotation rows, a header row and data rows """
+    block = block.strip()
+    lines = block.split(b'\n', 8)
+    datatypes = []
+    skip = 0
+    for line in lines:
+        if not line.startswith(b'#'):
+            break
+        if line.startswith(b'#datatype'):
+            datatypes = next(csv.reader([line.decode().rstrip('\r')]))
+        skip += 1
+    if skip >= len(lines) or not lines[skip].strip():
+        return None
+    header = next(csv.reader([lines[skip].decode().rstrip('\r')]))
+    if 'error' in header and 'reference' in header:
+        raise FluxQueryError(block.decode(errors='replace'))
+    keep = [i for i, name in enumerate(header) if name not in DROP]
+    dtypes = {}
+    dates = []
+    for i in keep:
+        name = header[i]
+        kind = datatypes[i] if i < len(datatypes) else ''
+        if name in schema:
+            dtypes[name] = schema[name]
+        elif kind.startswith('dateTime'):
+            dates.append(name)
+        elif DATATYPES.get(kind) is not None:
+            dtypes[name] = DATATYPES[kind]
+    frame = pd.read_csv(io.BytesIO(block), skiprows=skip + 1, header=None, names=header,
+                        usecols=keep, dtype=dtypes, keep_default_na=False, na_values=[''],
+                        skip_blank_lines=True)
+    for name in dates:
+        frame[name] = pd.to_datetime(frame[name], utc=True)
+    return frame
@@ -46,8 +46,9 @@ class INSERTDATA:
         print("Connected to InfluxDB at {}".format(self.url))
 
     def dropmeas(self, measname):
-        query = f'from(bucket: "{self.bucket}") |> range(start: -1y) |> filter(fn: (r) => r._measurement == "{measname}") |> drop()'
-        self.query_api.query(query)
+        # a query ending in drop() only drops columns from its result, points are removed by the delete API
+        stop = datetime.datetime.now(datetime.timezone.utc)
+        self.client.delete_api().delete('1970-01-01T00:00:00Z', stop, f'_measurement="{measname}"', bucket=self.bucket, org=self.org)
         print("Dropped measurement: " + measname)
 
     def assign_timestamp(self, df):
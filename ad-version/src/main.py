@@ -16,71 +16,282 @@
 
 import json
 import os
+import signal
+import threading
 import time
-import pandas as pd
-import schedule
-from influxdb_client import InfluxDBClient
 from ricxappframe.xapp_frame import Xapp, rmr
 from ricxappframe.xapp_sdl import SDLWrapper
 from mdclogpy import Logger
-from ad_model import modelling, CAUSE
-from ad_train import ModelTraining
 from configparser import ConfigParser
-from database import DATABASE, DUMMY
-
-db = None
-cp = None
-threshold = None
+from profiler import Profiler
+
+# pandas, scikit-learn, influxdb_client and the pipeline contexts are imported on first use
+# (load_model, train_model, connectdb, entry) to keep the xApp start up short
+
+# default pipeline context (the [influxdb] measurement) and all contexts run by this process
+ctx = None
+contexts = []
+training = False
+train_lock = threading.Lock()
+rmr_lock = threading.RLock()
+profiler = Profiler()
+control_mtype = 30010
+checkpointer = None
 sdl = SDLWrapper(use_fake_sdl=True)
 
 logger = Logger(name=__name__)
 
 def entry(self):
-    """If ML model is not present in the path, it will trigger training module to train the model.
-    Calls predict function every 0.5 seconds (as we are using simulated data).
+    """If ML model is not present in the path, it will trigger training module to train the model
+    in the background and serve the bundled fallback model (if any) until training completes.
+    Ticks every pipeline context on a shared thread pool, at the poll interval of its tick controller ([pipeline] adaptive)
+    or every 0.5 seconds if the interval is fixed.
+    With the async pipeline mode, reads and writes of neighbouring ticks overlap with scoring.
     """
+    global training
+    cfg = ConfigParser()
+    cfg.read('src/ad_config.ini')
+    setup_profiler(cfg)
     connectdb()
-    train_model()
+    setup_contexts(cfg)
+    if os.path.isfile('src/model'):
+        load_model()
+    else:
+        load_model(cfg.get('model', 'fallback', fallback='src/fallback'), serve='src')
+        training = True
+        threading.Thread(target=train_in_background, name='ad-train', daemon=True).start()
+    for path in {c.model_path for c in contexts} - {'src'}:
+        load_model(path)
+    setup_checkpoint(self, cfg)
+    setup_retention(cfg)
+    setup_metrics(self, cfg)
+    if cfg.get('pipeline', 'mode', fallback='sync') == 'async':
+        from concurrent.futures import ThreadPoolExecutor
+        from pipeline import Pipeline
+        io = ThreadPoolExecutor(max_workers=2 * len(contexts), thread_name_prefix='ad-io')
+        pipelines = [Pipeline(c.fetch, lambda df, c=c: profiled_score(c, df), c.write, lambda val, c=c: msg_to_ts(self, val, c),
+                              interval=c.interval, queue_size=cfg.getint('pipeline', 'queue_size', fallback=2), ticker=c.ticker, io=io,
+                              poll=(lambda: handle_messages(self)) if c is ctx else None)
+                     for c in contexts]
+        threads = [threading.Thread(target=p.run, name='ad-pipeline', daemon=True) for p in pipelines[1:]]
+        for thread in threads:
+            thread.start()
+        pipelines[0].run()
+        return
+    from context import run
+    run(contexts, lambda c: predict(self, c), workers=cfg.getint('pipeline', 'workers', fallback=0) or None)
+
+def setup_contexts(cfg):
+    """Add the contexts listed in [pipeline] contexts, each configured by its [context.<name>] section."""
+    from context import PipelineContext
+    for name in cfg.get('pipeline', 'contexts', fallback='').split(','):
+        name = name.strip()
+        if name and name not in (c.name for c in contexts):
+            c = PipelineContext.from_config(name, cfg)
+            c.on_drift = retrain
+            contexts.append(c)
+
+def setup_profiler(cfg):
+    """Configure the on-demand profiler from the [profiling] section.
+    Profiling is toggled with SIGUSR1 or an RMR control message, and starts enabled if configured.
+    """
+    global control_mtype
+    profiler.path = cfg.get('profiling', 'dir', fallback='profile')
+    profiler.budget = cfg.getfloat('profiling', 'budget', fallback=0.5)
+    profiler.interval = cfg.getfloat('profiling', 'interval', fallback=0.01)
+    profiler.top = cfg.getint('profiling', 'top', fallback=25)
+    control_mtype = cfg.getint('profiling', 'control_mtype', fallback=30010)
+    try:
+        signal.signal(signal.SIGUSR1, lambda signum, frame: threading.Thread(target=profiler.toggle, daemon=True).start())
+    except ValueError:
+        logger.warning("Not running in the main thread, profiling cannot be toggled with SIGUSR1")
+    if cfg.getboolean('profiling', 'enabled', fallback=False):
+        profiler.enable()
+
+def setup_checkpoint(self, cfg):
+    """Restore the runtime state saved before the last restart and checkpoint it periodically
+    to a local file or SDL ([checkpoint] section). Restored TS messages are sent right away.
+    """
+    global checkpointer
+    if not cfg.getboolean('checkpoint', 'enabled', fallback=False):
+        return
+    from checkpoint import Checkpointer, FileStore, SDLStore
+    if cfg.get('checkpoint', 'store', fallback='file') == 'sdl':
+        store = SDLStore(sdl, cfg.get('checkpoint', 'namespace', fallback='ad'))
+    else:
+        store = FileStore(cfg.get('checkpoint', 'path', fallback='checkpoint.json'))
+    checkpointer = Checkpointer(store, runtime_state, cfg.getfloat('checkpoint', 'interval', fallback=10))
+    for c in contexts:
+        c.checkpointer = checkpointer
+    state = checkpointer.load()
+    if state is None:
+        return
+    age = time.time() - state.get('saved_at', 0)
+    if age > cfg.getfloat('checkpoint', 'max_age', fallback=600):
+        logger.warning("Checkpoint is {:.0f}s old, starting from scratch".format(age))
+        return
+    restore(state)
+    for c in contexts:
+        if c.pending:
+            logger.info("Sending {} message(s) to TS restored from the checkpoint of {}".format(len(c.pending), c.name))
+            send_pending(self, c)
+
+def setup_retention(cfg):
+    """Delete the points older than their retention ([retention] section) in a background thread,
+    in bounded time chunks every interval seconds. Every context expires its own bucket: the
+    default context the measurements of [retention], the other ones those of the retention
+    key of their [context.<name>] section, or by default their input and output measurements
+    with the retention of the default input (UEReports) and output (AD).
+    """
+    if not cfg.getboolean('retention', 'enabled', fallback=False):
+        return
+    import pandas as pd
+    from retention import Retention, loop, policies
+    keep = policies(cfg.get('retention', 'measurements', fallback='')) or {ctx.db.meas: pd.Timedelta('240h'), ctx.output: pd.Timedelta('240h')}
+    ages = (keep.get(ctx.db.meas, pd.Timedelta('240h')), keep.get(ctx.output, pd.Timedelta('240h')))
+    retentions = []
+    seen = set()
+    for c in contexts:
+        if c is ctx:
+            own = keep
+        else:
+            own = policies(cfg.get('context.' + c.name, 'retention', fallback='')) or {c.db.meas: ages[0], c.output: ages[1]}
+        own = {meas: age for meas, age in own.items() if (c.db.bucket, meas) not in seen}
+        seen.update((c.db.bucket, meas) for meas in own)
+        if own:
+            retentions.append(Retention(c.db, own, chunk=pd.Timedelta(cfg.get('retention', 'chunk', fallback='1h')),
+                                        max_chunks=cfg.getint('retention', 'max_chunks', fallback=24),
+                                        count=cfg.getboolean('retention', 'count', fallback=True)))
+            logger.info("Retention enforced in {}/{}: {}".format(c.name, c.db.bucket, ', '.join('{} {}'.format(m, d) for m, d in own.items())))
+    threading.Thread(target=loop, args=(retentions, cfg.getfloat('retention', 'interval', fallback=3600)),
+                     name='ad-retention', daemon=True).start()
+
+def setup_metrics(self, cfg):
+    """Report the metrics registry (poll interval and arrival rate of every context, removed points, ...)
+    every interval seconds of the [metrics] section: logged, and sent to the metrics collector over RMR if rmr is set.
+    """
+    if not cfg.getboolean('metrics', 'enabled', fallback=True):
+        return
+    from metrics import Reporter, registry
+    send = None
+    if cfg.getboolean('metrics', 'rmr', fallback=False):
+        from ricxappframe.metric.metric import MetricsManager
+        manager = MetricsManager(self._mrc, reporter='ad', generator='ad')
+        send = lambda items: send_metrics(manager, items)
+    reporter = Reporter(registry, cfg.getfloat('metrics', 'interval', fallback=60), send)
+    threading.Thread(target=reporter.loop, name='ad-metrics', daemon=True).start()
+
+def send_metrics(manager, items):
+    """Send the (name, value, type) items as one metrics report (message type RIC_METRICS)."""
+    from ricxappframe.metric.metric import MetricData
+    with rmr_lock:
+        manager.send_metrics([MetricData(name, str(value), kind) for name, value, kind in items])
+
+def runtime_state():
+    """Runtime state of every context: read watermark, cached UE baselines, last alert per UE and unsent TS messages."""
+    return {'saved_at': time.time(), 'contexts': {c.name: c.state() for c in contexts}}
+
+def restore(state):
+    """Resume every context from its checkpointed state (checkpoints of a single context
+    written before contexts were introduced restore the default context).
+    """
+    saved = state.get('contexts', {ctx.name: state})
+    for c in contexts:
+        if c.name in saved:
+            c.restore(saved[c.name])
+
+def load_model(path='src', serve=None):
+    """Load the model bundle from path, run a warm-up batch through it and serve it in every context
+    configured with the bundle serve (path if None), or in the default context if there is none.
+    Contexts keep their current model while no bundle is available, predictions are skipped until one is served.
+    """
+    from ad_model import modelling, ScoreCache
+    cfg = ConfigParser()
+    cfg.read('src/ad_config.ini')
+    model = modelling(path=path)
+    if not model.ready():
+        logger.warning("No model bundle in {}, predictions start once training completes".format(path))
+        return
+    warmup = cfg.getint('model', 'warmup_rows', fallback=256)
+    if warmup > 0:
+        model.warmup(warmup)
+    size = cfg.getint('model', 'cache_size', fallback=0)
+    drift = None
+    if cfg.getboolean('drift', 'enabled', fallback=False):
+        from drift import DriftMonitor
+        drift = lambda: DriftMonitor.load(os.path.join(path, 'feature_stats'), alpha=cfg.getfloat('drift', 'alpha', fallback=0.01),
+                                          threshold=cfg.getfloat('drift', 'threshold', fallback=3.0),
+                                          patience=cfg.getint('drift', 'patience', fallback=20))
+    for c in [c for c in contexts if c.model_path == (serve or path)] or [ctx]:
+        c.md = model.fork(cache=ScoreCache(size, cfg.getfloat('model', 'cache_quantum', fallback=1e-4)) if size > 0 else None,
+                          drift=drift() if drift is not None else None)
+        c.db.set_schema(model.num)
+        logger.info("Serving model bundle from {} in {}".format(path, c.name))
+
+def train_model(force=False):
+    """Train on a database instance of its own, reads of the training range never share
+    the frame of the default context that is scoring the live samples meanwhile.
+    """
+    if force or not os.path.isfile('src/model'):
+        from ad_train import ModelTraining
+        db = type(ctx.db)()
+        db.bucket, db.meas = ctx.db.bucket, ctx.db.meas
+        try:
+            mt = ModelTraining(db)
+            mt.train()
+        finally:
+            db.close()
+
+def train_in_background(force=False):
+    """Train the model while the current (or fallback) model is served, then switch to the new bundle."""
+    global training
+    try:
+        train_model(force)
+    except Exception as e:
+        logger.error("Background training failed: {}".format(e))
+        return
+    finally:
+        training = False
     load_model()
-    schedule.every(0.5).seconds.do(predict, self)
-    while True:
-        schedule.run_pending()
-
-def load_model():
-    global md
-    global cp
-    global threshold
-    md = modelling()
-    cp = CAUSE()
-    threshold = 70
-    logger.info("Throughput threshold parameter is set as {}% (default)".format(threshold))
-
-def train_model():
-    if not os.path.isfile('src/model'):
-        mt = ModelTraining(db)
-        mt.train()
-
-def predict(self):
+
+def retrain(c):
+    """Start retraining in the background unless a training is already running."""
+    global training
+    with train_lock:
+        if training:
+            return
+        training = True
+    logger.info("Feature drift score {:.2f} of {} above threshold, retraining".format(c.md.drift.score, c.name))
+    c.md.drift.reset()
+    threading.Thread(target=train_in_background, args=(True,), name='ad-train', daemon=True).start()
+
+def predict(self, c=None):
     """Read the latest UE sample from InfluxDB and detect if it is anomalous or normal.
     Send the UEID, DUID, Degradation type, and timestamp for the anomalous samples to Traffic Steering (RMR with the message type as 30003).
     Get the acknowledgement of the sent message from traffic steering.
+
+    Parameters
+    ----------
+    c: PipelineContext (default=None)
+        context to tick, the default context if None
+
+    Returns
+    -------
+    rows: number of samples scored
     """
-    db.read_data()
-    val = None
-    if db.data is not None:
-        if set(md.num).issubset(db.data.columns):
-            db.data = db.data.dropna(axis=0)
-            if len(db.data) > 0:
-                val = predict_anomaly(self, db.data)
-        else:
-            logger.warning("Parameters do not match with training data")
-    else:
-        logger.warning("No data in the last 1 second")
-        time.sleep(1)
+    c = c or ctx
+    with profiler.tick(c.name):
+        df = c.fetch()
+        val = None
+        if df is not None:
+            val = predict_anomaly(self, df, c)
     if (val is not None) and (len(val) > 2):
-        msg_to_ts(self, val)
+        msg_to_ts(self, val, c)
+    else:
+        handle_messages(self)
+    return 0 if df is None else len(df)
 
-def predict_anomaly(self, df):
+def predict_anomaly(self, df, c=None):
     """Calls ad_predict to detect if the given sample is normal or anomalous.
     Finds out the degradation type if the sample is anomalous.
     Writes the given sample along with the predicted label to AD measurement.
@@ -88,53 +299,75 @@ def predict_anomaly(self, df):
     Parameters
     ----------
     df: DataFrame
+    c: PipelineContext (default=None)
+        context scoring the samples, the default context if None
 
     Returns
     -------
     val: JSON string of anomalous sample info (UEID, DUID, TimeStamp, Degradation type)
     """
-    df['Anomaly'] = md.predict(df)
-    df.loc[:, 'Degradation'] = ''
-    val = None
-    if 1 in df.Anomaly.unique():
-        df.loc[:, ['Anomaly', 'Degradation']] = cp.cause(df, db, threshold)
-        df_a = df.loc[df['Anomaly'] == 1].copy()
-        if len(df_a) > 0:
-            df_a['time'] = df_a.index
-            cols = [db.ue, 'time', 'Degradation']
-            result = json.loads(df_a.loc[:, cols].to_json(orient='records'))
-            val = json.dumps(result).encode()
-    df.loc[:, 'RRU.PrbUsedDl'] = df['RRU.PrbUsedDl'].astype('float')
-    df.index = pd.date_range(start=df.index[0], periods=len(df), freq='1ms')
-    db.write_anomaly(df)
+    c = c or ctx
+    df, val = c.score(df)
+    c.write(df)
     return val
 
-def msg_to_ts(self, val):
-    """Send message from AD to TS."""
+def profiled_score(c, df):
+    """PipelineContext.score as a pipeline stage, profiled as one tick."""
+    with profiler.tick(c.name):
+        return c.score(df)
+
+def msg_to_ts(self, val, c=None):
+    """Send message from AD to TS. Messages that could not be sent are kept (and checkpointed)
+    and sent first on the next call.
+    """
+    c = c or ctx
     logger.debug("Sending Anomalous UE to TS")
-    success = self.rmr_send(val, 30003)
-    if success:
-        logger.info("Message to TS: message sent successfully")
+    with rmr_lock:
+        c.pending.append(val)
+        send_pending(self, c)
         # RMR receive to get the acknowledgement message from the traffic steering.
-    for summary, sbuf in self.rmr_get_messages():
-        if sbuf.contents.mtype == 30004:
-            logger.info("Received acknowledgement from TS (TS_ANOMALY_ACK): {}".format(summary))
-        if sbuf.contents.mtype == 20010:
-            a1_request_handler(self, summary, sbuf)
-        self.rmr_free(sbuf)
+        handle_messages(self)
+
+def send_pending(self, c):
+    """Send the pending TS messages of context c in order, up to the first one that fails."""
+    with rmr_lock:
+        while c.pending:
+            if not self.rmr_send(c.pending[0], 30003):
+                logger.warning("Message to TS failed, {} message(s) pending".format(len(c.pending)))
+                break
+            c.pending.popleft()
+            logger.info("Message to TS: message sent successfully")
+
+def handle_messages(self):
+    """Handle the received RMR messages: TS acknowledgements, A1 policies and profiling control."""
+    with rmr_lock:
+        for summary, sbuf in self.rmr_get_messages():
+            if sbuf.contents.mtype == 30004:
+                logger.info("Received acknowledgement from TS (TS_ANOMALY_ACK): {}".format(summary))
+            if sbuf.contents.mtype == 20010:
+                a1_request_handler(self, summary, sbuf)
+            if sbuf.contents.mtype == control_mtype:
+                profiling_request_handler(summary)
+            self.rmr_free(sbuf)
+
+def profiling_request_handler(summary):
+    """Handle a profiling control message {"profiling": "on" | "off" | "toggle"}."""
+    try:
+        req = json.loads(summary[rmr.RMR_MS_PAYLOAD])
+    except (json.decoder.JSONDecodeError, KeyError):
+        logger.error("Failed to parse profiling request")
+        return
+    threading.Thread(target=profiler.control, args=(req,), daemon=True).start()
 
 def connectdb(thread=False):
-    """Create a connection to InfluxDB if thread=True, otherwise it will create a dummy data instance."""
-    global db
+    """Create the default pipeline context with a connection to InfluxDB if thread=False, otherwise with a dummy data instance."""
+    global ctx
+    from context import DEFAULT, PipelineContext
     cfg = ConfigParser()
-    cfg.read('ad_config.ini')
-    if thread:
-        db = DUMMY()  # Ensure DUMMY class is updated for InfluxDB v2.x as needed
-    else:
-        db = DATABASE()  # Ensure DATABASE class is updated for InfluxDB v2.x
-    success = False
-    while not success:
-        success = db.connect()
+    cfg.read('src/ad_config.ini')
+    ctx = PipelineContext.from_config(DEFAULT, cfg, dummy=thread)
+    ctx.on_drift = retrain
+    contexts[:] = [ctx]
 
 def a1_request_handler(self, summary, sbuf):
     """Handles A1 policy requests."""
@@ -157,12 +390,16 @@ def a1_request_handler(self, summary, sbuf):
     self.rmr_free(sbuf)
 
 def change_threshold(self, req: dict):
-    """Update throughput threshold parameter based on A1 policy request."""
-    global threshold
+    """Update throughput threshold parameter based on A1 policy request.
+    The policy applies to the context named by its "context" field, to every context if it has none.
+    """
     if req["operation"] == "CREATE":
-        payload = req["payload"]
-        threshold = json.loads(payload)[db.a1_param]
-        logger.info("Throughput threshold parameter updated to: {}%".format(threshold))
+        payload = json.loads(req["payload"])
+        threshold = payload[ctx.db.a1_param]
+        for c in contexts:
+            if payload.get("context", c.name) == c.name:
+                c.threshold = threshold
+                logger.info("Throughput threshold parameter of {} updated to: {}%".format(c.name, threshold))
 
 def verifyPolicy(req: dict):
     """Verify A1 policy request."""
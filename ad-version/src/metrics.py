@@ -0,0 +1,96 @@
+# ==================================================================================
+#  Copyright (c) 2020 HCL Technologies Limited.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+# ==================================================================================
+
+import threading
+import time
+from mdclogpy import Logger
+
+logger = Logger(name=__name__)
+
+
+class Registry(object):
+    r""" Process wide registry of named gauges and counters.
+
+    Components publish their current state here (e.g. the tick controller's
+    poll interval) and the values can be read as one consistent snapshot.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {}
+        self.counters = set()
+
+    def set(self, name, value):
+        with self.lock:
+            self.values[name] = value
+
+    def inc(self, name, value=1):
+        with self.lock:
+            self.values[name] = self.values.get(name, 0) + value
+            self.counters.add(name)
+
+    def get(self, name, default=None):
+        with self.lock:
+            return self.values.get(name, default)
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.values)
+
+    def items(self):
+        """ (name, value, type) of every metric, type is counter or gauge """
+        with self.lock:
+            return [(name, value, 'counter' if name in self.counters else 'gauge') for name, value in sorted(self.values.items())]
+
+
+class Reporter(object):
+    r""" Reports the registry every interval seconds.
+
+    The snapshot is logged and, if send is given, passed to it as a list of
+    (name, value, type), e.g. to send it as an xApp metrics report over RMR.
+
+    Parameters
+    ----------
+    registry: Registry
+    interval: float (default=60)
+        seconds between two reports
+    send: callable (default=None)
+    """
+
+    def __init__(self, registry, interval=60.0, send=None):
+        self.registry = registry
+        self.interval = interval
+        self.send = send
+
+    def report(self):
+        items = self.registry.items()
+        if not items:
+            return
+        logger.info("Metrics: {}".format(', '.join('{}={:.4g}'.format(name, value) if isinstance(value, float)
+                                                   else '{}={}'.format(name, value) for name, value, _ in items)))
+        if self.send is not None:
+            try:
+                self.send(items)
+            except Exception as e:
+                logger.error("Sending metrics failed: {}".format(e))
+
+    def loop(self):
+        while True:
+            time.sleep(self.interval)
+            self.report()
+
+
+registry = Registry()
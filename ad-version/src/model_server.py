@@ -0,0 +1,252 @@
+# ==================================================================================
+#  Copyright (c) 2020 HCL Technologies Limited.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+# ==================================================================================
+
+"""
+Shared memory serving of the model bundle for several worker processes.
+
+The publisher flattens the trees of the IsolationForest into a few node
+arrays (global feature index, threshold, children and the path length
+credited at each leaf) and writes them, the feature names and the fitted
+scaler into one shared memory segment per model generation. A small control
+segment holds the current generation. Workers attach read-only, evaluate the
+forest with NumPy on the shared arrays and re-attach when the generation
+changes, so a new model is picked up without restarting them and the forest
+is held in memory once however many workers there are.
+"""
+
+import json
+import pickle
+import struct
+import sys
+import threading
+import time
+import numpy as np
+from multiprocessing import resource_tracker, shared_memory
+from mdclogpy import Logger
+
+logger = Logger(name=__name__)
+
+# control segment: generation (int64)
+CONTROL = struct.Struct('q')
+ARRAYS = ('feature', 'threshold', 'left', 'right', 'leaf')
+attach_lock = threading.Lock()
+
+
+def average_path_length(n):
+    """ Average path length of an unsuccessful search in a binary search tree of n samples """
+    n = np.asarray(n, dtype=np.float64)
+    result = np.zeros_like(n)
+    result[n == 2] = 1.0
+    many = n > 2
+    result[many] = 2.0 * (np.log(n[many] - 1.0) + np.euler_gamma) - 2.0 * (n[many] - 1.0) / n[many]
+    return result
+
+
+def flatten(model):
+    """ Node arrays of all trees of a fitted IsolationForest, children are global node indices
+    and leaf holds the path length credited to a sample ending in that node.
+    """
+    parts = {name: [] for name in ARRAYS}
+    roots = []
+    offset = 0
+    for tree, features in zip(model.estimators_, model.estimators_features_):
+        t = tree.tree_
+        n = t.node_count
+        leaf = t.children_left < 0
+        depth = np.zeros(n, dtype=np.float64)
+        for node in range(n):
+            if not leaf[node]:
+                depth[t.children_left[node]] = depth[node] + 1
+                depth[t.children_right[node]] = depth[node] + 1
+        parts['feature'].append(np.where(leaf, -1, np.asarray(features)[np.maximum(t.feature, 0)]).astype(np.int32))
+        parts['threshold'].append(t.threshold.astype(np.float64))
+        parts['left'].append(np.where(leaf, -1, t.children_left + offset).astype(np.int32))
+        parts['right'].append(np.where(leaf, -1, t.children_right + offset).astype(np.int32))
+        parts['leaf'].append(depth + average_path_length(t.n_node_samples))
+        roots.append(offset)
+        offset += n
+    arrays = {name: np.concatenate(values) for name, values in parts.items()}
+    arrays['roots'] = np.asarray(roots, dtype=np.int32)
+    return arrays
+
+
+class SharedForest(object):
+    r""" IsolationForest evaluated on flattened node arrays, predict follows sklearn
+    (-1: anomalous, 1: normal).
+    """
+
+    def __init__(self, arrays, max_samples, offset, segment=None, chunk=4096):
+        # the segment is closed only once no forest evaluates on its arrays any more
+        self.segment = segment
+        self.feature = arrays['feature']
+        self.threshold = arrays['threshold']
+        self.left = arrays['left']
+        self.right = arrays['right']
+        self.leaf = arrays['leaf']
+        self.roots = arrays['roots']
+        self.denominator = len(self.roots) * float(average_path_length([max_samples])[0])
+        self.offset = offset
+        self.chunk = chunk
+
+    def depths(self, X):
+        rows = np.arange(len(X))[None, :]
+        node = np.repeat(self.roots[:, None], len(X), axis=1)
+        while True:
+            feature = self.feature[node]
+            inner = feature >= 0
+            if not inner.any():
+                break
+            go_left = X[rows, np.maximum(feature, 0)] <= self.threshold[node]
+            node = np.where(inner, np.where(go_left, self.left[node], self.right[node]), node)
+        return self.leaf[node].sum(axis=0)
+
+    def score_samples(self, X):
+        X = np.asarray(X, dtype=np.float32)
+        depths = np.concatenate([self.depths(X[i:i + self.chunk]) for i in range(0, len(X), self.chunk)]) if len(X) else np.zeros(0)
+        if self.denominator == 0:
+            return -np.ones(len(X))
+        return -2 ** (-depths / self.denominator)
+
+    def decision_function(self, X):
+        return self.score_samples(X) - self.offset
+
+    def predict(self, X):
+        return np.where(self.decision_function(X) < 0, -1, 1)
+
+
+class ModelServer(object):
+    r""" Publishes model bundles to shared memory under name.
+
+    Parameters
+    ----------
+    name: str (default='ad-model')
+        name of the control segment, generations are stored in name-<generation>
+    """
+
+    def __init__(self, name='ad-model'):
+        self.name = name
+        self.generation = 0
+        self.segment = None
+        try:
+            self.control = shared_memory.SharedMemory(name=name, create=True, size=CONTROL.size)
+        except FileExistsError:
+            self.control = shared_memory.SharedMemory(name=name)
+            self.generation = CONTROL.unpack_from(self.control.buf)[0]
+
+    def publish(self, model, scale, columns):
+        """ Write a fitted IsolationForest, its scaler and feature names as the next generation
+
+        Returns
+        -------
+        generation: int
+        """
+        arrays = flatten(model)
+        blobs = {'scale': np.frombuffer(pickle.dumps(scale), dtype=np.uint8)}
+        meta = {'columns': list(columns), 'offset': float(model.offset_),
+                'max_samples': int(getattr(model, '_max_samples', model.max_samples_)), 'arrays': {}}
+        position = 0
+        for name, array in list(arrays.items()) + list(blobs.items()):
+            meta['arrays'][name] = [position, array.dtype.str, array.shape]
+            position += -(-array.nbytes // 8) * 8
+        header = json.dumps(meta).encode()
+        start = 8 + -(-len(header) // 8) * 8
+        generation = self.generation + 1
+        segment = shared_memory.SharedMemory(name='{}-{}'.format(self.name, generation), create=True, size=start + max(position, 8))
+        struct.pack_into('q', segment.buf, 0, len(header))
+        segment.buf[8:8 + len(header)] = header
+        for name, array in list(arrays.items()) + list(blobs.items()):
+            offset, dtype, shape = meta['arrays'][name]
+            np.ndarray(shape, dtype=dtype, buffer=segment.buf, offset=start + offset)[...] = array
+        CONTROL.pack_into(self.control.buf, 0, generation)
+        if self.segment is not None:
+            self.segment.close()
+            self.segment.unlink()
+        self.segment = segment
+        self.generation = generation
+        logger.info("Published model generation {} ({} trees, {} nodes, {} bytes) to shared memory {}".format(
+            generation, len(arrays['roots']), len(arrays['leaf']), segment.size, self.name))
+        return generation
+
+    def close(self):
+        """ Remove the published segments, attached workers keep their mapping until they detach """
+        if self.segment is not None:
+            self.segment.close()
+            self.segment.unlink()
+            self.segment = None
+        self.control.close()
+        self.control.unlink()
+
+
+class SharedModel(object):
+    r""" Read-only view of the model published by a ModelServer.
+
+    Attributes
+    ----------
+    model: SharedForest
+    scale: fitted scaler
+    num: list of feature names
+    generation: int
+        generation currently attached, 0 before the first model is published
+    """
+
+    def __init__(self, name='ad-model'):
+        self.name = name
+        self.generation = 0
+        self.control = attach(name)
+
+    def current(self):
+        return CONTROL.unpack_from(self.control.buf)[0]
+
+    def refresh(self):
+        """ Attach to the latest generation, returns True if a new one was attached """
+        while True:
+            generation = self.current()
+            if generation == self.generation:
+                return False
+            try:
+                segment = attach('{}-{}'.format(self.name, generation))
+                break
+            except FileNotFoundError:
+                # superseded while attaching, the control segment holds a newer generation
+                time.sleep(0.001)
+        length = struct.unpack_from('q', segment.buf, 0)[0]
+        meta = json.loads(bytes(segment.buf[8:8 + length]))
+        start = 8 + -(-length // 8) * 8
+        arrays = {}
+        for name, (offset, dtype, shape) in meta['arrays'].items():
+            array = np.ndarray(shape, dtype=dtype, buffer=segment.buf, offset=start + offset)
+            array.flags.writeable = False
+            arrays[name] = array
+        self.scale = pickle.loads(arrays.pop('scale').tobytes())
+        self.model = SharedForest(arrays, meta['max_samples'], meta['offset'], segment)
+        self.num = meta['columns']
+        self.generation = generation
+        return True
+
+
+def attach(name):
+    """ Attach to an existing segment without registering it with the resource tracker, which
+    would otherwise unlink it when an attached worker exits (track=False from Python 3.13).
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    with attach_lock:
+        register = resource_tracker.register
+        resource_tracker.register = lambda name, rtype: None
+        try:
+            return shared_memory.SharedMemory(name=name)
+        finally:
+            resource_tracker.register = register
@@ -0,0 +1,144 @@
+# ==================================================================================
+#  Copyright (c) 2020 HCL Technologies Limited.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+# ==================================================================================
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from mdclogpy import Logger
+
+logger = Logger(name=__name__)
+
+
+class Pipeline(object):
+    r""" Pipelined read -> score -> write execution of the prediction loop.
+
+    Each stage runs as an asyncio task connected to the next one by a bounded
+    queue, so the InfluxDB read of tick N+1 and the write of tick N-1 run in the
+    I/O threads while tick N is scored. There is a single scorer and a single
+    writer consuming the queues in FIFO order, so results are written and sent
+    to TS in the order the ticks were read.
+
+    Parameters
+    ----------
+    read: callable
+        returns the DataFrame to score, or None when there is nothing new
+    score: callable
+        takes a DataFrame and returns (DataFrame, message or None)
+    write: callable
+        stores a scored DataFrame
+    send: callable
+        sends a message to TS
+    interval: float (default=0.5)
+        seconds between the start of two reads
+    queue_size: int (default=2)
+        number of ticks that can wait between two stages
+    ticker: TickController (default=None)
+        adapts the interval between reads to the data arrival rate and the
+        scoring time, the interval is fixed if None
+    io: ThreadPoolExecutor (default=None)
+        I/O threads shared with other pipelines, the pipeline creates and
+        shuts down its own if None
+    poll: callable (default=None)
+        called in the I/O threads once per tick whether or not samples were
+        read, e.g. to handle the incoming RMR messages
+    """
+
+    def __init__(self, read, score, write, send, interval=0.5, queue_size=2, ticker=None, io=None, poll=None):
+        self.read = read
+        self.poll = poll
+        self.score = score
+        self.write = write
+        self.send = send
+        self.interval = interval
+        self.queue_size = queue_size
+        self.ticker = ticker
+        self.running = False
+        self.shared_io = io is not None
+        self.io = io or ThreadPoolExecutor(max_workers=2, thread_name_prefix='ad-io')
+        self.cpu = ThreadPoolExecutor(max_workers=1, thread_name_prefix='ad-score')
+
+    def run(self, ticks=None):
+        """ Run the pipeline until stop() is called or the given number of ticks were read """
+        asyncio.run(self.main(ticks))
+
+    def stop(self):
+        self.running = False
+
+    async def main(self, ticks=None):
+        self.running = True
+        scored = asyncio.Queue(self.queue_size)
+        done = asyncio.Queue(self.queue_size)
+        try:
+            await asyncio.gather(self.reader(scored, ticks), self.scorer(scored, done), self.writer(done))
+        finally:
+            if not self.shared_io:
+                self.io.shutdown(wait=False)
+            self.cpu.shutdown(wait=False)
+
+    async def reader(self, outbox, ticks):
+        loop = asyncio.get_running_loop()
+        seq = 0
+        while self.running and (ticks is None or seq < ticks):
+            start = loop.time()
+            seq += 1
+            try:
+                df = await loop.run_in_executor(self.io, self.read)
+            except Exception as e:
+                logger.error("Pipeline read failed: {}".format(e))
+                df = None
+            if df is not None:
+                await outbox.put(df)
+            if self.poll is not None:
+                try:
+                    await loop.run_in_executor(self.io, self.poll)
+                except Exception as e:
+                    logger.error("Pipeline poll failed: {}".format(e))
+            interval = self.interval
+            if self.ticker is not None:
+                self.ticker.arrived(0 if df is None else len(df))
+                interval = self.ticker.next_interval()
+            await asyncio.sleep(max(0.0, interval - (loop.time() - start)))
+        await outbox.put(None)
+
+    async def scorer(self, inbox, outbox):
+        loop = asyncio.get_running_loop()
+        while True:
+            df = await inbox.get()
+            if df is None:
+                break
+            start = loop.time()
+            try:
+                result = await loop.run_in_executor(self.cpu, self.score, df)
+            except Exception as e:
+                logger.error("Pipeline scoring failed: {}".format(e))
+                continue
+            if self.ticker is not None:
+                self.ticker.processed(loop.time() - start)
+            await outbox.put(result)
+        await outbox.put(None)
+
+    async def writer(self, inbox):
+        loop = asyncio.get_running_loop()
+        while True:
+            result = await inbox.get()
+            if result is None:
+                break
+            df, val = result
+            if val is not None and len(val) > 2:
+                self.send(val)
+            try:
+                await loop.run_in_executor(self.io, self.write, df)
+            except Exception as e:
+                logger.error("Pipeline write failed: {}".format(e))
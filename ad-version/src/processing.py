@@ -14,6 +14,7 @@
 #  limitations under the License.
 # ==================================================================================
 
+import os
 import pandas as pd
 import numpy as np
 import joblib
@@ -27,6 +28,8 @@ class PREPROCESS(object):
     ----------
     data: pandas dataframe
         input dataset to process in pandas dataframe
+    path: str (default='src')
+        directory the scaler and the parameter list are saved in
 
     Attributes
     ----------
@@ -36,11 +39,12 @@ class PREPROCESS(object):
         list of attributes to drop
     """
 
-    def __init__(self, data):
+    def __init__(self, data, path='src'):
         """
            Columns that are not useful for the prediction will be dropped(UEID, Category, & Timestamp)
         """
         self.data = data
+        self.path = path
         self.convert_gb_to_mb()
 
     def variation(self):
@@ -72,14 +76,14 @@ class PREPROCESS(object):
     def fit_transform(self):
         """ use normalizer transformation to bring all parameters in same scale """
         scale = Normalizer().fit(self.data)
-        joblib.dump(scale, 'src/scale')
+        joblib.dump(scale, os.path.join(self.path, 'scale'))
 
     def transform(self):
-        scale = joblib.load('src/scale')
-        self.data = pd.DataFrame(scale.transform(self.data), columns=self.data.columns)
+        scale = joblib.load(os.path.join(self.path, 'scale'))
+        self.data = pd.DataFrame(scale.transform(self.data), columns=self.data.columns, index=self.data.index)
 
     def save_cols(self):
-        joblib.dump(self.data.columns, 'src/num_params')
+        joblib.dump(self.data.columns, os.path.join(self.path, 'num_params'))
 
     def process(self):
         """
@@ -0,0 +1,172 @@
+# ==================================================================================
+#  Copyright (c) 2020 HCL Technologies Limited.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+# ==================================================================================
+
+import cProfile
+import io
+import itertools
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from mdclogpy import Logger
+
+logger = Logger(name=__name__)
+
+
+class Profiler(object):
+    r""" On demand profiling of the running xApp, toggled by signal, RMR message or config.
+
+    While enabled:
+    * a sampler thread records the stacks of all threads every interval seconds,
+      written as collapsed stacks (cpu-<time>.folded, flame graph input) on disable
+    * tracemalloc traces allocations, the top allocation sites are written to
+      alloc-<time>.txt on disable
+    * ticks run under cProfile, one at a time: a tick starting while another one
+      is profiled (e.g. of another context) is only timed. Profiled ticks slower
+      than budget are dumped to slow-<name>-<time>.prof and slow-<name>-<time>.txt
+
+    <time> has millisecond resolution and a sequence number, dumps never overwrite
+    each other.
+
+    Parameters
+    ----------
+    path: str (default='profile')
+        output directory
+    budget: float (default=0.5)
+        tick duration in seconds above which a tick is dumped
+    interval: float (default=0.01)
+        sampling interval in seconds
+    top: int (default=25)
+        number of entries in the text reports
+    """
+
+    def __init__(self, path='profile', budget=0.5, interval=0.01, top=25):
+        self.path = path
+        self.budget = budget
+        self.interval = interval
+        self.top = top
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.profiling = threading.Lock()
+        self.sequence = itertools.count()
+        self.stacks = Counter()
+        self.sampler = None
+
+    def toggle(self):
+        if self.enabled:
+            self.disable()
+        else:
+            self.enable()
+
+    def enable(self):
+        with self.lock:
+            if self.enabled:
+                return
+            self.enabled = True
+            self.stacks = Counter()
+            tracemalloc.start()
+            self.sampler = threading.Thread(target=self.sample, name='ad-profiler', daemon=True)
+            self.sampler.start()
+        logger.info("Profiling enabled, output in {}".format(self.path))
+
+    def disable(self):
+        with self.lock:
+            if not self.enabled:
+                return
+            self.enabled = False
+        self.sampler.join()
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        os.makedirs(self.path, exist_ok=True)
+        stamp = self.stamp()
+        with open(os.path.join(self.path, 'cpu-{}.folded'.format(stamp)), 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write('{} {}\n'.format(stack, count))
+        with open(os.path.join(self.path, 'alloc-{}.txt'.format(stamp)), 'w') as f:
+            for stat in snapshot.statistics('lineno')[:self.top]:
+                f.write('{}\n'.format(stat))
+        logger.info("Profiling disabled, {} stack samples written to {}".format(sum(self.stacks.values()), self.path))
+
+    def sample(self):
+        own = threading.get_ident()
+        names = {}
+        while self.enabled:
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                if ident not in names:
+                    names = {t.ident: t.name for t in threading.enumerate()}
+                stack = []
+                while frame is not None:
+                    stack.append('{}:{}'.format(frame.f_code.co_filename.rsplit('/', 1)[-1], frame.f_code.co_name))
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.stacks[';'.join(reversed(stack))] += 1
+            time.sleep(self.interval)
+
+    def stamp(self):
+        """ Unique file name suffix: local time in milliseconds and a sequence number """
+        now = time.time()
+        return '{}.{:03d}-{}'.format(time.strftime('%Y%m%d-%H%M%S', time.localtime(now)), int(now * 1000) % 1000,
+                                     next(self.sequence))
+
+    @contextmanager
+    def tick(self, name='ad'):
+        """ Time a tick of context name, under cProfile while profiling is enabled and no other
+        tick is profiled (only one profiler can be active per process); slow ticks are dumped
+        """
+        if not self.enabled or not self.profiling.acquire(blocking=False):
+            yield
+            return
+        try:
+            profile = cProfile.Profile()
+            start = time.monotonic()
+            profile.enable()
+            try:
+                yield
+            finally:
+                profile.disable()
+                elapsed = time.monotonic() - start
+                if elapsed > self.budget:
+                    self.dump(profile, elapsed, name)
+        finally:
+            self.profiling.release()
+
+    def dump(self, profile, elapsed, context='ad'):
+        os.makedirs(self.path, exist_ok=True)
+        name = os.path.join(self.path, 'slow-{}-{}'.format(context, self.stamp()))
+        profile.dump_stats(name + '.prof')
+        out = io.StringIO()
+        pstats.Stats(profile, stream=out).sort_stats('cumulative').print_stats(self.top)
+        with open(name + '.txt', 'w') as f:
+            f.write(out.getvalue())
+        logger.warning("Tick took {:.3f}s (budget {:.3f}s), profile written to {}.prof".format(elapsed, self.budget, name))
+
+    def control(self, payload):
+        """ Handle a control request {"profiling": "on" | "off" | "toggle"} """
+        action = payload.get('profiling')
+        if action == 'on':
+            self.enable()
+        elif action == 'off':
+            self.disable()
+        elif action == 'toggle':
+            self.toggle()
+        else:
+            logger.error("Unknown profiling request: {}".format(payload))
@@ -0,0 +1,116 @@
+# ==================================================================================
+#  Copyright (c) 2020 HCL Technologies Limited.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+# ==================================================================================
+
+
+import time
+import pandas as pd
+from mdclogpy import Logger
+from metrics import registry
+
+logger = Logger(name=__name__)
+
+
+def policies(spec):
+    """ Parse "measurement=duration, ..." (e.g. "UEReports=240h, AD=240h") into measurement -> Timedelta """
+    parsed = {}
+    for item in spec.split(','):
+        if item.strip():
+            meas, duration = item.split('=', 1)
+            parsed[meas.strip()] = pd.Timedelta(duration.strip())
+    return parsed
+
+
+class Retention(object):
+    r""" Deletes the points of measurements that are older than their retention.
+
+    Expired data is deleted through the delete API in time chunks, oldest
+    first, with at most max_chunks delete calls per measurement and run, so a
+    run takes bounded time even on a large backlog; the rest is deleted by
+    the following runs. Each measurement keeps a cursor up to which it was
+    cleared, only its first run looks up the oldest point.
+
+    Parameters
+    ----------
+    db: DATABASE
+    policies: dict
+        measurement -> retention (Timedelta)
+    chunk: Timedelta (default=1h)
+        time span deleted per call
+    max_chunks: int (default=24)
+        delete calls per measurement and run
+    count: bool (default=True)
+        count the field values of a chunk on the server before deleting it
+    """
+
+    def __init__(self, db, policies, chunk=pd.Timedelta('1h'), max_chunks=24, count=True):
+        self.db = db
+        self.policies = dict(policies)
+        self.chunk = pd.Timedelta(chunk)
+        self.max_chunks = max_chunks
+        self.count = count
+        self.cursor = {}
+
+    def run(self, now=None):
+        """ Delete the expired chunks of every measurement
+
+        Returns
+        -------
+        removed: dict
+            measurement -> number of field values removed in this run (0 if not counted)
+        """
+        now = pd.Timestamp.now(tz='UTC') if now is None else pd.Timestamp(now)
+        removed = {}
+        for meas, keep in self.policies.items():
+            try:
+                removed[meas] = self.expire(meas, now - keep)
+            except Exception as e:
+                logger.warning("Retention of {} interrupted: {}".format(meas, e))
+        return removed
+
+    def expire(self, meas, cutoff):
+        start = self.cursor.get(meas)
+        if start is None:
+            start = self.db.oldest(meas, cutoff)
+            if start is None:
+                self.cursor[meas] = cutoff
+                return 0
+        removed = 0
+        chunks = 0
+        while start < cutoff and chunks < self.max_chunks:
+            stop = min(start + self.chunk, cutoff)
+            count = self.db.count_range(meas, start, stop) if self.count else 0
+            self.db.delete_range(meas, start, stop)
+            removed += count
+            chunks += 1
+            start = stop
+            self.cursor[meas] = start
+        if chunks:
+            registry.inc('retention.removed.' + meas, removed)
+            logger.info("Retention: removed {} values of {} in {} chunk(s), cleared up to {}{}".format(
+                removed, meas, chunks, start, '' if start >= cutoff else ', backlog left for the next run'))
+        return removed
+
+    def loop(self, interval):
+        """ Run every interval seconds, meant for a daemon thread """
+        loop([self], interval)
+
+
+def loop(retentions, interval):
+    """ Run each of the retentions (e.g. one per pipeline context) in turn every interval seconds """
+    while True:
+        for retention in retentions:
+            retention.run()
+        time.sleep(interval)
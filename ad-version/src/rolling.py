@@ -0,0 +1,165 @@
+# ==================================================================================
+#  Copyright (c) 2020 HCL Technologies Limited.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+# ==================================================================================
+
+
+import numpy as np
+import pandas as pd
+from mdclogpy import Logger
+
+logger = Logger(name=__name__)
+
+STATS = ('mean', 'std', 'min', 'max')
+
+
+class RollingStore(object):
+    r""" Rolling window statistics per UE over array backed ring buffers.
+
+    Every UE owns a slot holding a ring of its last window samples, the least
+    recently updated UE gives up its slot when max_ues are tracked. Running
+    sums and sums of squares give the mean and standard deviation in O(1) per
+    sample; minimum and maximum are updated in O(1) and only rescanned over the
+    window when the sample leaving the window was the extreme (amortized O(1)).
+    Updates are vectorized over the UEs of a batch.
+
+    Parameters
+    ----------
+    features: list
+        columns tracked per UE
+    window: int (default=20)
+        samples per UE in the window
+    max_ues: int (default=10000)
+        number of UEs tracked at the same time
+
+    Attributes
+    ----------
+    columns: list
+        names of the statistics, <feature>_<mean|std|min|max> feature by feature
+    """
+
+    def __init__(self, features, window=20, max_ues=10000):
+        self.features = list(features)
+        self.window = window
+        self.max_ues = max_ues
+        self.columns = ['{}_{}'.format(f, s) for f in self.features for s in STATS]
+        n = len(self.features)
+        self.values = np.zeros((max_ues, window, n))
+        self.count = np.zeros(max_ues, dtype=np.int64)
+        self.pos = np.zeros(max_ues, dtype=np.int64)
+        self.sum = np.zeros((max_ues, n))
+        self.sumsq = np.zeros((max_ues, n))
+        self.min = np.full((max_ues, n), np.inf)
+        self.max = np.full((max_ues, n), -np.inf)
+        self.touched = np.zeros(max_ues, dtype=np.int64)
+        self.clock = 1
+        self.index = {}
+        self.owner = [None] * max_ues
+
+    def __len__(self):
+        return len(self.index)
+
+    def slots(self, ues):
+        """ Slot of each UE, allocating (or evicting) slots for new UEs """
+        codes, uniques = pd.factorize(np.asarray(ues, dtype=object))
+        slots = np.empty(len(uniques), dtype=np.int64)
+        for i, ue in enumerate(uniques):
+            slot = self.index.get(ue)
+            if slot is None:
+                slot = self.allocate(ue)
+            self.touched[slot] = self.clock
+            slots[i] = slot
+        self.clock += 1
+        return slots[codes]
+
+    def allocate(self, ue):
+        if len(self.index) < self.max_ues:
+            slot = len(self.index)
+        else:
+            slot = int(np.argmin(self.touched))
+            if self.touched[slot] == self.clock:
+                raise ValueError("More than {} UEs in one batch".format(self.max_ues))
+            del self.index[self.owner[slot]]
+        self.index[ue] = slot
+        self.owner[slot] = ue
+        self.count[slot] = 0
+        self.pos[slot] = 0
+        self.sum[slot] = 0
+        self.sumsq[slot] = 0
+        self.min[slot] = np.inf
+        self.max[slot] = -np.inf
+        return slot
+
+    def update(self, ues, values):
+        """ Fold the samples (rows of values, in time order) into the windows of their UEs
+
+        Returns
+        -------
+        stats: array
+            (n, len(columns)) statistics of the UE window right after each sample
+        """
+        values = np.asarray(values, dtype=np.float64)
+        stats = np.empty((len(values), len(self.columns)))
+        if len(values) == 0:
+            return stats
+        slots = self.slots(ues)
+        # samples of the same UE are pushed in successive rounds, one per UE and round
+        rank = pd.Series(slots).groupby(slots).cumcount().to_numpy()
+        for r in range(rank.max() + 1):
+            rows = np.flatnonzero(rank == r)
+            self.push(slots[rows], values[rows])
+            stats[rows] = self.stats(slots[rows])
+        return stats
+
+    def push(self, slots, x):
+        pos = self.pos[slots]
+        full = self.count[slots] == self.window
+        old = self.values[slots, pos]
+        leaving = np.where(full[:, None], old, 0.0)
+        self.sum[slots] += x - leaving
+        self.sumsq[slots] += x * x - leaving * leaving
+        self.values[slots, pos] = x
+        self.pos[slots] = (pos + 1) % self.window
+        self.count[slots] = np.minimum(self.count[slots] + 1, self.window)
+        low, high = self.min[slots], self.max[slots]
+        stale_low = full[:, None] & (old == low) & (x > old)
+        stale_high = full[:, None] & (old == high) & (x < old)
+        self.min[slots] = np.minimum(low, x)
+        self.max[slots] = np.maximum(high, x)
+        for extreme, stale, reduce in ((self.min, stale_low, np.min), (self.max, stale_high, np.max)):
+            rows, cols = np.nonzero(stale)
+            if len(rows):
+                extreme[slots[rows], cols] = reduce(self.values[slots[rows], :, cols], axis=1)
+
+    def stats(self, slots):
+        """ (len(slots), len(columns)) statistics of the given slots """
+        n = self.count[slots][:, None]
+        mean = self.sum[slots] / n
+        std = np.sqrt(np.maximum(self.sumsq[slots] / n - mean * mean, 0.0))
+        return np.stack([mean, std, self.min[slots], self.max[slots]], axis=2).reshape(len(slots), -1)
+
+    def get(self, ues):
+        """ Statistics of the windows of ues as a DataFrame indexed by UE, UEs without samples are left out """
+        known = [ue for ue in ues if ue in self.index]
+        slots = np.array([self.index[ue] for ue in known], dtype=np.int64)
+        return pd.DataFrame(self.stats(slots), index=known, columns=self.columns)
+
+    def augment(self, df, ue, assign=True):
+        """ Update with the samples of df and return df with the statistics of each sample's UE
+        as extra columns (df itself if assign is False).
+        """
+        stats = self.update(df[ue].to_numpy(), df[self.features].to_numpy(dtype=np.float64))
+        if not assign:
+            return df
+        return df.assign(**{name: stats[:, j] for j, name in enumerate(self.columns)})
@@ -0,0 +1,176 @@
+# ==================================================================================
+#  Copyright (c) 2020 HCL Technologies Limited.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+# ==================================================================================
+
+import os
+import threading
+import time
+from mdclogpy import Logger
+
+logger = Logger(name=__name__)
+
+
+class CircuitBreaker(object):
+    r""" Circuit breaker guarding the InfluxDB writes.
+
+    closed: writes go to InfluxDB
+    open: writes go to the spool until reset_timeout has passed
+    half-open: writes are tried again, one failure opens the circuit again
+
+    Parameters
+    ----------
+    failures: int (default=3)
+        consecutive failures that open the circuit
+    reset_timeout: float (default=30)
+        seconds before an open circuit lets writes through again
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, failures=3, reset_timeout=30.0):
+        self.threshold = failures
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+
+    def allow(self):
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = self.HALF_OPEN
+        return self.state != self.OPEN
+
+    def success(self):
+        if self.state != self.CLOSED:
+            logger.info("InfluxDB writes recovered, circuit closed")
+        self.state = self.CLOSED
+        self.failures = 0
+
+    def failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.threshold:
+            if self.state != self.OPEN:
+                logger.warning("InfluxDB writes failing, circuit opened for {}s".format(self.reset_timeout))
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+
+class Spool(object):
+    r""" Local append-only spool of line protocol records.
+
+    Records are appended to segment files named by their creation time. The
+    active segment is sealed when it reaches segment_bytes or when a replay
+    starts, sealed segments are replayed oldest first and removed once written.
+    Segments older than max_age and the oldest segments beyond max_bytes are
+    dropped.
+
+    Parameters
+    ----------
+    path: str
+        spool directory, created on first use
+    max_bytes: int
+        upper bound of the spool size on disk
+    max_age: float
+        seconds a record is kept before it is dropped
+    segment_bytes: int
+        size at which the active segment is sealed
+    """
+
+    def __init__(self, path, max_bytes=64 << 20, max_age=86400.0, segment_bytes=4 << 20):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.segment_bytes = segment_bytes
+        self.lock = threading.Lock()
+        self.active = None
+
+    def segments(self):
+        if not os.path.isdir(self.path):
+            return []
+        return sorted(os.path.join(self.path, f) for f in os.listdir(self.path) if f.endswith('.lp'))
+
+    def pending(self):
+        return len(self.segments()) > 0
+
+    def append(self, records):
+        """ Append a batch of line protocol records (str, bytes or list of str) """
+        if isinstance(records, bytes):
+            records = records.decode()
+        if not isinstance(records, str):
+            records = '\n'.join(records)
+        if not records:
+            return
+        with self.lock:
+            if self.active is None or os.path.getsize(self.active) >= self.segment_bytes:
+                os.makedirs(self.path, exist_ok=True)
+                self.active = os.path.join(self.path, '{:020d}.lp'.format(time.time_ns()))
+            with open(self.active, 'a') as f:
+                f.write(records + '\n')
+            self.enforce()
+
+    def enforce(self):
+        """ Drop segments that are too old or exceed the size limit, oldest first """
+        segments = self.segments()
+        sizes = [os.path.getsize(s) for s in segments]
+        total = sum(sizes)
+        cutoff = time.time_ns() - int(self.max_age * 1e9)
+        dropped = 0
+        for segment, size in zip(segments, sizes):
+            if segment == self.active:
+                break
+            if total <= self.max_bytes and int(os.path.basename(segment)[:-3]) >= cutoff:
+                break
+            os.remove(segment)
+            total -= size
+            dropped += 1
+        if dropped:
+            logger.warning("Spool limits reached, dropped {} segment(s)".format(dropped))
+
+    def replay(self, write, batch_size=5000):
+        """ Write all spooled records with write(list_of_records), oldest first.
+
+        A segment is removed once all its batches are written. If a batch fails,
+        the unwritten remainder is kept in place and the exception is raised.
+
+        Returns
+        -------
+        count: int
+            number of records replayed
+        """
+        with self.lock:
+            self.active = None
+            segments = self.segments()
+        count = 0
+        for segment in segments:
+            try:
+                with open(segment) as f:
+                    records = f.read().splitlines()
+            except FileNotFoundError:
+                continue
+            for i in range(0, len(records), batch_size):
+                try:
+                    write(records[i:i + batch_size])
+                except Exception:
+                    with self.lock:
+                        tmp = segment + '.tmp'
+                        with open(tmp, 'w') as f:
+                            f.write('\n'.join(records[i:]) + '\n')
+                        os.replace(tmp, segment)
+                    raise
+                count += len(records[i:i + batch_size])
+            with self.lock:
+                if os.path.exists(segment):
+                    os.remove(segment)
+        return count
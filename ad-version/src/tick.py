@@ -0,0 +1,103 @@
+# ==================================================================================
+#  Copyright (c) 2020 HCL Technologies Limited.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+# ==================================================================================
+
+import time
+from mdclogpy import Logger
+from metrics import registry
+
+logger = Logger(name=__name__)
+
+
+class TickController(object):
+    r""" Adaptive poll interval of the prediction loop.
+
+    Tracks an exponentially weighted arrival rate of new samples and the time
+    a tick takes to process them. While data arrives the interval is the time
+    the feed needs to fill a batch of batch_rows samples, so dense feeds are
+    polled more often; it never drops below headroom times the processing
+    time. Every idle poll multiplies the interval by backoff. The interval is
+    kept within [min_interval, max_interval] and published as the <prefix>.*
+    metrics.
+
+    Parameters
+    ----------
+    interval: float (default=0.5)
+        initial interval in seconds
+    min_interval: float (default=0.1)
+    max_interval: float (default=5.0)
+    batch_rows: int (default=200)
+        samples per tick the interval aims for on a busy feed
+    headroom: float (default=1.5)
+        minimum ratio of interval to processing time
+    backoff: float (default=2.0)
+        growth of the interval per idle poll
+    alpha: float (default=0.3)
+        weight of the latest poll in the running averages
+    prefix: str (default='tick')
+        name prefix of the published metrics
+    """
+
+    def __init__(self, interval=0.5, min_interval=0.1, max_interval=5.0, batch_rows=200, headroom=1.5, backoff=2.0, alpha=0.3, prefix='tick'):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.batch_rows = batch_rows
+        self.headroom = headroom
+        self.backoff = backoff
+        self.alpha = alpha
+        self.prefix = prefix
+        self.interval = min(max_interval, max(min_interval, interval))
+        self.rate = 0.0
+        self.processing = 0.0
+        self.idle = 0
+        self.last_poll = None
+        self.publish()
+
+    def arrived(self, rows):
+        """ Record the number of new samples returned by a poll """
+        now = time.monotonic()
+        if self.last_poll is not None:
+            elapsed = max(now - self.last_poll, 1e-3)
+            self.rate += self.alpha * (rows / elapsed - self.rate)
+        self.last_poll = now
+        self.idle = 0 if rows > 0 else self.idle + 1
+        registry.inc(self.prefix + '.rows', rows)
+
+    def processed(self, seconds):
+        """ Record the time a tick took to read, score and write its samples """
+        self.processing += self.alpha * (seconds - self.processing)
+
+    def next_interval(self):
+        """ Decide the interval until the next poll """
+        if self.idle > 0:
+            interval = self.interval * self.backoff
+        elif self.rate > 0:
+            interval = self.batch_rows / self.rate
+        else:
+            interval = self.interval
+        interval = max(interval, self.processing * self.headroom)
+        interval = min(self.max_interval, max(self.min_interval, interval))
+        if abs(interval - self.interval) > 0.25 * self.interval:
+            logger.debug("Poll interval {:.3f}s -> {:.3f}s (rate {:.1f}/s, processing {:.3f}s, idle polls {})".format(
+                self.interval, interval, self.rate, self.processing, self.idle))
+        self.interval = interval
+        self.publish()
+        return interval
+
+    def publish(self):
+        registry.set(self.prefix + '.interval', self.interval)
+        registry.set(self.prefix + '.arrival_rate', self.rate)
+        registry.set(self.prefix + '.processing_time', self.processing)
+        registry.set(self.prefix + '.idle_polls', self.idle)
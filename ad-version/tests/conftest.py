@@ -13,8 +13,13 @@
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
 # ==================================================================================
+import os
+import joblib
 import pytest
+import numpy as np
 import pandas as pd
+from sklearn.ensemble import IsolationForest
+from sklearn.preprocessing import Normalizer
 
 
 @pytest.fixture
@@ -28,3 +33,102 @@ def ad_ue():
     ad_ue_val = pd.DataFrame([[1002, "c2/B13", 8, 69, 65, 113, 0.1, 0.1, "Waiting passenger 9", -882, -959, pd.to_datetime("2021-05-12T07:43:51.652")]], columns=["du-id", "ServingCellId", "RRU.PrbUsedDl", "RF.serving.RSRP", "RF.serving.RSRQ", "RF.serving.RSSINR", "TargetTput", "DRB.UEThpDl", "ue-id", "x", "y", "measTimeStampRf"])
 
     return ad_ue_val
+
+
+@pytest.fixture
+def ad_features():
+    rng = np.random.default_rng(4)
+    cols = ["RRU.PrbUsedDl", "RF.serving.RSRP", "RF.serving.RSRQ", "RF.serving.RSSINR", "DRB.UEThpDl"]
+    df = pd.DataFrame(rng.normal(50, 10, size=(200, len(cols))), columns=cols)
+    df["ue-id"] = ["Car-{}".format(i % 20) for i in range(len(df))]
+    df["ServingCellId"] = ["c{}/B13".format(i % 3) for i in range(len(df))]
+    return df, cols
+
+
+@pytest.fixture
+def flux_csv():
+    head = ('#datatype,string,long,dateTime:RFC3339,dateTime:RFC3339,dateTime:RFC3339,string,string,double,long,string\r\n'
+            '#group,false,false,true,true,false,true,true,false,false,false\r\n'
+            '#default,_result,,,,,,,,,\r\n'
+            ',result,table,_start,_stop,_time,_measurement,tag_key,DRB.UEThpDl,RF.serving.RSRP,ue-id\r\n')
+    rows = (',,0,2021-05-12T00:00:00Z,2021-05-13T00:00:00Z,2021-05-12T07:43:51.652Z,UEReports,tag_value,0.1,-882,Car-1\r\n'
+            ',,0,2021-05-12T00:00:00Z,2021-05-13T00:00:00Z,2021-05-12T07:43:51.653Z,UEReports,tag_value,,-880,Car-2\r\n')
+    other = ',,1,2021-05-12T00:00:00Z,2021-05-13T00:00:00Z,2021-05-12T07:43:51.654Z,UEReports,tag_value,0.3,-870,Car-3\r\n'
+    return (head + rows + '\r\n' + head + other + '\r\n').encode()
+
+
+class FrameDB(object):
+    """In-memory stand-in for DATABASE serving one DataFrame, the label column (if any)
+    is left out of training reads. Also used by the benchmarks. Every poll of the latest
+    point sees new data.
+    """
+    meas = 'UEReports'
+
+    def __init__(self, df, label=None):
+        self.df = df
+        self.label = label
+        self.data = None
+        self.polls = 0
+
+    def read_data(self, train=False, valid=False, limit=False):
+        self.reads = getattr(self, 'reads', 0) + 1
+        self.data = self.df.drop(columns=[self.label]) if train and self.label else self.df.copy()
+
+    def features(self):
+        return [col for col in self.df.columns if col != self.label]
+
+    def count_complete(self, train=False, valid=False, fields=None):
+        return len(self.df.dropna(subset=self.features()))
+
+    def last_timestamps(self, measurements=None):
+        self.polls += 1
+        return {self.meas: pd.Timestamp(self.polls, unit='s', tz='UTC')}
+
+
+class HistoryDB(object):
+    """Serves the stored samples of all UEs to the CAUSE baseline queries, aggregated per UE"""
+    bucket = 'RIC-Test'
+    meas = 'UEReports'
+    ue = 'ue-id'
+    thpt = 'DRB.UEThpDl'
+    rsrp = 'RF.serving.RSRP'
+    rsrq = 'RF.serving.RSRQ'
+
+    def __init__(self, history):
+        self.history = history
+        self.queries = 0
+
+    def baselines(self, ues, window='20s', agg='max', fields=None):
+        self.queries += 1
+        fields = fields or [self.thpt, self.rsrp, self.rsrq]
+        rows = self.history[self.history[self.ue].isin(list(ues))]
+        grouped = rows.groupby(self.ue)[fields]
+        return grouped.max() if agg == 'max' else grouped.quantile(float(agg))
+
+
+@pytest.fixture
+def bundle_dir(tmp_path, monkeypatch):
+    """Run in an empty working directory holding src/ for model bundles and config"""
+    (tmp_path / 'src').mkdir()
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+@pytest.fixture
+def model_bundle(ad_features, bundle_dir):
+    """Save a model bundle fitted on ad_features: model_bundle(model=None, path='src', **params)
+    fits model (an IsolationForest(n_estimators=20, random_state=4, **params) if None) on the
+    normalized features, saves it with the scaler and the feature names and returns (model, scale)
+    """
+    df, cols = ad_features
+    scale = Normalizer().fit(df[cols])
+
+    def save(model=None, path='src', **params):
+        model = model if model is not None else IsolationForest(n_estimators=20, random_state=4, **params)
+        model.fit(scale.transform(df[cols]))
+        os.makedirs(path, exist_ok=True)
+        joblib.dump(model, os.path.join(path, 'model'))
+        joblib.dump(scale, os.path.join(path, 'scale'))
+        joblib.dump(pd.Index(cols), os.path.join(path, 'num_params'))
+        return model, scale
+    return save
@@ -0,0 +1,107 @@
+# ==================================================================================
+#       Copyright (c) 2020 HCL Technologies Limited.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#          http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+# ==================================================================================
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import IsolationForest
+from sklearn.preprocessing import Normalizer
+from src import ad_model
+from tests.conftest import HistoryDB
+
+
+def test_feature_batch_matches_sklearn(ad_features):
+    df, cols = ad_features
+    scale = Normalizer().fit(df[cols])
+    model = IsolationForest(n_estimators=20, random_state=4).fit(scale.transform(df[cols]))
+    batch = ad_model.FeatureBatch(cols, capacity=8)
+
+    batch.load(df)
+    values = batch.values
+    np.testing.assert_allclose(batch.scale(scale), scale.transform(df[cols]), rtol=1e-5)
+    expected = (model.predict(scale.transform(df[cols]).astype(np.float32)) == -1).astype(int)
+    np.testing.assert_array_equal(batch.predict(model), expected)
+
+    # a smaller tick reuses the same buffers
+    batch.load(df.head(10))
+    assert batch.values is values
+    assert batch.view.shape == (10, len(cols))
+
+
+def test_score_cache(ad_features):
+    df, cols = ad_features
+    scale = Normalizer().fit(df[cols])
+    model = IsolationForest(n_estimators=20, random_state=4).fit(scale.transform(df[cols]))
+    batch = ad_model.FeatureBatch(cols)
+    cache = ad_model.ScoreCache(size=150)
+    cache.bind('bundle-1')
+
+    batch.load(df)
+    batch.scale(scale)
+    expected = batch.predict(model).copy()
+    evaluate = lambda view, cells: model.predict(view) == -1
+    np.testing.assert_array_equal(cache.predict(batch, evaluate), expected)
+    assert cache.stats()['misses'] == len(df) and len(cache.entries) == 150
+
+    batch.load(df.tail(100))
+    batch.scale(scale)
+    np.testing.assert_array_equal(cache.predict(batch, evaluate), expected[-100:])
+    assert cache.hits == 100
+
+    cache.bind('bundle-2')
+    assert len(cache.entries) == 0
+
+
+def test_modelling_bundle_path_and_warmup(ad_features, model_bundle):
+    df, cols = ad_features
+    model_bundle(path='fallback')
+
+    assert not ad_model.modelling().ready()
+    md = ad_model.modelling(path='fallback')
+    assert md.ready()
+    md.warmup(rows=64)
+    assert md.batch.capacity >= 64 and md.batch.size == 0
+    assert md.predict(df).shape == (len(df),)
+
+
+def test_cause_classifies_batch():
+    history = pd.DataFrame({'ue-id': ['a', 'a', 'b', 'c'], 'DRB.UEThpDl': [100.0, 80.0, 50.0, 10.0],
+                            'RF.serving.RSRP': [-80.0, -90.0, -70.0, -60.0], 'RF.serving.RSRQ': [-10.0, -12.0, -5.0, -5.0]})
+    df = pd.DataFrame({'ue-id': pd.Categorical(['a', 'a', 'b', 'b', 'c', 'd']),
+                       'DRB.UEThpDl': np.float32([20, 50, 10, 50, 10, 1]),
+                       'RF.serving.RSRP': np.float32([-100, -80, -70, -70, -60, -200]),
+                       'RF.serving.RSRQ': np.float32([-10, -30, -5, -5, -20, -50]),
+                       'Anomaly': np.int8([1, 1, 1, 1, 0, 1])})
+    db = HistoryDB(history)
+    anomaly, codes = ad_model.CAUSE().cause(df, db, 70)
+    assert db.queries == 1
+    assert list(anomaly) == [2, 1, 1, 0, 0, 0]
+    degradation = pd.Categorical.from_codes(codes, dtype=ad_model.DEGRADATION)
+    assert list(degradation) == ['Throughput RSRP', 'RSRQ', 'Throughput', '', '', '']
+
+
+def test_cause_uses_the_window_of_each_sample():
+    times = pd.Series(pd.to_datetime(['2024-01-01T00:00:00', '2024-01-01T00:00:10', '2024-01-01T00:00:20',
+                                      '2024-01-01T00:00:40', '2024-01-01T00:00:45'], utc=True))
+    samples = pd.DataFrame({'ue-id': ['a', 'b', 'a', 'a', 'b'], 'DRB.UEThpDl': [100.0, 50.0, 20.0, 5.0, 10.0],
+                            'RF.serving.RSRP': -80.0, 'RF.serving.RSRQ': -10.0, 'Anomaly': np.int8([0, 0, 1, 1, 1])})
+    db = HistoryDB(samples)
+    cp = ad_model.CAUSE(window='25s')
+    base = cp.windowed(samples, times, db)
+    # a at 00:20 still sees its sample of 00:00, at 00:40 only the one of 00:20
+    assert list(base['DRB.UEThpDl']) == [100.0, 50.0, 100.0, 20.0, 10.0]
+    df = samples.iloc[2:]
+    anomaly, codes = cp.cause(df, db, 70, base=base.loc[df.index])
+    assert db.queries == 0
+    assert list(anomaly) == [1, 1, 0]
@@ -0,0 +1,94 @@
+# ==================================================================================
+#       Copyright (c) 2020 HCL Technologies Limited.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#          http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+# ==================================================================================
+import os
+import joblib
+import numpy as np
+import pandas as pd
+from src import ad_model, ad_train
+from tests.conftest import FrameDB
+
+
+def test_per_cell_models(ad_features, bundle_dir, model_bundle):
+    df, cols = ad_features
+    (bundle_dir / 'src' / 'ad_config.ini').write_text('[model]\npartition = ServingCellId\nmin_cell_samples = 60\nn_jobs = 2\n')
+    model, scale = model_bundle()
+    X = df[cols].copy()
+    X[cols] = scale.transform(df[cols])
+
+    mt = ad_train.ModelTraining(FrameDB(pd.concat([df] * 6, ignore_index=True)))
+    mt.train_data = X
+    mt.train_cells(model, df)
+    bundle = joblib.load('src/cell_models')
+    assert bundle['partition'] == 'ServingCellId'
+    assert sorted(bundle['models']) == ['c0/B13', 'c1/B13', 'c2/B13']
+
+    md = ad_model.modelling()
+    sample = df.copy()
+    sample.loc[:9, 'ServingCellId'] = 'c9/B13'  # no model, served by the global one
+    labels = md.predict(sample).copy()
+    expected = np.empty(len(sample), dtype=bool)
+    view = scale.transform(sample[cols]).astype(np.float32)
+    for cell, rows in sample.groupby('ServingCellId').indices.items():
+        expected[rows] = bundle['models'].get(cell, model).predict(view[rows]) == -1
+    np.testing.assert_array_equal(labels, expected)
+
+
+def test_training_waits_on_probe(ad_features, monkeypatch):
+    df, cols = ad_features
+    db = FrameDB(pd.concat([df] * 6, ignore_index=True))
+    first, second = pd.Timestamp('2024-01-01', tz='UTC'), pd.Timestamp('2024-01-01T00:02', tz='UTC')
+    # no points yet, new points, no new points since the last count, new points
+    stamps = iter([{}, {db.meas: first}, {db.meas: first}, {db.meas: second}])
+    monkeypatch.setattr(db, 'last_timestamps', lambda measurements=None: next(stamps, {db.meas: second}))
+    counts = []
+    monkeypatch.setattr(db, 'count_complete', lambda **kwargs: counts.append(kwargs) or (500, 1200)[len(counts) > 1])
+    sleeps = []
+    monkeypatch.setattr(ad_train.time, 'sleep', sleeps.append)
+    ad_train.ModelTraining(db)
+    assert sleeps == [120, 120, 120]
+    assert counts == [{'train': True}, {'train': True}, {'valid': True}]  # the stale poll is not counted
+    assert db.reads == 2  # one heavy pull for training, one for validation
+
+
+def test_selection_prefers_cheap_forests_and_prunes(ad_features, bundle_dir):
+    df, cols = ad_features
+    (bundle_dir / 'src' / 'ad_config.ini').write_text('[model]\nf1_tolerance = 1\nprune = true\nprune_tolerance = 1\nmin_trees = 25\n')
+    rng = np.random.default_rng(4)
+    X = pd.DataFrame(rng.normal(size=(1200, len(cols))), columns=cols)
+    mt = ad_train.ModelTraining(FrameDB(pd.concat([df] * 6, ignore_index=True)))
+    mt.train_data = X
+    mt.test_data = X.iloc[:300]
+    mt.actual = (np.abs(X.iloc[:300]).max(axis=1) > 2.5).astype(int)
+    f1, model = mt.isoforest(n_iter=4)
+    # every candidate is within tolerance, the smallest forest is the cheapest and is halved down to min_trees
+    assert model.n_estimators < 200 and len(model.estimators_) == model.n_estimators >= 25
+    assert len(model._decision_path_lengths) == len(model._seeds) == model.n_estimators
+    outliers = (model.predict(X.values) == -1).mean()
+    assert abs(outliers - model.contamination) < 0.02
+    np.testing.assert_allclose(model.decision_function(X.values), model.score_samples(X.values) - model.offset_)
+
+
+def test_install_swaps_the_whole_bundle(bundle_dir):
+    for name, value in (('model', 'old'), ('scale', 'old'), ('num_params', 'old'), ('cell_models', 'old')):
+        joblib.dump(value, 'src/' + name)
+    staging = bundle_dir / 'src' / '.bundle-test'
+    staging.mkdir()
+    for name in ('model', 'scale', 'num_params', 'feature_stats'):
+        joblib.dump('new', str(staging / name))
+    ad_train.install(str(staging), 'src')
+    assert all(joblib.load('src/' + name) == 'new' for name in ('model', 'scale', 'num_params', 'feature_stats'))
+    assert not (bundle_dir / 'src' / 'cell_models').exists()
+    assert sorted(os.listdir(str(staging))) == ['model.old']
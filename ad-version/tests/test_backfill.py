@@ -0,0 +1,37 @@
+# ==================================================================================
+#       Copyright (c) 2020 HCL Technologies Limited.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#          http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+# ==================================================================================
+import json
+import shutil
+import pandas as pd
+import pytest
+from src import backfill
+
+
+@pytest.mark.parametrize('shared', [False, True])
+def test_backfill_scores_range_and_resumes(ad_features, model_bundle, shared):
+    df, cols = ad_features
+    model_bundle()
+    df['measTimeStampRf'] = pd.date_range('2021-05-12T07:00', periods=len(df), freq='1min').strftime('%Y-%m-%dT%H:%M:%S')
+    df.to_csv('src/ue.csv', index=False)
+    shutil.copy(backfill.__file__.replace('backfill.py', 'ad_config.ini'), 'src/ad_config.ini')
+
+    state = backfill.backfill('2021-05-12T07:00', '2021-05-12T10:20', chunk='1h', workers=1, dummy=True, shared=shared)
+    assert state.rows == len(df)
+    saved = json.load(open('backfill.json'))
+    assert len(saved['done']) == 4 and saved['rows'] == len(df)
+
+    again = backfill.backfill('2021-05-12T07:00', '2021-05-12T10:20', chunk='1h', workers=1, dummy=True)
+    assert again.rows == len(df) and len(again.done) == 4
@@ -0,0 +1,67 @@
+# ==================================================================================
+#       Copyright (c) 2020 HCL Technologies Limited.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#          http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+# ==================================================================================
+import json
+import pandas as pd
+from src import ad_model, checkpoint
+from tests.conftest import HistoryDB
+
+
+class Store(object):
+
+    def __init__(self):
+        self.saved = []
+
+    def save(self, state):
+        self.saved.append(json.loads(json.dumps(state)))
+
+    def load(self):
+        return self.saved[-1] if self.saved else None
+
+
+def test_file_store_roundtrip(tmp_path):
+    store = checkpoint.FileStore(str(tmp_path / 'checkpoint.json'))
+    assert store.load() is None
+    store.save({'watermark': '2021-05-12T07:43:51.652000+00:00', 'pending': ['[]']})
+    assert store.load()['pending'] == ['[]']
+    assert not (tmp_path / 'checkpoint.json.tmp').exists()
+
+
+def test_checkpointer_throttles_saves(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(checkpoint.time, 'monotonic', lambda: now[0])
+    store = Store()
+    cp = checkpoint.Checkpointer(store, lambda: {'tick': now[0]}, interval=10)
+    for _ in range(25):
+        now[0] += 1
+        cp.maybe_save()
+    assert [s['tick'] for s in store.saved] == [10, 20]
+
+
+def test_cause_baselines_survive_restart():
+    history = pd.DataFrame({'ue-id': ['a', 'b'], 'DRB.UEThpDl': [100.0, 50.0],
+                            'RF.serving.RSRP': [-80.0, -70.0], 'RF.serving.RSRQ': [-10.0, -5.0]})
+    df = pd.DataFrame({'ue-id': ['a', 'b'], 'DRB.UEThpDl': [20.0, 50.0], 'RF.serving.RSRP': [-80.0, -70.0],
+                       'RF.serving.RSRQ': [-10.0, -5.0], 'Anomaly': [1, 1]})
+    db = HistoryDB(history)
+    cause = ad_model.CAUSE(ttl=60)
+    cause.cause(df, db, 70)
+    cause.cause(df, db, 70)
+    assert db.queries == 1
+    restarted = ad_model.CAUSE(ttl=60)
+    restarted.restore(json.loads(json.dumps(cause.export())))
+    anomaly, codes = restarted.cause(df, db, 70)
+    assert db.queries == 1
+    assert list(anomaly) == [1, 0] and list(codes) == [1, 0]
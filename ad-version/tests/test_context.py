@@ -0,0 +1,79 @@
+# ==================================================================================
+#       Copyright (c) 2020 HCL Technologies Limited.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#          http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+# ==================================================================================
+import pandas as pd
+from src import ad_model, context, rolling
+from tests.conftest import HistoryDB
+
+
+class FeedDB(HistoryDB):
+    """Serves the same samples on every read and keeps what is written per measurement"""
+    prb = 'RRU.PrbUsedDl'
+
+    def __init__(self, history):
+        super().__init__(history)
+        self.data = None
+        self.written = {}
+
+    def read_data(self):
+        self.data = self.history.assign(_time=pd.date_range('2024-01-01', periods=len(self.history), freq='10ms', tz='UTC'))
+
+    def write_anomaly(self, df, meas):
+        self.written[meas] = self.written.get(meas, 0) + len(df)
+
+
+def test_contexts_share_the_bundle_and_tick_independently(ad_features, model_bundle):
+    df, cols = ad_features
+    model_bundle(contamination=0.2)
+    base = ad_model.modelling()
+    a = context.PipelineContext('ad', FeedDB(df), output='AD', threshold=70)
+    b = context.PipelineContext('slice1', FeedDB(df), output='AD-slice1', threshold=10)
+    for c in (a, b):
+        c.md = base.fork()
+    assert a.md.model is b.md.model and a.md.batch is not b.md.batch
+
+    def tick(c):
+        scored, val = c.score(c.fetch())
+        c.write(scored)
+        return len(scored)
+
+    context.run([a, b], tick, workers=2, ticks=4)
+    assert a.db.written == {'AD': 2 * len(df)} and b.db.written == {'AD-slice1': 2 * len(df)}
+    # every context applies its own throughput threshold and keeps its own alerts
+    assert a.alerts and b.alerts and set(a.alerts) != set(b.alerts)
+    assert set(b.state()['alerts']) == set(b.alerts)
+
+
+def test_alerts_are_deduplicated_by_point_time(ad_features):
+    df, cols = ad_features
+    c = context.PipelineContext('ad', FeedDB(df), output='AD')
+    replayed = df.head(5).assign(measTimeStampRf=pd.date_range('2021-05-12', periods=5, freq='1s'))
+    # a looping replay repeats the recorded times, samples without a point time are always sent
+    assert len(c.unsent(replayed)) == 5 and len(c.unsent(replayed)) == 5
+    read = replayed.assign(_time=pd.date_range('2024-01-01', periods=5, freq='10ms', tz='UTC'))
+    assert len(c.unsent(read)) == 5 and len(c.unsent(read)) == 0
+
+
+def test_rolling_store_is_updated_by_the_scorer(ad_features, model_bundle):
+    df, cols = ad_features
+    model_bundle(contamination=0.2)
+    db = FeedDB(df)
+    store = rolling.RollingStore([db.thpt, db.rsrp, db.rsrq], window=10)
+    c = context.PipelineContext('ad', db, output='AD', rolling=store)
+    c.md = ad_model.modelling()
+    read = c.fetch()
+    assert len(store) == 0
+    c.score(read)
+    assert len(store) == df[db.ue].nunique()
@@ -0,0 +1,152 @@
+# ==================================================================================
+#       Copyright (c) 2020 HCL Technologies Limited.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#          http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+# ==================================================================================
+import asyncio
+import threading
+import time
+import numpy as np
+import pandas as pd
+import pytest
+from src import database, fluxcsv
+
+
+def test_fluxcsv_decode(flux_csv):
+    df = fluxcsv.decode(flux_csv, schema={'RF.serving.RSRP': 'float64'})
+    assert list(df.columns) == ['_time', '_measurement', 'tag_key', 'DRB.UEThpDl', 'RF.serving.RSRP', 'ue-id']
+    assert len(df) == 3
+    assert isinstance(df['_time'].dtype, pd.DatetimeTZDtype)
+    assert df['RF.serving.RSRP'].dtype == 'float64'
+    assert df['DRB.UEThpDl'].isna().sum() == 1
+    assert fluxcsv.decode(b'').empty
+
+
+def test_fluxcsv_compact_schema(flux_csv):
+    df = fluxcsv.decode(flux_csv, schema={'DRB.UEThpDl': 'float32', 'RF.serving.RSRP': 'float32', 'ue-id': 'category'})
+    assert df['DRB.UEThpDl'].dtype == 'float32'
+    assert df['RF.serving.RSRP'].dtype == 'float32'
+    assert isinstance(df['ue-id'].dtype, pd.CategoricalDtype)
+    assert list(df['ue-id']) == ['Car-1', 'Car-2', 'Car-3']
+
+
+def test_fluxcsv_error_table():
+    with pytest.raises(fluxcsv.FluxQueryError):
+        fluxcsv.decode(b'#datatype,string,string\n#group,true,true\n#default,,\n,error,reference\n,bad query,897\n')
+
+
+def test_database_fails_fast(monkeypatch):
+    pings = []
+    monkeypatch.setattr(database.InfluxDBClient, 'ping', lambda self: pings.append(1) or False)
+    db = database.DATABASE()
+    assert not db.connected
+    db.backoff.next_attempt = time.monotonic() + 60
+    start = time.monotonic()
+    with pytest.raises(database.DatabaseUnavailableError):
+        db.read_data()
+    assert time.monotonic() - start < 1
+    assert len(pings) == 1
+    assert db.query('from(bucket: "RIC-Test")').empty
+
+
+def test_server_errors_mark_the_client_disconnected(monkeypatch):
+    monkeypatch.setattr(database.InfluxDBClient, 'ping', lambda self: True)
+    db = database.DATABASE()
+    assert db.connected
+
+    def unauthorized(query):
+        raise database.ApiException(status=401, reason='Unauthorized')
+    monkeypatch.setattr(db.query_api, 'query_raw', unauthorized)
+    with pytest.raises(database.DatabaseUnavailableError):
+        db.query_frame('from(bucket: "RIC-Test")')
+    assert not db.connected
+    with pytest.raises(database.DatabaseUnavailableError):
+        asyncio.run(db.aquery_frame('from(bucket: "RIC-Test")'))
+    assert db.aclient is None
+
+
+def test_close_stops_the_batching_writer(monkeypatch):
+    monkeypatch.setattr(database.InfluxDBClient, 'ping', lambda self: False)
+    before = set(threading.enumerate())
+    db = database.DATABASE()
+    assert set(threading.enumerate()) - before
+    db.close()
+    deadline = time.monotonic() + 5
+    while set(threading.enumerate()) - before and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert not set(threading.enumerate()) - before
+
+
+def test_baselines_are_aggregated_by_the_server(monkeypatch):
+    monkeypatch.setattr(database.InfluxDBClient, 'ping', lambda self: False)
+    db = database.DATABASE()
+    queries = []
+    frame = pd.DataFrame({'ue-id': ['Car-1', 'Car-2'], 'DRB.UEThpDl': [10.0, 20.0], 'RF.serving.RSRP': [-80.0, -90.0]})
+    monkeypatch.setattr(db, 'query_frame', lambda query: queries.append(query) or frame.copy())
+    normal = db.baselines(['Car-1', 'Car-2'], window='20s', agg=0.9)
+    assert len(queries) == 1
+    assert 'range(start: -20s)' in queries[0] and 'q: 0.9' in queries[0] and queries[0].count('quantile(') == 3
+    assert list(normal.index) == ['Car-1', 'Car-2']
+    assert list(normal.columns) == [db.thpt, db.rsrp, db.rsrq] and normal[db.rsrq].isna().all()
+    assert db.baselines([]).empty and len(queries) == 1
+
+
+def test_records_keep_every_ue_and_the_sample_time(monkeypatch):
+    monkeypatch.setattr(database.InfluxDBClient, 'ping', lambda self: False)
+    db = database.DATABASE()
+    df = pd.DataFrame({'ue-id': pd.Categorical(['Car-1', 'Waiting passenger 9', 'Car-1']),
+                       'DRB.UEThpDl': np.float32([0.1, np.nan, 5.0]), 'Anomaly': np.int8([1, 0, 1]),
+                       'Degradation': ['Throughput', '', 'RSRP'],
+                       'measTimeStampRf': pd.to_datetime(['2024-01-01T00:00:00.000', '2024-01-01T00:00:00.500',
+                                                          '2024-01-01T00:00:00.500'], utc=True)})
+    records = db.to_records(df)
+    assert records == ['AD,ue-id=Car-1 DRB.UEThpDl=0.1,Anomaly=1i,Degradation="Throughput" 1704067200000000000',
+                       'AD,ue-id=Waiting\\ passenger\\ 9 Anomaly=0i,Degradation="" 1704067200500000000',
+                       'AD,ue-id=Car-1 DRB.UEThpDl=5,Anomaly=1i,Degradation="RSRP" 1704067200500000000']
+    df['measTimeStampRf'] = [1620832626630, 1620832626631, 1620832626632]
+    assert db.to_records(df)[0].endswith(' 1620832626630000000')
+
+
+def test_backoff_is_bounded():
+    backoff = database.Backoff(base=1, cap=4)
+    delays = [backoff.failure() for _ in range(10)]
+    assert all(0 <= d <= 4 for d in delays)
+    assert not backoff.ready() or delays[-1] == 0
+    backoff.reset()
+    assert backoff.ready()
+
+
+def test_replay_advances_by_recorded_time(bundle_dir):
+    times = pd.date_range('2021-05-12T07:43:51', periods=50, freq='100ms')
+    pd.DataFrame({'ue-id': ['Car-{}'.format(i % 4) for i in range(50)],
+                  'DRB.UEThpDl': range(50),
+                  'measTimeStampRf': times.strftime('%Y-%m-%dT%H:%M:%S.%f')}).to_csv('src/ue.csv', index=False)
+    (bundle_dir / 'src' / 'ad_config.ini').write_text('[replay]\nchunksize = 7\nspeed = 2\n[pipeline]\ninterval = 0.25\n')
+    db = database.DUMMY()
+    seen = []
+    for _ in range(10):
+        db.read_data()
+        assert len(db.data) == 5
+        seen.extend(db.data['DRB.UEThpDl'])
+        assert db.buffer is None or len(db.buffer) <= 7 + 5
+    assert seen == list(range(50))
+    db.read_data()
+    assert list(db.data['DRB.UEThpDl']) == [0, 1, 2, 3, 4]
+    db.read_data()
+    db.ue = 'ue-id'
+    normal = db.baselines(['Car-1', 'Car-3'], window='600ms', fields=['DRB.UEThpDl'])
+    assert list(normal['DRB.UEThpDl']) == [9.0, 7.0]
+    assert list(db.baselines(['Car-1', 'Car-3'], window='200ms', fields=['DRB.UEThpDl']).index) == ['Car-1']
+    assert len(db.read_range(times[10], times[20])) == 10
+    db.read_data(train=True, limit=20)
+    assert len(db.data) == 20 and db.head(20) is db.head(20)
@@ -0,0 +1,52 @@
+# ==================================================================================
+#       Copyright (c) 2020 HCL Technologies Limited.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#          http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+# ==================================================================================
+import numpy as np
+import pytest
+from src import ad_model, detectors
+
+
+def test_robust_zscore_flags_outliers_and_tracks_the_stream():
+    rng = np.random.default_rng(4)
+    X = rng.normal(0, 1, size=(2000, 3))
+    zs = detectors.create('zscore', threshold=4.0, alpha=0.01).fit(X)
+    outliers = np.array([[0, 0, 12.0], [-15.0, 0, 0]])
+    assert (zs.predict(X[:100]) == 1).mean() > 0.95
+    assert (zs.predict(outliers) == -1).all()
+    assert (zs.score_samples(outliers) < zs.score_samples(X[:1])).all()
+    for _ in range(50):
+        zs.update(rng.normal(10, 2, size=(100, 3)))
+    np.testing.assert_allclose(zs.median, 10, atol=0.5)
+    np.testing.assert_allclose(zs.mad, 2 * 0.6745, rtol=0.2)
+    with pytest.raises(ValueError):
+        detectors.create('hst')
+
+    class Incomplete(detectors.Detector):
+        def fit(self, X):
+            return self
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_modelling_serves_online_detector(ad_features, model_bundle):
+    df, cols = ad_features
+    zs, scale = model_bundle(detectors.RobustZScore())
+    md = ad_model.modelling(cache=ad_model.ScoreCache(100))
+    median = md.model.median.copy()
+    shifted = df.assign(**{cols[0]: df[cols[0]] * 2})
+    labels = md.predict(shifted)
+    assert (labels == (zs.predict(scale.transform(shifted[cols]).astype(np.float32)) == -1)).all()
+    assert not np.array_equal(md.model.median, median)
+    assert md.cache.misses == 0
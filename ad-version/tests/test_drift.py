@@ -0,0 +1,34 @@
+# ==================================================================================
+#       Copyright (c) 2020 HCL Technologies Limited.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#          http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+# ==================================================================================
+import numpy as np
+from src import drift
+
+
+def test_drift_monitor(bundle_dir):
+    rng = np.random.default_rng(4)
+    train = rng.normal(0, 1, size=(5000, 3))
+    drift.save_stats(train)
+    monitor = drift.DriftMonitor.load('src/feature_stats', alpha=0.05, threshold=2.0, patience=3)
+
+    for _ in range(20):
+        assert not monitor.update(rng.normal(0, 1, size=(50, 3)))
+    assert monitor.score < 1.0
+
+    shifted = [monitor.update(rng.normal([0, 5, 0], 1, size=(50, 3))) for _ in range(3)]
+    assert shifted == [False, False, True]
+    monitor.reset()
+    assert not monitor.due()
+    assert drift.DriftMonitor.load('src/missing') is None
@@ -0,0 +1,43 @@
+# ==================================================================================
+#       Copyright (c) 2020 HCL Technologies Limited.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#          http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+# ==================================================================================
+import os
+import numpy as np
+from sklearn.ensemble import IsolationForest
+from sklearn.preprocessing import Normalizer
+from src import ad_model, model_server
+
+
+def test_shared_model_matches_sklearn_and_follows_generations(ad_features):
+    df, cols = ad_features
+    scale = Normalizer().fit(df[cols])
+    X = scale.transform(df[cols]).astype(np.float32)
+    first = IsolationForest(n_estimators=30, max_samples=0.5, max_features=0.6, contamination=0.1, random_state=4).fit(X)
+    second = IsolationForest(n_estimators=10, random_state=7).fit(X)
+    server = model_server.ModelServer('ad-test-{}'.format(os.getpid()))
+    try:
+        server.publish(first, scale, cols)
+        shared = model_server.SharedModel(server.name)
+        assert shared.refresh() and not shared.refresh()
+        np.testing.assert_allclose(shared.model.score_samples(X), first.score_samples(X), rtol=1e-6)
+        assert (shared.model.predict(X) == first.predict(X)).all()
+        md = ad_model.modelling(shared=shared)
+        assert (md.predict(df) == (first.predict(X) == -1)).all()
+
+        server.publish(second, scale, cols)
+        assert shared.refresh() and shared.generation == 2
+        assert (shared.model.predict(X) == second.predict(X)).all()
+    finally:
+        server.close()
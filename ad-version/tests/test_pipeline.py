@@ -0,0 +1,46 @@
+# ==================================================================================
+#       Copyright (c) 2020 HCL Technologies Limited.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#          http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+# ==================================================================================
+import itertools
+import time
+from src import pipeline
+
+
+def test_pipeline_overlaps_io_and_keeps_order():
+    counter = itertools.count()
+    sent, written = [], []
+
+    def read():
+        time.sleep(0.05)
+        return next(counter)
+
+    def score(tick):
+        time.sleep(0.05)
+        return tick, '[{}]'.format(tick).encode()
+
+    def write(tick):
+        time.sleep(0.05)
+        written.append(tick)
+
+    polls = []
+    pl = pipeline.Pipeline(read, score, write, sent.append, interval=0, queue_size=1, poll=lambda: polls.append(1))
+    start = time.monotonic()
+    pl.run(ticks=10)
+    elapsed = time.monotonic() - start
+    assert written == list(range(10))
+    assert sent == ['[{}]'.format(i).encode() for i in range(10)]
+    assert len(polls) == 10
+    # strictly sequential execution would take 10 * 0.15 s
+    assert elapsed < 1.2
@@ -0,0 +1,67 @@
+# ==================================================================================
+#       Copyright (c) 2020 HCL Technologies Limited.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#          http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+# ==================================================================================
+import os
+import threading
+import time
+from src.profiler import Profiler
+
+
+def busy(seconds):
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        sum(range(1000))
+
+
+def test_profiler_writes_reports(tmp_path):
+    profiler = Profiler(path=str(tmp_path), budget=0.01, interval=0.001)
+    with profiler.tick():
+        busy(0.02)
+    assert os.listdir(tmp_path) == []
+    profiler.control({'profiling': 'on'})
+    with profiler.tick():
+        busy(0.05)
+    profiler.control({'profiling': 'toggle'})
+    assert not profiler.enabled
+    files = os.listdir(tmp_path)
+    for prefix in ['cpu-', 'alloc-', 'slow-']:
+        assert any(f.startswith(prefix) for f in files)
+    folded = [f for f in files if f.startswith('cpu-')][0]
+    assert 'busy' in open(os.path.join(tmp_path, folded)).read()
+
+
+def test_profiler_profiles_one_tick_at_a_time(tmp_path):
+    profiler = Profiler(path=str(tmp_path), budget=0.01, interval=0.001)
+    profiler.enable()
+    inside = threading.Barrier(2)
+
+    def tick(name):
+        with profiler.tick(name):
+            inside.wait()
+            busy(0.05)
+
+    other = threading.Thread(target=tick, args=('slice1',))
+    other.start()
+    tick('ad')
+    other.join()
+    profiled = [f for f in os.listdir(tmp_path) if f.endswith('.prof')]
+    assert len(profiled) == 1
+    # ticks within the same second are written to files of their own
+    for _ in range(2):
+        with profiler.tick('ad'):
+            busy(0.02)
+    profiler.disable()
+    profiled = [f for f in os.listdir(tmp_path) if f.endswith('.prof')]
+    assert len(profiled) == 3 and all(f.startswith(('slow-ad-', 'slow-slice1-')) for f in profiled)
@@ -0,0 +1,52 @@
+# ==================================================================================
+#       Copyright (c) 2020 HCL Technologies Limited.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#          http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+# ==================================================================================
+import pandas as pd
+from src import retention
+
+
+class PointsDB(object):
+    """Timestamps of the points of each measurement, deleted like the delete API does"""
+
+    def __init__(self, points):
+        self.points = points
+        self.deletes = []
+
+    def oldest(self, meas, before):
+        times = [t for t in self.points[meas] if t < before]
+        return min(times) if times else None
+
+    def count_range(self, meas, start, stop):
+        return sum(start <= t < stop for t in self.points[meas])
+
+    def delete_range(self, meas, start, stop):
+        self.deletes.append((meas, start, stop))
+        self.points[meas] = [t for t in self.points[meas] if not start <= t < stop]
+
+
+def test_retention_deletes_in_bounded_chunks():
+    now = pd.Timestamp('2024-01-11T00:00:00Z')
+    db = PointsDB({'UEReports': list(pd.date_range(now - pd.Timedelta('15D'), now, freq='30min')),
+                   'AD': list(pd.date_range(now - pd.Timedelta('2D'), now, freq='30min'))})
+    assert retention.policies('UEReports=10D, AD = 240h') == {'UEReports': pd.Timedelta('10D'), 'AD': pd.Timedelta('240h')}
+    rt = retention.Retention(db, retention.policies('UEReports=10D, AD=240h'), chunk=pd.Timedelta('1D'), max_chunks=3)
+    assert rt.run(now) == {'UEReports': 3 * 48, 'AD': 0}
+    assert len(db.deletes) == 3 and min(db.points['UEReports']) == now - pd.Timedelta('12D')
+    assert rt.run(now) == {'UEReports': 2 * 48, 'AD': 0}
+    assert min(db.points['UEReports']) == now - pd.Timedelta('10D')
+    # once cleared only the newly expired span is deleted
+    assert rt.run(now + pd.Timedelta('1h')) == {'UEReports': 2, 'AD': 0}
+    assert db.deletes[-1][1:] == (now - pd.Timedelta('10D'), now - pd.Timedelta('10D') + pd.Timedelta('1h'))
+    assert len(db.points['AD']) == 97
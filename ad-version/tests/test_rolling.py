@@ -0,0 +1,51 @@
+# ==================================================================================
+#       Copyright (c) 2020 HCL Technologies Limited.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#          http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+# ==================================================================================
+import numpy as np
+import pandas as pd
+from src import ad_model, rolling
+from tests.conftest import HistoryDB
+
+
+def test_rolling_store_matches_brute_force_windows():
+    rng = np.random.default_rng(4)
+    ues = rng.choice(['Car-1', 'Car-2', 'Car-3', 'Car-4'], 300)
+    values = rng.normal(size=(300, 2)).round(1)
+    store = rolling.RollingStore(['a', 'b'], window=5, max_ues=4)
+    stats = np.vstack([store.update(ues[i:i + 30], values[i:i + 30]) for i in range(0, 300, 30)])
+    for i in range(300):
+        window = values[:i + 1][ues[:i + 1] == ues[i]][-5:]
+        expected = np.stack([window.mean(0), window.std(0), window.min(0), window.max(0)], axis=1).ravel()
+        np.testing.assert_allclose(stats[i], expected, atol=1e-9)
+    assert store.columns[:4] == ['a_mean', 'a_std', 'a_min', 'a_max']
+    # a new UE takes the slot of the least recently updated one
+    store.update(['Car-5'], [[1.0, 2.0]])
+    assert len(store) == 4 and 'Car-5' in store.index and ues[-1] in store.index
+    np.testing.assert_allclose(store.get(['Car-5']).to_numpy(), [[1, 0, 1, 1, 2, 0, 2, 2]])
+
+
+def test_cause_uses_rolling_baselines(ad_features):
+    df, cols = ad_features
+    db = HistoryDB(df)
+    store = rolling.RollingStore([db.thpt, db.rsrp, db.rsrq], window=10)
+    store.augment(df, db.ue, assign=False)
+    batch = df.assign(Anomaly=1)
+    cause = ad_model.CAUSE(rolling=store)
+    anomaly, codes = cause.cause(batch, db, 70)
+    assert db.queries == 0
+    recent = store.get(pd.unique(batch[db.ue]))
+    base = recent.reindex(batch[db.ue])[['{}_max'.format(c) for c in (db.thpt, db.rsrp, db.rsrq)]].to_numpy()
+    expected = cause.find(batch[[db.thpt, db.rsrp, db.rsrq]].to_numpy(), base, 70)
+    assert (codes == expected).all() and (codes > 0).any()
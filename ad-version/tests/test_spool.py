@@ -0,0 +1,59 @@
+# ==================================================================================
+#       Copyright (c) 2020 HCL Technologies Limited.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#          http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+# ==================================================================================
+import pytest
+from src import spool
+
+
+def test_spool_replays_in_order_and_keeps_remainder(tmp_path):
+    sp = spool.Spool(str(tmp_path), segment_bytes=64)
+    for i in range(10):
+        sp.append(['AD value={}i {}'.format(i, i)])
+    assert sp.pending()
+
+    written = []
+
+    def flaky(records):
+        if len(written) >= 4:
+            raise ConnectionError("down")
+        written.extend(records)
+
+    with pytest.raises(ConnectionError):
+        sp.replay(flaky, batch_size=2)
+    assert sp.pending()
+    assert sp.replay(written.extend, batch_size=2) == 6
+    assert written == ['AD value={}i {}'.format(i, i) for i in range(10)]
+    assert not sp.pending()
+
+
+def test_spool_size_limit(tmp_path):
+    sp = spool.Spool(str(tmp_path), max_bytes=100, segment_bytes=10)
+    for i in range(50):
+        sp.append('AD value={}i'.format(i))
+    assert sum(len(open(s).read()) for s in sp.segments()) <= 100 + 20
+
+
+def test_circuit_breaker():
+    breaker = spool.CircuitBreaker(failures=2, reset_timeout=0)
+    breaker.failure()
+    assert breaker.allow()
+    breaker.failure()
+    assert breaker.state == breaker.OPEN
+    assert breaker.allow() and breaker.state == breaker.HALF_OPEN
+    breaker.failure()
+    assert breaker.state == breaker.OPEN
+    breaker.allow()
+    breaker.success()
+    assert breaker.state == breaker.CLOSED
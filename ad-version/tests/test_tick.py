@@ -0,0 +1,48 @@
+# ==================================================================================
+#       Copyright (c) 2020 HCL Technologies Limited.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#          http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+# ==================================================================================
+from src import metrics, tick
+
+
+def test_tick_controller_adapts_to_arrivals(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(tick.time, 'monotonic', lambda: now[0])
+    ticker = tick.TickController(interval=0.5, min_interval=0.1, max_interval=4.0, batch_rows=100, alpha=1.0)
+    ticker.arrived(0)
+    for _ in range(5):
+        now[0] += ticker.interval
+        ticker.arrived(0)
+        ticker.next_interval()
+    assert ticker.interval == 4.0
+    # 2000 samples per second fill a batch of 100 in 50 ms, bounded by min_interval
+    now[0] += 1.0
+    ticker.arrived(2000)
+    assert ticker.next_interval() == 0.1
+    # scoring slower than the arrival of a batch widens the interval
+    ticker.processed(0.4)
+    assert abs(ticker.next_interval() - 0.6) < 1e-9
+    assert tick.registry.get('tick.interval') == ticker.interval
+
+
+def test_reporter_sends_the_controller_state(monkeypatch):
+    registry = metrics.Registry()
+    monkeypatch.setattr(tick, 'registry', registry)
+    ticker = tick.TickController(interval=0.5, prefix='tick.slice1')
+    ticker.arrived(10)
+    ticker.next_interval()
+    sent = []
+    metrics.Reporter(registry, send=sent.append).report()
+    items = {name: kind for name, _, kind in sent[0]}
+    assert items['tick.slice1.interval'] == 'gauge' and items['tick.slice1.rows'] == 'counter'